@@ -1,33 +1,22 @@
 import os
-import pandas as pd
 import numpy as np
-import json
-from rapidfuzz import process, fuzz
 import tkinter as tk
 from tkinter import messagebox
+from coordinate_codec import CoordinateCodec
 
 
 # Make sure you have the correct files in the appropriate directories
-# I will not include the directory name.
-os.chdir("YOUR DIRECTORY GOES HERE")
-f = open('launch.json')
-
-f = open('launch.json')
-data = json.load(f)
-
-# Iterating through the json
-# list
-z_coordinate = data['z_coordinate'][0]
-
-trans = {}
-for elm in z_coordinate:
-    save = z_coordinate[elm]
-    trans[save] = elm
-
-z_coordinate = trans
-
-# Closing file
-f.close()
+# I will not include the directory name. main changes into it, so importing
+# this module doesn't touch the disk (or pandas, or rapidfuzz) at all. The z
+# coordinates are made up as needed (see coordinate_codec.py), so there's no
+# launch.json to read anymore.
+#
+# main reads the CSV with ingest.read_inventory, the same way the real backend
+# does. That is NOT the same rows the old pd.read_csv gave this app: the
+# categories that never go on the shelves (0 and 4, see ingest.EXCLUDED) and
+# rows with no category are left out, and a SKU that shows up more than once
+# is only kept the first time. So those products don't show up here anymore.
+DIRECTORY = "YOUR DIRECTORY GOES HERE"
 
 
 # This is the main 'backend' class.
@@ -135,44 +124,32 @@ class UpdatedInventory:
 
         # Two functions to initialize the attributes
         def coordinate_map(tree: dict[str, dict[str, list[str]]]):
-            """The purpose of this function is to initialize the product_map
-            attribute"""
-            result = {}
-            for room in tree:
-                # With each iteration, we should create a new coordinate
-                x = room
-                for category in tree[room]:
-                    y = str(category)
-                    products = tree[room][category]
-                    for i in range(len(products)):
-                        # Recall that product is
-                        z = z_coordinate[i].lower()
-                        coordinate = x + '.' + y + '.' + z
-                        result[coordinate] = products[i]
+            """The purpose of this function is to initialize the coordinate_map
+            and product_map attributes"""
+            # With each room and category, we should create a new coordinate.
+            # The product_map comes out of the same pass.
+            levels = (((room, str(category)), tree[room][category])
+                      for room in tree for category in tree[room])
+            result, self.product_map = codec.build_maps(levels)
             self.coordinate_map = result
 
             # initialize key_maps
             self.products_list = list(self.coordinate_map.values())
             return result
 
-        def product_map(map_ob) -> None:
-            """Literally switch the key-value pairing"""
-            result = {}
-            for elm in map_ob:
-                save = map_ob[elm]
-                result[save] = elm
-            self.product_map = result
-
+        codec = CoordinateCodec()
         structure = categorize_and_rank(df)
-        future = coordinate_map(structure)
-        product_map(future)
+        coordinate_map(structure)
 
-    def fetch(self, search: str) -> str:
-        """Return the coordinate of an item when a name is typed in"""
+    def fetch(self, search: str) -> tuple[str, str]:
+        """Return the name and coordinate of an item when a name is typed in,
+        the same as inventory_documentation.UpdatedInventory and
+        service.RemoteInventory do"""
+        from rapidfuzz import process, fuzz
         result = process.extractOne(search, self.products_list,
                                     scorer=fuzz.WRatio)
         name = result[0]
-        return self.product_map[name]
+        return name, self.product_map[name]
 
 
 class PageController:
@@ -225,8 +202,7 @@ class StartingMenu(tk.Frame):
     def search(self, search_text) -> None:
         """Search a csv file that contains all of our current
         inventory, plus the inventory that is coming in."""
-        coordinate = self.inventory.fetch(search_text)
-        item = self.inventory.coordinate_map[coordinate]
+        item, coordinate = self.inventory.fetch(search_text)
         statement = "{item} is at {loc}.".format(item=item,
                                                  loc=coordinate)
         messagebox.showinfo("Search Result", statement)
@@ -359,8 +335,10 @@ class Backroom(tk.Frame):
 
 
 def main():
-    os.chdir(r"YOUR DIRECTORY GOES HERE")
-    update_inventory = pd.read_csv("update inventory.csv")
+    from ingest import read_inventory
+    os.chdir(DIRECTORY)
+    # Without categories 0 and 4 or repeated SKUs (see the comment at the top)
+    update_inventory = read_inventory("update inventory.csv")
     curr = UpdatedInventory(update_inventory)
     root = tk.Tk()
     controller = PageController(root, curr)
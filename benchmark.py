@@ -0,0 +1,349 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+from inventoryStructure import stable_deconstruct
+from layout import load_layout, compile_layout
+from snapshot import write_snapshot
+
+################################################################################
+# Benchmarks
+#
+# Times every step of getting from a CSV to a working inventory on made up
+# catalogs of different sizes, and saves it all as JSON so two commits can be
+# compared:
+#
+#   python benchmark.py --out before.json
+#   (change something)
+#   python benchmark.py --out after.json --compare before.json
+#
+# Every stage is run twice: once to time it, and once under tracemalloc to get
+# its peak memory (tracemalloc slows everything down, so the times come from the
+# first run). Nothing here needs Qt or Tk. The stages that need UpdatedInventory
+# (making one, coordinate_map_build, fetch and item_to_loc) are skipped, with
+# the reason written down, if inventory_documentation can't be imported here.
+#
+# Then there's the cold start (see startup): a brand new python that imports
+# the backend, loads the store from a snapshot and searches once, which is what
+# the app does before anybody can use it. Its stages are import, load_snapshot,
+# first_search and time_to_first_search (all of it, starting the interpreter
+# included). They're timed once, with no memory.
+################################################################################
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+# Made up names that hit every rule in layout.json
+BRANDS = ["Area 51", "Good Supply", "Jean Guy", "Pink Kush", "Soft Chew Co",
+          "Gummy Bears", "Pax Era", "Infused Co", "Chocolate Bar", "CBD Calm",
+          "Disposable Pen", "Color Cannabis", "Back Forty", "Spinach"]
+FLOWER = ["3.5g", "7g", "14g", "28g", "1g"]
+PREROLLS = ["_1x", "_2x", "_3x", "_5x", "_10x"]
+CARTS = ["0.5g", "1g", "0.95g"]
+
+
+def synthetic_catalog(n: int, seed: int = 0) -> pd.DataFrame:
+    """Return a made up inventory of n products with the same columns the real
+    CSV has (Product Name, SKU, Category Code, Rank and Retail price).
+    Categories 0 and 4 are left out, just like main() filters them out."""
+    rng = np.random.default_rng(seed)
+    categories = rng.choice([1, 2, 3, 5], size=n, p=[.4, .2, .2, .2])
+    brands = rng.choice(BRANDS, size=n)
+    pick = rng.integers(0, 5, size=n)
+    names = []
+    skus = []
+    for i in range(n):
+        category = categories[i]
+        if category == 1:
+            size = FLOWER[pick[i]]
+            names.append(f"{brands[i]} {size} #{i}")
+            skus.append(f"FL-{size}-{i}")
+        elif category == 5:
+            count = PREROLLS[pick[i]]
+            names.append(f"{brands[i]} Preroll{count} #{i}")
+            skus.append(f"PR{count}-{i}")
+        elif category == 3:
+            size = CARTS[pick[i] % 3]
+            names.append(f"{brands[i]} Cart {size} #{i}")
+            skus.append(f"EX-{size}-{i}")
+        else:
+            names.append(f"{brands[i]} Edible #{i}")
+            skus.append(f"ED-{i}")
+    return pd.DataFrame({"Product Name": names,
+                         "SKU": skus,
+                         "Category Code": categories,
+                         "Rank": rng.permutation(n) + 1,
+                         "Retail price": rng.uniform(5, 300, n).round(2)})
+
+
+def _backend():
+    """Return the inventory_documentation module, or the reason it can't be
+    imported here."""
+    try:
+        import inventory_documentation
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    return inventory_documentation, None
+
+
+def _stages(df: pd.DataFrame, queries: int, moves: int, seed: int,
+            state: dict = None):
+    """Yield (stage name, function) for every stage, in order. Each function
+    runs one stage on whatever the stages before it made (which goes in state),
+    and returns how many times it did its thing (so fetch and item_to_loc can
+    be reported per call)."""
+    plan = compile_layout(load_layout())
+    if state is None:
+        state = {}
+
+    def build():
+        state["atom"] = plan.split(df)
+        return 1
+
+    def deconstruct():
+        state["atom"].traverse_and_apply(stable_deconstruct)
+        plan.link(state["atom"])
+        return 1
+
+    def bijection():
+        state["tree"] = state["atom"].bijection()
+        return 1
+
+    yield "build", build
+    yield "stable_deconstruct", deconstruct
+    yield "bijection", bijection
+
+    documentation, reason = _backend()
+    if documentation is None:
+        for stage in ["UpdatedInventory", "coordinate_map_build", "fetch",
+                      "item_to_loc"]:
+            yield stage, reason
+        return
+
+    def backend():
+        # Build from the tree, not from whatever storage is lying around
+        documentation.obj = {}
+        state["inventory"] = documentation.UpdatedInventory(state["atom"])
+        return 1
+
+    def coordinate_map_build():
+        inventory = state["inventory"]
+        inventory.product_map_build(inventory.coordinate_map_build(
+            inventory.tree))
+        return 1
+
+    def fetch():
+        inventory = state["inventory"]
+        rnd = random.Random(seed)
+        names = list(inventory.product_map)
+        for i in range(queries):
+            name = rnd.choice(names)
+            inventory.fetch(name[:rnd.randint(3, len(name))])
+        return queries
+
+    def item_to_loc():
+        inventory = state["inventory"]
+        room, x, y = sorted(inventory.cycles)[-1]
+        items = list(inventory.tree[room][x][y][:moves])
+        for item in items:
+            inventory.item_to_loc(item, "B" if room == "F" else "F")
+        return max(len(items), 1)
+
+    yield "UpdatedInventory", backend
+    yield "coordinate_map_build", coordinate_map_build
+    yield "fetch", fetch
+    yield "item_to_loc", item_to_loc
+
+
+def run(n: int, seed: int = 0, queries: int = 100, moves: int = 50,
+        memory: bool = True, cold: bool = True) -> dict:
+    """Return the results of every stage on a catalog of n products (and of
+    the cold start, if cold is True). A stage gets seconds (total), per_call,
+    and peak_bytes (if memory is True), or 'skipped' / 'error' with the
+    reason."""
+    df = synthetic_catalog(n, seed)
+    result = {}
+    broken = None
+    state = {}
+    for stage, function in _stages(df, queries, moves, seed, state):
+        if isinstance(function, str):
+            result[stage] = {"skipped": function}
+        elif broken is not None:
+            result[stage] = {"skipped": "needs " + broken}
+        else:
+            try:
+                start = time.perf_counter()
+                calls = function()
+                seconds = time.perf_counter() - start
+                result[stage] = {"seconds": seconds,
+                                 "per_call": seconds / calls}
+            except Exception as e:
+                result[stage] = {"error": f"{type(e).__name__}: {e}"}
+                broken = stage
+    if memory:
+        # The same thing again, just for the memory
+        tracemalloc.start()
+        try:
+            for stage, function in _stages(df, queries, moves, seed):
+                if "seconds" not in result[stage]:
+                    continue
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                function()
+                result[stage]["peak_bytes"] = \
+                    tracemalloc.get_traced_memory()[1] - base
+        finally:
+            tracemalloc.stop()
+    if cold:
+        result.update(startup(state.get("tree")))
+    return result
+
+
+# What a cold start does (see startup), run with python -c. It prints the time
+# (time.time, so the parent can tell how long it took since it started the
+# process) after each step as the last line.
+STARTUP = """
+import sys, time, json
+marks = [time.time()]
+sys.path.insert(0, sys.argv[1])
+import inventory_documentation
+from snapshot import Snapshot
+marks.append(time.time())
+inventory = inventory_documentation.UpdatedInventory(
+    None, storage=Snapshot(sys.argv[2]))
+marks.append(time.time())
+inventory.fetch(sys.argv[3])
+marks.append(time.time())
+print(json.dumps(marks))
+"""
+
+
+def startup(tree: dict) -> dict:
+    """Return the cold start stages (see the comment at the top) of a store
+    with a snapshot of tree, or why they were skipped."""
+    stages = ["import", "load_snapshot", "first_search",
+              "time_to_first_search"]
+    documentation, reason = _backend()
+    if documentation is None or tree is None:
+        return {stage: {"skipped": reason or "needs bijection"}
+                for stage in stages}
+    query = next((products[0][:8] for room in tree for x in tree[room]
+                  for products in tree[room][x].values() if products), "")
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "storage.snap")
+        try:
+            write_snapshot(path, tree)
+            start = time.time()
+            out = subprocess.run(
+                [sys.executable, "-c", STARTUP,
+                 os.path.dirname(os.path.abspath(__file__)), path, query],
+                capture_output=True, text=True, check=True).stdout
+        except (OSError, subprocess.CalledProcessError) as e:
+            reason = getattr(e, "stderr", None) or str(e)
+            reason = reason.strip().splitlines()[-1]
+            return {stage: {"error": reason} for stage in stages}
+    marks = [start] + json.loads(out.strip().splitlines()[-1])
+    # Between the first two marks is python starting up, which only counts
+    # towards the total
+    seconds = [marks[2] - marks[1], marks[3] - marks[2], marks[4] - marks[3],
+               marks[4] - marks[0]]
+    return {stage: {"seconds": elm, "per_call": elm}
+            for stage, elm in zip(stages, seconds)}
+
+
+def _commit() -> str | None:
+    """Return the commit the code is at, if this is a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(sizes: list[int] = SIZES, seed: int = 0, queries: int = 100,
+              moves: int = 50, memory: bool = True,
+              cold: bool = True) -> dict:
+    """Return the results of run for every size, with where they came from."""
+    results = {"commit": _commit(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "pandas": pd.__version__,
+               "numpy": np.__version__,
+               "seed": seed,
+               "sizes": {}}
+    # Warm up (imports, caches) so the first size isn't paying for them
+    run(min(sizes), seed, queries, moves, False, False)
+    for n in sizes:
+        print(f"{n} rows...", file=sys.stderr)
+        results["sizes"][str(n)] = run(n, seed, queries, moves, memory,
+                                       cold)
+    return results
+
+
+def compare(old: dict, new: dict) -> list[str]:
+    """Return a line for every stage that both results timed, with how much
+    slower (> 1) or faster (< 1) new is."""
+    lines = []
+    for n in new["sizes"]:
+        for stage in new["sizes"][n]:
+            before = old["sizes"].get(n, {}).get(stage, {})
+            after = new["sizes"][n][stage]
+            if "per_call" in before and "per_call" in after:
+                ratio = after["per_call"] / max(before["per_call"], 1e-12)
+                line = f"{n:>8} {stage:<22} {ratio:6.2f}x time"
+                if "peak_bytes" in before and "peak_bytes" in after:
+                    line += f" {after['peak_bytes'] / max(before['peak_bytes'], 1):6.2f}x memory"
+                lines.append(line)
+    return lines
+
+
+def report(results: dict) -> list[str]:
+    """Return a line per size and stage to print."""
+    lines = []
+    for n in results["sizes"]:
+        for stage, result in results["sizes"][n].items():
+            if "per_call" in result:
+                line = f"{n:>8} {stage:<22} {result['per_call'] * 1000:10.3f} ms"
+                if "peak_bytes" in result:
+                    line += f" {result['peak_bytes'] / 2 ** 20:10.1f} MB"
+            else:
+                line = f"{n:>8} {stage:<22} " + \
+                    next(iter(result)) + ": " + next(iter(result.values()))
+            lines.append(line)
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the layout build, "
+                                                 "search and move paths.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=100,
+                        help="how many fetches to time")
+    parser.add_argument("--moves", type=int, default=50,
+                        help="how many item_to_locs to time")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the (slow) tracemalloc pass")
+    parser.add_argument("--no-startup", action="store_true",
+                        help="skip the cold start (import, load a snapshot "
+                             "and search once in a new python)")
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--compare", help="an older results file")
+    args = parser.parse_args()
+    results = benchmark(args.sizes, args.seed, args.queries, args.moves,
+                        not args.no_memory, not args.no_startup)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=4)
+    print("\n".join(report(results)))
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(json.load(f), results)))
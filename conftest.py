@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+import inventoryStructure as structure
+
+################################################################################
+# What the tests share. make_frame makes a made-up POS export (only the
+# categories that go on the shelves, like ingest.read_inventory gives back),
+# and hand_built is the store the way the old __main__ blocks built it, one
+# atom.nuke at a time, for the tests to check the new code against.
+################################################################################
+
+BRANDS = ["Area 51", "Good Supply", "Jean Guy", "Pink Kush", "Soft Chew Co",
+          "Pax Era", "Infused Co", "CBD Calm"]
+
+
+def frame(n: int, seed: int = 0, prefix: str = "") -> pd.DataFrame:
+    """Return n made-up rows with every column the layout looks at. prefix
+    goes in front of every SKU and product name, so two frames with different
+    ones don't share any products."""
+    rng = np.random.default_rng(seed)
+    categories = rng.choice([1, 2, 3, 5], size=n, p=[.4, .2, .2, .2])
+    names = []
+    skus = []
+    for i, category in enumerate(categories):
+        brand = BRANDS[rng.integers(len(BRANDS))]
+        if category == 1:
+            weight = rng.choice(["3.5g", "7g", "14g", "28g", "1g"])
+            names.append(f"{brand} {weight} #{i}")
+            skus.append(f"FL-{weight}-{i}")
+        elif category == 5:
+            pack = rng.choice(["_1x", "_2x", "_3x", "_5x", "_10x"])
+            names.append(f"{brand} Preroll{pack} #{i}")
+            skus.append(f"PR{pack}-{i}")
+        elif category == 3:
+            weight = rng.choice(["0.5g", "1g", "0.95g"])
+            names.append(f"{brand} Cart {weight} #{i}")
+            skus.append(f"EX-{i}")
+        else:
+            names.append(f"{brand} Item #{i}")
+            skus.append(f"X-{i}")
+    return pd.DataFrame({"Product Name": [prefix + name for name in names],
+                         "SKU": [prefix + sku for sku in skus],
+                         "Category Code": categories,
+                         "Rank": rng.permutation(n) + 1,
+                         "Retail price": rng.uniform(5, 300, n).round(2)})
+
+
+def hand_built(df: pd.DataFrame) -> structure.AtomicTree:
+    """Return the store built out of df with the hand-chained nukes that
+    layout.json replaced, sorted lists and all."""
+    atom = structure.AtomicTree("***Main", "Rank", df, main=True, find=[None])
+    atom.nuke(2, **structure.front_and_back)
+    curr = atom.subtrees[0]
+    curr.nuke(4, **structure.front_flower)
+    curr = curr.subtrees[0]
+    curr.nuke(3, **structure.front_half_quarter)
+    curr = curr.parent.subtrees[5]
+    curr.nuke(5, **structure.front_prerolls)
+    curr = curr.subtrees[4]
+    curr.nuke(3, **structure.front_edibles)
+    curr = curr.subtrees[2]
+    curr.nuke(2, **structure.front_extracts)
+    curr = curr.subtrees[1]
+    curr.nuke(2, **structure.front_carts)
+    curr = atom.subtrees[1]
+    curr.nuke(3, **structure.back_flower)
+    curr = curr.subtrees[2]
+    curr.nuke(3, **structure.back_prerolls)
+    curr = curr.subtrees[2]
+    curr.nuke(2, **structure.back_carts)
+    curr = curr.subtrees[1]
+    curr.nuke(2, **structure.back_edibles)
+    atom.traverse_and_apply(structure.stable_deconstruct)
+    return atom
+
+
+@pytest.fixture
+def make_frame():
+    return frame
+
+
+@pytest.fixture
+def build_by_hand():
+    return hand_built
+
+
+@pytest.fixture
+def store(make_frame):
+    """A 3000 row store, the same one every time."""
+    return make_frame(3000)
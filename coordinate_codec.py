@@ -0,0 +1,245 @@
+import threading
+import numpy as np
+
+################################################################################
+# Packed coordinates
+#
+# A coordinate like "F.1.2.c" is really two things: the level it's on
+# ("F", "1", "2") and the slot on that level (the 3rd product, which is "c").
+# Building every coordinate by gluing room + '.' + x + '.' + y + '.' + z
+# together (and looking up and lowercasing z every single time) makes a pile of
+# throwaway strings for every product. A CoordinateCodec gives every level a
+# small number and its "F.1.2." prefix ONCE, so a coordinate packs into one int:
+#
+#   packed = level << SLOT_BITS | slot
+#
+# and formatting one is a single prefix + z. build_maps makes coordinate_map
+# and product_map together in one pass over the tree instead of building one
+# and then flipping it around.
+#
+# The z labels used to be a table in data.json, and a level with more products
+# than the table had rows blew up. Now they're just counting in bijective base
+# 26: a, b, ..., z, aa, ab, ..., zz, aaa, ... (the same thing the table had),
+# which never runs out. They're made with numpy a whole block at a time (see
+# slot_labels) and kept, and the table only ever grows to the longest level
+# that has been seen. Going back from a label to its slot is a bit of math
+# (see slot_index), not a lookup.
+################################################################################
+
+# 2 ** 20 products per level is way more than any shelf will ever see
+SLOT_BITS = 20
+SLOT_MASK = (1 << SLOT_BITS) - 1
+
+# Every z label made so far, as a numpy array and as a list of str (gluing a
+# prefix onto a list of str is ~10x faster than numpy's string add). They're
+# only ever swapped for longer ones, never changed in place, so anything that
+# read them before a swap still has labels that are right
+_LABELS = np.array([], "U1")
+_LABEL_LIST = []
+
+# Held while the table grows, since the compactor's thread and a move can both
+# want more labels at once
+_GROWING = threading.Lock()
+
+
+def _make_labels(start: int, stop: int) -> np.ndarray:
+    """Return the z labels of slots start up to stop.
+    >>> _make_labels(24, 29).tolist()
+    ['y', 'z', 'aa', 'ab', 'ac']
+    """
+    pieces = []
+    width = 1
+    # The labels with width letters are the slots first to first + 26 ** width
+    first = 0
+    while first < stop:
+        count = 26 ** width
+        low, high = max(start, first), min(stop, first + count)
+        if low < high:
+            digits = np.arange(low - first, high - first)[:, None] // \
+                26 ** np.arange(width - 1, -1, -1) % 26
+            letters = (digits + ord("a")).astype(np.uint8)
+            pieces.append(letters.view("S" + str(width)).ravel()
+                          .astype("U" + str(width)))
+        first += count
+        width += 1
+    if not pieces:
+        return np.array([], "U1")
+    return np.concatenate(pieces)
+
+
+def slot_labels(n: int) -> np.ndarray:
+    """Return the z labels of the first n slots (which is a view of the
+    table, so don't change it). The table is doubled whenever it's too short.
+    >>> slot_labels(3).tolist()
+    ['a', 'b', 'c']
+    """
+    global _LABELS, _LABEL_LIST
+    if n > len(_LABELS):
+        with _GROWING:
+            # Somebody else could have grown it while we waited
+            if n > len(_LABELS):
+                more = _make_labels(len(_LABELS),
+                                    max(n, 2 * len(_LABELS), 64))
+                # The list first, so whoever sees the longer array (see
+                # CoordinateCodec.coordinates) sees the longer list too
+                _LABEL_LIST = _LABEL_LIST + more.tolist()
+                _LABELS = np.concatenate([_LABELS, more])
+    return _LABELS[:n]
+
+
+def slot_label(slot: int) -> str:
+    """Return the z label of slot.
+    >>> slot_label(0), slot_label(25), slot_label(26), slot_label(702)
+    ('a', 'z', 'aa', 'aaa')
+    """
+    if slot >= len(_LABEL_LIST):
+        slot_labels(slot + 1)
+    return _LABEL_LIST[slot]
+
+
+def slot_index(label: str) -> int:
+    """Return the slot of a z label. Raise a KeyError if it isn't one.
+    >>> slot_index("a"), slot_index("z"), slot_index("aa"), slot_index("aaa")
+    (0, 25, 26, 702)
+    """
+    if not label:
+        raise KeyError(label)
+    result = 0
+    for c in label:
+        if not "a" <= c <= "z":
+            raise KeyError(label)
+        result = result * 26 + ord(c) - ord("a") + 1
+    return result - 1
+
+
+class CoordinateCodec:
+    """Packs coordinates into ints and back.
+    ============================================================================
+    Attributes |
+    ===========
+    _levels: A list of every level (a tuple of its labels, like
+             ("F", "1", "2")) that has been seen, in the order they were seen.
+
+    _numbers: A dict object with "F.1.2" pointing to the number of that level.
+
+    _prefixes: A list with the "F.1.2." prefix of every level.
+    """
+    __slots__ = ["_levels", "_numbers", "_prefixes"]
+
+    def __init__(self) -> None:
+        self._levels = []
+        self._numbers = {}
+        self._prefixes = []
+
+    def level(self, parts: tuple[str, ...]) -> int:
+        """Return the number of the level with these labels, giving it a new
+        one if it's never been seen before.
+        >>> codec = CoordinateCodec()
+        >>> codec.level(("F", "1", "2")), codec.level(("B", "3", "1"))
+        (0, 1)
+        >>> codec.level(("F", "1", "2"))
+        0
+        """
+        key = '.'.join(parts)
+        number = self._numbers.get(key)
+        if number is None:
+            number = len(self._levels)
+            self._numbers[key] = number
+            self._levels.append(tuple(parts))
+            self._prefixes.append(key + '.')
+        return number
+
+    def pack(self, level: int, slot: int) -> int:
+        """Return the packed coordinate of slot on level. Raise a ValueError
+        if slot doesn't fit in SLOT_BITS (it would run into the level).
+        >>> CoordinateCodec().pack(0, 1 << SLOT_BITS)
+        Traceback (most recent call last):
+        ...
+        ValueError: Slot 1048576 doesn't fit in 20 bits
+        """
+        if not 0 <= slot <= SLOT_MASK:
+            raise ValueError(_too_big(slot))
+        return level << SLOT_BITS | slot
+
+    def unpack(self, packed: int) -> tuple[int, int]:
+        """Return the (level, slot) of a packed coordinate."""
+        return packed >> SLOT_BITS, packed & SLOT_MASK
+
+    def prefix(self, level: int) -> str:
+        """Return the "F.1.2." in front of every coordinate on level."""
+        return self._prefixes[level]
+
+    def format(self, packed: int) -> str:
+        """Return the coordinate string of a packed coordinate.
+        >>> codec = CoordinateCodec()
+        >>> codec.format(codec.pack(codec.level(("F", "1", "2")), 2))
+        'F.1.2.c'
+        """
+        return self._prefixes[packed >> SLOT_BITS] + \
+            slot_label(packed & SLOT_MASK)
+
+    def coordinates(self, level: int, start: int, stop: int) -> list[str]:
+        """Return the coordinate strings of slots start up to stop of level,
+        all at once.
+        >>> codec = CoordinateCodec()
+        >>> codec.coordinates(codec.level(("F", "1", "2")), 25, 28)
+        ['F.1.2.z', 'F.1.2.aa', 'F.1.2.ab']
+
+        Raise a ValueError if a slot doesn't fit in SLOT_BITS, like pack.
+        """
+        if stop > SLOT_MASK + 1:
+            raise ValueError(_too_big(stop - 1))
+        slot_labels(stop)
+        return list(map(self._prefixes[level].__add__,
+                        _LABEL_LIST[start:stop]))
+
+    def parse(self, coordinate: str) -> int:
+        """Return the packed coordinate of a coordinate string. Raise a
+        KeyError if its level has never been seen or its z label isn't one.
+        >>> codec = CoordinateCodec()
+        >>> codec.level(("F", "1", "2"))
+        0
+        >>> codec.unpack(codec.parse("F.1.2.b"))
+        (0, 1)
+        """
+        key, _, z = coordinate.rpartition('.')
+        slot = slot_index(z)
+        if slot > SLOT_MASK:
+            raise KeyError(coordinate)
+        return self._numbers[key] << SLOT_BITS | slot
+
+    def address(self, coordinate: str) -> tuple[str, ...]:
+        """Return the labels of the level a coordinate string is on, like
+        ("F", "1", "2") for "F.1.2.c"."""
+        number = self._numbers.get(coordinate.rpartition('.')[0])
+        if number is None:
+            return tuple(coordinate.split('.')[:-1])
+        return self._levels[number]
+
+    def build_maps(self, levels) -> tuple[dict[str, str], dict[str, str]]:
+        """Return (coordinate_map, product_map) of levels, which is anything
+        that gives back (labels of the level, list of products) pairs (see
+        tree_levels). Both maps come out of the same pass, a whole level at a
+        time, and a product on more than one level ends up at the last one,
+        same as flipping coordinate_map around would."""
+        coordinate_map = {}
+        product_map = {}
+        for parts, products in levels:
+            coordinates = self.coordinates(self.level(parts), 0,
+                                           len(products))
+            coordinate_map.update(zip(coordinates, products))
+            product_map.update(zip(products, coordinates))
+        return coordinate_map, product_map
+
+
+def _too_big(slot: int) -> str:
+    return "Slot " + str(slot) + " doesn't fit in " + str(SLOT_BITS) + " bits"
+
+
+def tree_levels(tree: dict):
+    """Yield ((room, x, y), products) for every level of a room -> shelf ->
+    level -> products tree, in order."""
+    for room in tree:
+        for x in tree[room]:
+            for y in tree[room][x]:
+                yield (room, x, y), tree[room][x][y]
@@ -0,0 +1,115 @@
+import sys
+import numpy as np
+import pandas as pd
+from layout import LayoutError, load_layout, compile_layout
+
+################################################################################
+# Streaming CSV ingest
+#
+# The POS export has every SKU the store has ever had, and every column the POS
+# knows about, so it's hundreds of MB. It used to be read whole with
+# pd.read_csv, and only then were categories 0 and 4 thrown out. Now it's read
+# a chunk at a time:
+#
+#   1. Only the columns the layout looks at (plus SKU) are read, and with the
+#      dtypes in DTYPES, so pandas doesn't guess (and guess differently from one
+#      chunk to the next).
+#   2. The rows of EXCLUDED categories (and rows with no category, which no tree
+#      would ever get anyway) are dropped right away.
+#   3. Every SKU is kept only the first time it shows up. The SKUs seen so far
+#      are a set, so a duplicate two chunks apart is still caught.
+#
+# So at any one time there's one chunk of the file in memory plus the rows that
+# were kept, never the whole file. What comes out has the same rows the old
+# read_csv, filter and drop_duplicates("SKU") made, minus the columns nobody
+# looks at.
+#
+# Then the frame gets normalized ONCE (see normalize), into the dtypes the trees
+# work best with. Every tree of a shared build uses the root's columns as they
+# are, so nothing gets converted again further down:
+#
+#   - "Category Code" is categorical, so every category comparison and groupby
+#     is over small int codes instead of a column of int64s.
+#   - Rank is the smallest int that fits (if none of them are missing) and
+#     Retail price is a float32.
+#   - Every string (product names, SKUs) is interned, so a name that shows up
+#     more than once is one object, and the same name in the tree, the maps and
+#     the search index is the same object too.
+################################################################################
+
+# Categories that never go on the shelves
+EXCLUDED = (0, 4)
+
+# How many rows of the CSV to read at a time
+CHUNK_SIZE = 100_000
+
+# What every column is read as (anything else is read as a string). Numbers
+# are read as floats so a missing one doesn't blow up the chunk
+DTYPES = {"Product Name": str, "SKU": str, "Category Code": "float64",
+          "Rank": "float64", "Retail price": "float64",
+          "Footprint": "float64", "Quantity": "float64"}
+
+# The ones that become ints if none of them are missing, and the ones that
+# become float32s (see normalize)
+INTEGERS = ["Rank"]
+FLOATS = ["Retail price", "Footprint", "Quantity"]
+
+
+def read_inventory(path: str, plan=None, chunk_size: int = CHUNK_SIZE,
+                   excluded: tuple = EXCLUDED) -> pd.DataFrame:
+    """Return the rows of the CSV at path that go on the shelves (see the
+    comment at the top), with only the columns that plan (the layout's
+    LayoutPlan, if not given) needs. Raise a LayoutError if the CSV is missing
+    one of them."""
+    if plan is None:
+        plan = compile_layout(load_layout())
+    header = pd.read_csv(path, nrows=0).columns
+    columns = [column for column in header
+               if column in plan.columns or column == "SKU"]
+    missing = (plan.columns | {"SKU"}) - set(columns)
+    if missing:
+        raise LayoutError("Missing columns " + str(sorted(missing)))
+    dtypes = {column: DTYPES.get(column, str) for column in columns}
+    pieces = []
+    seen = set()
+    for chunk in pd.read_csv(path, usecols=columns, dtype=dtypes,
+                             chunksize=chunk_size):
+        codes = chunk["Category Code"]
+        chunk = chunk[codes.notna() & ~codes.isin(excluded)] \
+            .astype({"Category Code": np.int64})
+        chunk = chunk.drop_duplicates("SKU")
+        # None instead of NaN, since two NaNs are never the same set member
+        skus = chunk["SKU"].astype(object).where(chunk["SKU"].notna(), None)
+        new = np.fromiter((sku not in seen for sku in skus), dtype=bool,
+                          count=len(skus))
+        seen.update(skus)
+        pieces.append(chunk[new])
+    if not pieces:
+        # An empty CSV
+        pieces.append(pd.DataFrame(
+            {column: pd.Series(dtype=dtypes[column]) for column in columns})
+            .astype({"Category Code": np.int64}))
+    return normalize(pd.concat(pieces, ignore_index=True))
+
+
+def normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """Return a copy of df in the dtypes the trees work best with (see the
+    comment at the top). A column that's already been normalized is left as
+    is."""
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            pass
+        elif column == "Category Code":
+            values = values.astype("category")
+        elif column in INTEGERS and values.notna().all():
+            values = pd.to_numeric(values, downcast="integer")
+        elif column in FLOATS:
+            values = values.astype(np.float32)
+        elif values.dtype == object:
+            values = pd.Series([sys.intern(elm) if type(elm) is str else elm
+                                for elm in values], index=values.index,
+                               dtype=object)
+        columns[column] = values
+    return pd.DataFrame(columns, index=df.index)
@@ -2,7 +2,10 @@ import pandas as pd
 import numpy as np
 import doctest
 import os
-import regex as re
+import re
+import threading
+from bisect import bisect_left, insort
+from packing import capacity_split
 
 # Make our split dictionaries
 # ###########################
@@ -153,13 +156,27 @@ class Node:
 
         Returns: None
         """
-        if product_name not in self.tree.sorted_list:
+        # Both lists are always sorted, so a binary search finds the spot
+        # instead of remove() scanning and sort() redoing the whole list
+        if not remove_sorted(self.tree.sorted_list, product_name):
             raise ValueError
         else:
-            self.tree.sorted_list.remove(product_name)
             curr = self.tree.node.next
-            curr.tree.sorted_list.append(product_name)
-            curr.tree.sorted_list.sort()
+            insort(curr.tree.sorted_list, product_name)
+
+    def move_items(self, product_names: list[str]) -> None:
+        """Move every product in product_names to the next tree at once. The
+        batch is sorted and then merged into the next tree's sorted_list in one
+        pass, instead of one insort (and one shift of the list) per product.
+
+        Raise a ValueError (without moving anything) if any of them aren't in
+        self.tree.sorted_list.
+
+        Note that both sorted_lists are changed in place, since they're the
+        same lists that the inventory's nested dict holds.
+        """
+        move_sorted(self.tree.sorted_list, self.next.tree.sorted_list,
+                    product_names)
 
 class LinkedCycle:
     """I'm thinking we first make LinkedLists for all the possible connections
@@ -213,62 +230,220 @@ class LinkedCycle:
 def stable_deconstruct(curr) -> None:
     """Update the self.sorted_list list. Ideally, after the trees are built,
     it snags the list and creates a separate list."""
-    result = list(curr._dataframe["Product Name"])
+    result = list(curr.column("Product Name"))
     result.sort()
     curr.sorted_list.extend(result)
 
 
-def dictionary_build(curr) -> dict[dict[list[str]]]:
-    """Return a nested dictionary for each leaf."""
-    result = {}
-    temp = {curr.coordinate[0]: {curr.coordinate[2]: curr.sorted_list}}
+def remove_sorted(products: list[str], name: str) -> bool:
+    """Remove name from the sorted list products with a binary search. Return
+    True iff it was in there."""
+    i = bisect_left(products, name)
+    if i < len(products) and products[i] == name:
+        del products[i]
+        return True
+    return False
+
+
+def move_sorted(source: list[str], target: list[str],
+                names: list[str]) -> None:
+    """Move names from the sorted list source to the sorted list target, in
+    place. One name is a binary search each way; a batch is sorted and merged
+    into target in one pass. Raise a ValueError (without moving anything) if
+    any of them aren't in source."""
+    if len(names) == 1:
+        if not remove_sorted(source, names[0]):
+            raise ValueError(names[0])
+        insort(target, names[0])
+        return
+    batch = sorted(names)
+    # Count how many of each name is moving, so a name that's in the list
+    # twice only loses as many copies as asked for
+    moving = {}
+    for name in batch:
+        moving[name] = moving.get(name, 0) + 1
+    for name in moving:
+        i = bisect_left(source, name)
+        if source[i:i + moving[name]] != [name] * moving[name]:
+            raise ValueError(name)
+    kept = []
+    for name in source:
+        if moving.get(name, 0) > 0:
+            moving[name] -= 1
+        else:
+            kept.append(name)
+    source[:] = kept
+    target[:] = merge_sorted(target, batch)
+
+
+def merge_sorted(list1: list[str], list2: list[str]) -> list[str]:
+    """Return the sorted merge of two sorted lists, in one pass.
+    >>> merge_sorted(["a", "c", "e"], ["b", "c", "f"])
+    ['a', 'b', 'c', 'c', 'e', 'f']
+    """
+    result = []
+    i = j = 0
+    while i < len(list1) and j < len(list2):
+        if list2[j] < list1[i]:
+            result.append(list2[j])
+            j += 1
+        else:
+            result.append(list1[i])
+            i += 1
+    result.extend(list1[i:])
+    result.extend(list2[j:])
+    return result
+
+
+def leaf_address(curr) -> tuple[str, str, str]:
+    """Return the (room, x, y) of a leaf, which is where its sorted_list ends
+    up in the nested dictionary."""
+    x, y = curr.coordinate[0], curr.coordinate[2]
     # I want to basically climb until I get to the top
     curr = curr.parent
     while not curr._stable:
         curr = curr.parent
-    result[curr.coordinate] = temp
-    return result
+    return curr.coordinate, x, y
 
-# Main dictionary creating function
-def update_dict(dict1, dict2):
-    for key, value2 in dict2.items():
-        if key not in dict1:
-            # If the key is not in dict1, add it along with its value
-            dict1[key] = value2
-        else:
-            # If the key is in dict1, and both values are dictionaries, recursively merge them
-            if isinstance(dict1[key], dict) and isinstance(value2, dict):
-                update_dict(dict1[key], value2)
+
+class CategoryGroups:
+    """One groupby of the "Category Code" column of the ROOT dataframe, shared
+    by every split in the tree. Without it, every single node re-compares the
+    whole "Category Code" column to the category it wants.
+
+    Pre-condition: The root dataframe has a plain 0, 1, 2, ... index (so the
+                   index of every row in every node is its position in the
+                   root). Every split keeps the index, so this stays true.
+    ============================================================================
+    Attributes |
+    ===========
+    codes: A numpy array with the group number of every row of the root.
+
+    numbers: A dict object with a category pointing to its group number.
+
+    indices: A dict object with a category pointing to the positions of its
+             rows in the root.
+    """
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        grouped = df.groupby("Category Code", sort=False, observed=True)
+        self.codes = grouped.ngroup().to_numpy()
+        self.indices = grouped.indices
+        self.numbers = {}
+        for category, positions in self.indices.items():
+            self.numbers[category] = self.codes[positions[0]]
+
+    def mask(self, df: pd.DataFrame, category: int) -> np.ndarray:
+        """Return a boolean array that is True for the rows of df that are in
+        category. df must be a piece of the root dataframe."""
+        if category not in self.numbers:
+            return np.zeros(len(df), dtype=bool)
+        return self.codes[df.index.to_numpy()] == self.numbers[category]
 
 
 # Main sorting_algorithm
 def sorting_algorithm(df: pd.DataFrame, category: int, column: str, n: int,
-                      find=None) -> list[pd.DataFrame]:
-    """Return a list of dataframes that is valid.
+                      find=None, groups=None, capacity=None,
+                      footprint=None) -> list[pd.DataFrame]:
+    """Return a list of dataframes that is valid. If groups (a CategoryGroups
+    of the root dataframe) is given, it is used to find the category instead of
+    going through the "Category Code" column again. capacity and footprint go
+    to sorting_split.
     """
-    temp = df[df["Category Code"] == category]
+    if groups is None:
+        in_category = (df["Category Code"] == category).to_numpy()
+    else:
+        in_category = groups.mask(df, category)
+    temp = df[in_category]
     # THIS REMAINDER IS THE CATEGORY REMAINDER. IT'S A WHOLE WORLD BIGGER THAN
     # THE MORE RELEVANT 'LOCAL' REMAINDER.
-    remainder = df[df["Category Code"] != category]
+    remainder = df[~in_category]
     if column == "":
         result = [temp]
     elif find:
         result = boolean_split(temp, column, find)
     else:
-        result = sorting_split(temp, column, n)
+        result = sorting_split(temp, column, n, capacity, footprint)
         # Now append remainder
     if len(remainder) > 0:
         result.append(remainder)
     return result
 
 
-def sorting_split(df: pd.DataFrame, column: str, n: int) -> list[pd.DataFrame]:
+def split_bounds(chunks: list[pd.DataFrame], column: str) -> list:
+    """Return the biggest value of column in each of the chunks that
+    sorting_split made (None for an empty chunk). This is all we need to
+    remember to put a new row into the right chunk later."""
+    result = []
+    for chunk in chunks:
+        values = chunk[column].dropna()
+        if len(values) > 0:
+            result.append(values.max())
+        else:
+            result.append(None)
+    return result
+
+
+def chunk_index(values: np.ndarray, bounds: list) -> np.ndarray:
+    """Return the chunk that each value would have gone into, given the
+    split_bounds of a sorting_split. Anything bigger than every bound (or
+    missing) goes into the last chunk, just like sort_values puts it last."""
+    filled = [i for i in range(len(bounds)) if bounds[i] is not None]
+    if not filled:
+        return np.zeros(len(values), dtype=int)
+    edges = np.array([bounds[i] for i in filled])
+    where = np.searchsorted(edges, values, side="left")
+    where = np.minimum(where, len(filled) - 1)
+    return np.array(filled)[where]
+
+
+def plain_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Return df with every categorical column turned back into the values
+    themselves (see ingest.normalize)."""
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(values.cat.categories.dtype)
+        columns[column] = values
+    return pd.DataFrame(columns, index=df.index)
+
+
+def diff_inventory(old: pd.DataFrame, new: pd.DataFrame,
+                   columns: list[str]) -> tuple[pd.DataFrame, pd.DataFrame,
+                                                pd.DataFrame, pd.DataFrame]:
+    """Return (added, removed, changed_old, changed_new) by comparing old and
+    new by SKU. A row is 'changed' iff the SKU is in both and any of columns
+    (the ones the layout actually looks at, like Rank) is different.
+    changed_old and changed_new are the before and after of the same rows.
+    """
+    old = old.drop_duplicates("SKU").set_index("SKU", drop=False)
+    new = new.drop_duplicates("SKU").set_index("SKU", drop=False)
+    added = new[~new.index.isin(old.index)]
+    removed = old[~old.index.isin(new.index)]
+    both = old.index.intersection(new.index)
+    # Two categoricals can't be compared unless they have the exact same
+    # categories, which two different CSVs almost never do
+    before = plain_columns(old.loc[both, columns])
+    after = plain_columns(new.loc[both, columns])
+    different = (before != after) & ~(before.isna() & after.isna())
+    changed = both[different.to_numpy().any(axis=1)]
+    return added, removed, old.loc[changed], new.loc[changed]
+
+
+def sorting_split(df: pd.DataFrame, column: str, n: int, capacity=None,
+                  footprint=None) -> list[pd.DataFrame]:
     """
     Return a tuple containing first the (n + 1)-sized list of DataFrame
     objects, with the remaining dataframe appended.
     First, narrow down the category.
     Then, sort by the columns. Finally, split the DataFrame.
+    Given a capacity for every piece (and the footprint columns of a row), the
+    pieces are cut to fit the shelves instead of having the same number of rows
+    (see packing.py).
     """
+    if capacity is not None:
+        return capacity_split(df, column, capacity, footprint)
     temp = df.sort_values(column)
     # This splits it into categories
     temp = np.array_split(temp, n)
@@ -277,6 +452,157 @@ def sorting_split(df: pd.DataFrame, column: str, n: int) -> list[pd.DataFrame]:
 
 # def boolean_help(df:pd.DataFrame, column:)
 
+# A pattern that refers to its own groups, or sets a flag for the whole
+# pattern, can't be glued to another one (see FindRule)
+_UNFUSABLE = re.compile(r"\\[1-9]|\\g<|\(\?P=|\(\?[aiLmsux]+\)")
+
+# Every FindRule made so far, by its find values, so a rebuild gets the names
+# they already know for free. The service and a StoreRegistry run for days
+# and every reload brings new names, so a rule forgets everything once it
+# knows MAX_NAMES of them, and only the last MAX_RULES rules are kept.
+_RULES = {}
+_RULES_LOCK = threading.Lock()
+MAX_RULES = 64
+MAX_NAMES = 250_000
+
+
+class FindRule:
+    """The find values of one boolean_split, compiled once.
+
+    All of them are also fused into ONE pattern (find[0] OR find[1] OR ...),
+    and every name goes through that first. Most names match nothing, and one
+    search settles those. Only the names that matched something get checked
+    against every find value on its own (and with just one find value, the
+    fused pattern already says it all). If a find value can't be fused (see
+    _UNFUSABLE), every name gets checked against every find value instead.
+
+    What every name matched is kept (as bits, bit i being find[i]), so going
+    over the same names again (the remainder of the next split, a rebuild, a
+    reload) is one get_indexer and never runs a pattern.
+    ============================================================================
+    Attributes |
+    ===========
+    find: The list of find values (see find_masks).
+
+    patterns: A list with the compiled pattern of every find value.
+
+    fused: The fused pattern, or None if the find values can't be fused.
+
+    names: A pandas Index of every name that has been classified.
+
+    bits: A numpy array with the bits of what every one of names matched.
+
+    lock: A threading.Lock held while names and bits are being looked at or
+          added to, since a reload and a route can both use the same rule.
+    """
+
+    def __init__(self, find: list) -> None:
+        self.find = find
+        sources = []
+        for value in find:
+            if isinstance(value, tuple):
+                sources.append(value[0])
+            else:
+                sources.append(re.escape(value))
+        self.patterns = [re.compile(elm) for elm in sources]
+        self.fused = None
+        if sources and not any(_UNFUSABLE.search(elm) for elm in sources):
+            self.fused = re.compile("|".join("(?:" + elm + ")"
+                                             for elm in sources))
+        self.names = pd.Index([], dtype=object)
+        self.bits = np.zeros(0, dtype=self._kind())
+        self.lock = threading.Lock()
+
+    def _kind(self):
+        """Return the dtype that fits a bit for every find value."""
+        if len(self.find) < 63:
+            return np.int64
+        return object
+
+    def classify(self, names: list[str]) -> np.ndarray:
+        """Return the bits of what every one of names matched."""
+        bits = np.zeros(len(names), dtype=self._kind())
+        if self.fused is None:
+            found = np.arange(len(names))
+        else:
+            found = np.flatnonzero(_searches(self.fused, names))
+            if len(self.patterns) == 1:
+                bits[found] = 1
+                return bits
+        subset = [names[i] for i in found]
+        for i in range(len(self.patterns)):
+            hit = found[_searches(self.patterns[i], subset)]
+            bits[hit] |= 1 << i
+        return bits
+
+    def masks(self, column: pd.Series) -> np.ndarray:
+        """Return find_masks(column, self.find)."""
+        with self.lock:
+            return self._masks(column)
+
+    def _masks(self, column: pd.Series) -> np.ndarray:
+        values = column.to_numpy(dtype=object)
+        if len(self.names) > MAX_NAMES:
+            # Start over, so names that are long gone don't pile up forever
+            self.names = pd.Index([], dtype=object)
+            self.bits = np.zeros(0, dtype=self._kind())
+        if len(self.names) > 0:
+            where = self.names.get_indexer(values)
+        else:
+            where = np.full(len(values), -1, dtype=np.intp)
+        missing = np.flatnonzero(where == -1)
+        if len(missing) > 0:
+            # Missing values stay at -1, and never match anything
+            codes, new = pd.factorize(values[missing])
+            found = codes != -1
+            where[missing[found]] = codes[found] + len(self.names)
+            if pd.api.types.infer_dtype(new, skipna=False) == "string":
+                strings = np.ones(len(new), dtype=bool)
+            else:
+                strings = np.fromiter((type(name) is str for name in new),
+                                      dtype=bool, count=len(new))
+            bits = np.zeros(len(new), dtype=self._kind())
+            bits[strings] = self.classify(new[strings].tolist())
+            self.bits = np.concatenate([self.bits, bits])
+            self.names = self.names.append(pd.Index(new, dtype=object))
+        bits = np.where(where == -1, 0, self.bits[where])
+        shifts = np.arange(len(self.find)).astype(self._kind())
+        return (bits[None, :] >> shifts[:, None]) & 1 == 1
+
+
+def _searches(pattern, names: list[str]) -> np.ndarray:
+    """Return a boolean array that is True wherever pattern shows up in
+    names."""
+    return np.fromiter(map(bool, map(pattern.search, names)), dtype=bool,
+                       count=len(names))
+
+
+def compile_find(find: list[str | tuple[str]]) -> FindRule:
+    """Return the FindRule of find, compiling it only the first time (or the
+    first time since it was dropped, see MAX_RULES)."""
+    key = tuple(find)
+    with _RULES_LOCK:
+        rule = _RULES.pop(key, None)
+        if rule is None:
+            rule = FindRule(list(find))
+        # Most recently used last, so the first one is the one to drop
+        _RULES[key] = rule
+        if len(_RULES) > MAX_RULES:
+            del _RULES[next(iter(_RULES))]
+    return rule
+
+
+def find_masks(column: pd.Series, find: list[str | tuple[str]]) -> np.ndarray:
+    """
+    Return a (len(find), len(column)) boolean array. Row i is True wherever
+    find[i] shows up in the column. Just like before, a tuple means that its
+    first value is a regular expression, and anything else is looked for as is.
+    Missing values never match anything. The find values are compiled once and
+    every name is only ever matched once (see FindRule).
+    """
+    return compile_find(find).masks(column)
+
+
 def boolean_split(df: pd.DataFrame, column: str,
                   find: str | list[str]) -> list[pd.DataFrame]:
     """
@@ -285,46 +611,20 @@ def boolean_split(df: pd.DataFrame, column: str,
     find disposables by setting category as "extracts inhaled" in the
     sorting_algorithm, column as "Product Name" in this function, and find as
     "disposable". Ideally, use lower method to match at all times.
+
+    There is one DataFrame for every find value (a row can show up in more than
+    one of them if it matches more than one), plus the rows that matched
+    nothing at the very end. df itself is never touched, all the matching is
+    done on one boolean array.
     pre-condition: find == find.lower()
     """
-    df["test"] = df[column].apply(lambda x: x.lower())
-    df["dummy"] = False
-    result = []
-    new_columns = []
     if not isinstance(find, list):
-        df["dummy"] = df[column].apply(lambda x: find in x)
-        # That good good stuff and the remainding Ick Ick
-        result = [df[df["dummy"] == 1], df[df["dummy"] == 0]]
-    else:
-        # I want an index that just tracks how many new columns we have
-
-        for i in range(len(find)):
-            if isinstance(find[i], tuple):
-                # If there's a tuple, I want it to be a regular expression
-                df[find[i]] = df[column].str.contains(find[i][0], regex=True)
-                new_columns.append(find[i])
-                # in_tuple is a dataframe which contains every find item that is
-                # in x
-                result.append(df[df[find[i]] == True])
-            else:
-                title = "dummy" + str(i)
-                new_columns.append(title)
-                df[title] = df[column].apply(lambda x: find[i] in x)
-                result.append(df[df[title] == 1])
-        for index, row in df.iterrows():
-            values_after_11 = row.iloc[10:]
-            # Basically, if any of the stuff in the list at this row is True
-            # it should return 1. If not, 0.
-            if sum(values_after_11) > 0:
-                df.loc[index, "dummy"] = True
-        # Add the remaining piece
-        piece = df[df["dummy"] == False]
-        result.append(piece)
-        # Keep only the old columns
-        clean_column = list(set(df.columns.values) - set(new_columns))
-        for i in range(len(result)):
-            if len(result[i]) > 0:
-                result[i] = result[i][clean_column]
+        # A single find value is just a list with one value
+        find = [find]
+    masks = find_masks(df[column], find)
+    result = [df[mask] for mask in masks]
+    # That good good stuff and the remainding Ick Ick
+    result.append(df[~masks.any(axis=0)])
     return result
 
 
@@ -353,10 +653,6 @@ def simplify(**kwargs) -> tuple[bool, list[str | bool] | str | bool]:
     return result
 
 
-# Consider this our main dictionary collector
-dictionaries = []
-
-
 class AtomicTree:
     """Tree that propagates itself using a nuke method.
     ============================================================================
@@ -371,13 +667,27 @@ class AtomicTree:
             the dataframe is first sorted by rank and split into 3 dataframes.
 
     _category: A list value containing unique category names that are in the
-               "Category Code" of self._dataframe.
+               "Category Code" of self._dataframe. Only the main tree ever
+               looks at it, so it's only worked out the first time it's asked
+               for.
 
     _find: A list of string values which is None iff we DON'T want to use
            boolean_split function
 
     _dataframe: A DataFrame object that is contained in each Atomic Tree.
                If self.dataframe == None, this is an 'exploded' dataframe.
+               For a shared tree this is built on demand out of _source and
+               _rows, so nothing is kept around except for the positions.
+
+    _source: The DataFrame the rows come from. For a normal tree that's just its
+             own dataframe, for a shared tree it's the ROOT dataframe (the same
+             object for every tree).
+
+    _rows: A numpy array with the positions of the rows of this tree in
+           _source, or None if the tree is all of _source.
+
+    shared: A boolean value that is True iff the subtrees are made with _rows
+            into the root instead of their own DataFrame copies.
 
     size: An int value which records the size of self._dataframe
 
@@ -408,12 +718,26 @@ class AtomicTree:
                  find=None,
                  main=False,
                  stable=True,
-                 parent=None | pd.DataFrame) -> None:
+                 parent=None | pd.DataFrame,
+                 rows=None,
+                 shared=False) -> None:
+        """If rows is given, dataframe is the root dataframe of a shared tree
+        and rows are the positions in it that belong to this tree. shared=True
+        on the root makes the whole tree work like that."""
         self.coordinate = coordinate
         self._column = column
-        self._dataframe = dataframe
-        self.size = len(self._dataframe)
-        self._category = list(self._dataframe["Category Code"].unique())
+        self.shared = shared or rows is not None
+        if self.shared and rows is None:
+            # The root of a shared tree. The index has to be the positions.
+            if not dataframe.index.equals(pd.RangeIndex(len(dataframe))):
+                dataframe = dataframe.reset_index(drop=True)
+        self._source = dataframe
+        self._rows = rows
+        if rows is None:
+            self.size = len(dataframe)
+        else:
+            self.size = len(rows)
+        self._categories = None
         self.subtrees = []
         # Say True in the beginning
         self.main = main
@@ -423,7 +747,65 @@ class AtomicTree:
         self._stable = stable
         self.node = None
         self.sorted_list = []
-
+        # Filled in by nuke (see route)
+        self._cat = None
+        self._bounds = None
+
+
+    @property
+    def _category(self) -> list:
+        if self._categories is None:
+            self._categories = list(self.column("Category Code").unique())
+        return self._categories
+
+    @property
+    def _dataframe(self) -> pd.DataFrame:
+        if self._rows is None:
+            return self._source
+        return self._source.take(self._rows)
+
+    @_dataframe.setter
+    def _dataframe(self, dataframe: pd.DataFrame) -> None:
+        self._source = dataframe
+        self._rows = None
+
+    def column(self, name: str) -> pd.Series:
+        """Return just the name column of this tree's dataframe (without
+        building the whole dataframe of a shared tree)."""
+        if self._rows is None:
+            return self._source[name]
+        return self._source[name].take(self._rows)
+
+    def _split_frame(self, extra=None) -> pd.DataFrame:
+        """Return the dataframe that nuke splits. A shared tree only builds the
+        columns that the split actually looks at (plus the extra ones, like the
+        footprint of a packed split), since the subtrees only keep the
+        positions anyway."""
+        if not self.shared:
+            return self._dataframe
+        columns = ["Category Code"]
+        if isinstance(self._column, str) and self._column in self._source:
+            columns.append(self._column)
+        for column in extra or []:
+            if column not in columns:
+                columns.append(column)
+        positions = self._source.columns.get_indexer(columns)
+        if self._rows is None:
+            return self._source.iloc[:, positions]
+        return self._source.iloc[self._rows, positions]
+
+    def _subtree(self, coordinate: str, column, df: pd.DataFrame, find,
+                 stable: bool):
+        """Return a new subtree holding the rows of df."""
+        if self.shared:
+            # The index of a piece of the root is the positions in the root
+            rows = df.index.to_numpy()
+            if len(self._source) < 2 ** 31:
+                rows = rows.astype(np.int32)
+            return AtomicTree(coordinate, column, self._source, stable=stable,
+                              parent=self, find=find, rows=rows)
+        return AtomicTree(coordinate, column, df, stable=stable, parent=self,
+                          find=find)
 
     def __str__(self, level=0) -> str:
         """Return the tree structure of each of its subtrees."""
@@ -465,9 +847,11 @@ class AtomicTree:
             count += subtree.size
         return count == self.size
 
-    def nuke(self, n: int, **kwargs) -> None:
+    def nuke(self, n: int, groups=None, **kwargs) -> None:
         """
         * Note: cat is there because every other split requires a category.
+        * Note: groups is an optional CategoryGroups of the root dataframe that
+          gets handed to sorting_algorithm (see layout.py).
         1.
         2. Iterate through the categories in self._category, sort by
            self.columns, then split into n pieces
@@ -475,28 +859,47 @@ class AtomicTree:
            for the front and back room split.
         4. Iff the sum of len(subtree._dataframes) is equal to the self._size,
            this is considered a valid nuke and self._dataframe is deleted.
+        5. Given a capacity for each of the n pieces (and the footprint
+           columns), a sorted split packs them onto the shelves instead of
+           cutting them into equal pieces (see packing.py).
         Pre-Conditions:
         - len(new_coordinates) == n
         """
+        capacity = kwargs.pop("capacity", None)
+        footprint = kwargs.pop("footprint", None)
         # helper function to organize kwargs
         simple, coordinates, columns, stability, find, cat = simplify(**kwargs)
+        # Remember how the split was made so that route can send new rows
+        # down the same way without redoing it.
+        self._cat = cat
         if self.main:
+            # This is only where things start out; a Rebalancer (see
+            # rebalance.py) keeps the front up with what's selling after that
             front = []
             back = []
+            self._bounds = {}
+            df = self._split_frame()
             for category in self._category:
-                temp = sorting_algorithm(self._dataframe,
-                                         category, self._column, n)
+                temp = sorting_algorithm(df,
+                                         category, self._column, n,
+                                         groups=groups)
                 front.append(temp[0])
                 back.append(temp[1])
+                self._bounds[category] = split_bounds(temp[:2], self._column)
             front = pd.concat(front)
             back = pd.concat(back)
             save = [front, back]
         else:
-            save = sorting_algorithm(self._dataframe,
+            save = sorting_algorithm(self._split_frame(footprint),
                                      cat,
                                      self._column,
                                      n,
-                                     self._find)
+                                     self._find,
+                                     groups,
+                                     capacity,
+                                     footprint)
+            if self._column != "" and not self._find:
+                self._bounds = split_bounds(save[:n], self._column)
 
         result = self.proliferate(save, simple, coordinates, columns, stability,
                                   find)
@@ -520,26 +923,25 @@ class AtomicTree:
         elif not simple:
             for i in range(len(df_list)):
                 result.append(
-                    AtomicTree(coordinate[i], columns[i],
-                               df_list[i], stable=stable[i], parent=self,
-                               find=find[i]))
+                    self._subtree(coordinate[i], columns[i],
+                                  df_list[i], find[i], stable[i]))
         else:
             leaf = "Terminated"
             for i in range(len(df_list)):
                 if i == len(df_list) - 1:
                     result.append(
-                        AtomicTree(coordinate[i], columns,
-                                   df_list[i], stable=stable, parent=self,
-                                   find=find[i]))
+                        self._subtree(coordinate[i], columns,
+                                      df_list[i], find[i], stable))
                 else:
                     result.append(
-                        AtomicTree(coordinate[i], leaf,
-                                   df_list[i], stable=True, parent=self,
-                                   find=find[i]))
+                        self._subtree(coordinate[i], leaf,
+                                      df_list[i], find[i], True))
         return result
 
     def _check(self) -> None:
         if self._valid_nuke():
+            # A shared tree never held a copy in the first place, so there's
+            # nothing to free there.
             pass
             # del self._dataframe
             # self._dataframe = None
@@ -561,19 +963,86 @@ class AtomicTree:
     #         curr = curr.parent
     #     return curr
 
-    def traverse_and_apply(self, method) -> None | list[dict]:
-        """Traverse the entire tree and apply class methods onto it. The two
-        that I'd imagine using rn would be for stable_deconstruct and the
-        bijective function."""
+    def _route_split(self, df: pd.DataFrame) -> list[pd.DataFrame]:
+        """Return df split up the same way nuke split this tree's dataframe,
+        one piece per subtree (the last one being the category remainder).
+        Sorted splits use the bounds that nuke saved instead of splitting df
+        into n equal pieces again."""
+        if self.main:
+            # The third one is every category that the tree has never seen,
+            # which has nowhere to go.
+            result = [[], [], []]
+            for category, temp in df.groupby("Category Code", sort=False,
+                                             observed=True):
+                if category not in self._bounds:
+                    result[2].append(temp)
+                    continue
+                where = chunk_index(temp[self._column].to_numpy(),
+                                    self._bounds[category])
+                result[0].append(temp[where == 0])
+                result[1].append(temp[where != 0])
+            return [pd.concat(pieces) if pieces else df.iloc[:0]
+                    for pieces in result]
+        in_category = (df["Category Code"] == self._cat).to_numpy()
+        temp = df[in_category]
+        if self._column == "":
+            result = [temp]
+        elif self._find:
+            result = boolean_split(temp, self._column, self._find)
+        else:
+            where = chunk_index(temp[self._column].to_numpy(), self._bounds)
+            result = [temp[where == i] for i in range(len(self._bounds))]
+        result.append(df[~in_category])
+        return result
+
+    def route(self, df: pd.DataFrame) -> list:
+        """Return a list of (leaf, piece of df) tuples telling you which leaf
+        each row of df would land in if the tree was built with it, using the
+        rules that were saved when the tree was nuked. A row can land in more
+        than one leaf (just like in boolean_split). Rows that have nowhere to go
+        (a category the tree has never seen, for example) come back with None
+        as the leaf."""
+        if len(self.subtrees) == 0:
+            return [(self, df)]
+        result = []
+        pieces = self._route_split(df)
+        for i in range(len(pieces)):
+            if len(pieces[i]) == 0:
+                continue
+            if i < len(self.subtrees):
+                result.extend(self.subtrees[i].route(pieces[i]))
+            else:
+                result.append((None, pieces[i]))
+        return result
 
+    def columns_used(self) -> list[str]:
+        """Return every column of the dataframe that the tree was split by, plus
+        the ones every tree needs."""
+        result = ["Category Code", "Product Name", "SKU"]
+        if isinstance(self._column, str) and self._column in self._source \
+                and self._column not in result and len(self.subtrees) > 0:
+            result.append(self._column)
+        for subtree in self.subtrees:
+            for column in subtree.columns_used():
+                if column not in result:
+                    result.append(column)
+        return result
+
+    def traverse_and_apply(self, method, result=None) -> list:
+        """Traverse the entire tree and apply class methods onto every stable
+        leaf. Return a list of whatever method returned (when it returned
+        something). Every call makes its own list, so calling this twice (or on
+        two trees at once) never mixes up the results."""
+        if result is None:
+            result = []
         if len(self.subtrees) == 0 and self._stable:  # If it's a leaf node
             output = method(self)
             if output:
-                dictionaries.append(output)
+                result.append(output)
         else:
             for subtree in self.subtrees:
-                subtree.traverse_and_apply(method)
-        return dictionaries
+                subtree.traverse_and_apply(method, result)
+        return result
 
     def bijection(self) -> dict[dict[dict[dict[list[str]]]]]:
         """Return a nested dictionary, with the final value for each coordinate
@@ -585,13 +1054,33 @@ class AtomicTree:
                        retrieve, so you'll be left with a complicated nest of
                        dictionaries with no content. (ZERO MATRIX
                                                       TRANSFORMATION)
-        IS THERE ANYWAY TO DO THIS RECURSIVELY???
-        * It would make things way more scalable k thanks bye.
+        It's one walk down the tree: the room (the closest stable tree above a
+        leaf) gets handed down on the way, instead of every leaf climbing back
+        up to find it. The lists in the dictionary ARE the leaves'
+        sorted_lists. If two leaves end up at the same room, x and y, the
+        first one wins.
         """
-        temp = self.traverse_and_apply(dictionary_build)
-        for i in range(1, len(temp)):
-            update_dict(temp[0], temp[i])
-        return temp[0]
+        result = {}
+        if self._stable:
+            self._bijection(self.coordinate, result)
+        else:
+            self._bijection(None, result)
+        return result
+
+    def _bijection(self, room: str, result: dict) -> None:
+        """Put every stable leaf under self into result. room is the coordinate
+        of the closest stable tree out of self and everything above it."""
+        for subtree in self.subtrees:
+            if len(subtree.subtrees) > 0:
+                if subtree._stable:
+                    subtree._bijection(subtree.coordinate, result)
+                else:
+                    subtree._bijection(room, result)
+            elif subtree._stable:
+                x, y = subtree.coordinate[0], subtree.coordinate[2]
+                level = result.setdefault(room, {}).setdefault(x, {})
+                if y not in level:
+                    level[y] = subtree.sorted_list
 
         # while not curr._stable:
         #     curr = curr.parent
@@ -617,45 +1106,15 @@ class AtomicTree:
 
 
 if __name__ == "__main__":
+    from layout import load_layout, compile_layout
     os.chdir(r"D:\My Projects\Fang Management\Inventory_Management")
     update_inventory = pd.read_csv(r"update_inventory.csv")
     update_inventory = update_inventory[update_inventory["Category Code"] != 0]
     update_inventory = update_inventory[update_inventory["Category Code"] != 4]
     doctest.testmod()
-    atom = AtomicTree("***Main", "Rank", update_inventory,
-                      main=True, find=[None])
-    atom.nuke(2, **front_and_back)
-    curr = atom.subtrees[0]
-    curr.nuke(4, **front_flower)
-    # for i in range(len(atom.subtrees)):
-    #     atom.subtrees[i].nuke(4, **second)
-    # atom.subtrees[0].subtrees[]
-    curr = curr.subtrees[0]
-    curr.nuke(3, **front_half_quarter)
-    # print(atom.subtrees[0].subtrees[4]._dataframe["Product Name"])
-    # curr = curr.subtrees[4]
-    curr = curr.parent.subtrees[5]
-    curr.nuke(5, **front_prerolls)
-    curr = curr.subtrees[4]
-    curr.nuke(3, **front_edibles)
-    curr = curr.subtrees[2]
-    curr.nuke(2, **front_extracts)
-    curr = curr.subtrees[1]
-    curr.nuke(2, **front_carts)
-    curr = atom.subtrees[1]
-    curr.nuke(3, **back_flower)
-    curr = curr.subtrees[2]
-    curr.nuke(3, **back_prerolls)
-    curr = curr.subtrees[2]
-    curr.nuke(2, **back_carts)
-    curr = curr.subtrees[1]
-    curr.nuke(2, **back_edibles)
-    atom.traverse_and_apply(stable_deconstruct)
-    LinkedCycle("Flowers 3.5g ", atom, "1.2", "3.1")
-    # print(atom.subtrees[1].subtrees[2].subtrees[1].node)
-    curr = curr.parent.parent.parent.subtrees[1]
-    # print(curr.sorted_list)
-    # curr = atom.subtrees[1].subtrees[2].subtrees[1]
+    # The whole split tree (and the "Flowers 3.5g " LinkedCycle) is in
+    # layout.json now.
+    atom = compile_layout(load_layout()).build(update_inventory)
     curr = atom.subtrees[0].subtrees[0].subtrees[0]
     print(curr.sorted_list)
     curr.node.move_item('Area 51 3.5g')
@@ -2,14 +2,16 @@ import os
 import pandas as pd
 import numpy as np
 import json
-from rapidfuzz import process, fuzz
-import sys
-from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QLineEdit, \
-    QPushButton, QVBoxLayout, QWidget, QMessageBox, QTreeView
-from PyQt5.QtGui import QStandardItemModel, QStandardItem
-from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
-from Testing_JSON import empty_storage
+import threading
+from bisect import bisect_left, insort
 from inventoryStructure import *
+from layout import load_layout, compile_layout
+from search_index import SearchIndex
+from snapshot import Snapshot, write_snapshot
+from journal import MoveJournal, Compactor, replay, save
+from coordinate_codec import CoordinateCodec, tree_levels
+from pick_path import PickPlanner, load_model
+from ingest import read_inventory
 
 ################################################################################
 # The objective of this program is to be able to locate and update products in
@@ -60,24 +62,79 @@ from inventoryStructure import *
 
 ################################################################################
 
-# This is just a dictionary for the z-coordinates from a json file.
-f = open('data.json')
-data = json.load(f)
-map = data['z_coordinate'][0]
+################################################################################
+# Nothing gets read when this module is imported, so tests, workers and the
+# benchmark can import it from anywhere (and the app comes up faster). The
+# storage below is loaded the first time something asks for it (see
+# __getattr__), and PyQt5 is only imported by main (see lookup_app.py). The z
+# coordinates don't come from a file at all anymore (see coordinate_codec.py).
+################################################################################
+
+# This is the storage that is running in the background. The binary snapshot
+# (see snapshot.py) is only mmapped, nothing gets read until the backend asks
+# for it. An old storage.json is still loaded if there is no snapshot yet.
+STORAGE = "storage.snap"
+# Every move since the last snapshot (see journal.py)
+JOURNAL = "moves.journal"
+
+
+def _load_storage():
+    """Return the snapshot at STORAGE, or what's in storage.json if there is
+    no snapshot yet."""
+    if os.path.exists(STORAGE):
+        return Snapshot(STORAGE)
+    f = open("storage.json")
+    obj = json.load(f)
+    f.close()
+    return obj
+
+
+def empty_storage(obj) -> bool:
+    """Return True iff the saved storage obj (room -> shelf -> level ->
+    products, like storage.json) has nothing to start from, which is no rooms
+    or rooms without a single shelf.
+    >>> empty_storage({})
+    True
+    >>> empty_storage({"F": {}, "B": {}})
+    True
+    >>> empty_storage({"F": {"1": {"2": ["Area 51 3.5g"]}}})
+    False
+    """
+    return all(not shelves for shelves in obj.values())
+
+
+# The module attributes that get loaded on first use, and what loads them
+_LAZY = {"obj": _load_storage}
+
+# The windows of the app, which live in lookup_app.py with the Qt imports
+_APP = ["ProductLookupApp", "DataWindow", "InventoryLayoutWindow"]
+
 
-z_coordinate = {}
+def _lazy(name: str):
+    """Return the module attribute name, loading it first if nobody has yet.
+    Setting it by hand (documentation.obj = {} to start from a CSV, for
+    example) means it never gets loaded."""
+    if name not in globals():
+        globals()[name] = _LAZY[name]()
+    return globals()[name]
 
-for alpha in map:
-    save = map[alpha]
-    z_coordinate[save] = alpha.lower()
 
-# Closing file
-f.close()
+def __getattr__(name: str):
+    if name in _LAZY:
+        return _lazy(name)
+    if name in _APP:
+        import lookup_app
+        return getattr(lookup_app, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def close_storage() -> None:
+    """Let go of the snapshot (if it was ever opened), so a new one can be
+    written over it."""
+    storage = globals().get("obj")
+    if isinstance(storage, Snapshot):
+        storage.close()
 
-# This is the storage that is running in the background
-f = open("storage.json")
-obj = json.load(f)
-f.close()
 
 # The current "moves" of the store will be stored here. Detailed documentation
 # of the moves will be included in the inventoryStructure.py file.
@@ -164,6 +221,25 @@ class UpdatedInventory:
     tree:           dict object. Consider this the master dictionary
     product_map:    dict object with product name pointing to a coordinate
     coordinate_map: dict object with coordinate pointing to a product name
+    search_index:   SearchIndex object over the product names. fetch uses this
+                    instead of scanning every product. (A SearchView of the
+                    shared catalog for a store of a StoreRegistry.)
+    atom:           The AtomicTree the maps were built from (None if the data
+                    was loaded from the JSON file)
+    snapshot:       The DataFrame the maps currently reflect, which is what
+                    reload compares the next CSV against (None if the data
+                    was loaded from the JSON file)
+    journal:        MoveJournal object that every move gets written to (or
+                    None to not keep one)
+    path:           Where the snapshot of tree gets written when the journal
+                    can't cover a change (see reload)
+    cycles:         dict object with the (room, x, y) of each end of a
+                    LinkedCycle pointing to the other end. This is where moves
+                    go when there is no atom to move things through.
+    codec:          CoordinateCodec object that every coordinate is made with
+    planner:        PickPlanner object that orders pick lists (see pick_path)
+    lock:           The lock held while moving things (the journal's, so that
+                    compaction waits for a move to finish)
     front_map:      dict object
     back_map:       dict object
     # existing_data:  bool object that is True iff the data loaded was a JSON
@@ -171,7 +247,9 @@ class UpdatedInventory:
     +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
     """
 
-    def __init__(self, AtomicTree, max_n=10000) -> None:
+    def __init__(self, AtomicTree, max_n=10000,
+                 journal: MoveJournal = None, storage=None,
+                 search_index: SearchIndex = None, path: str = STORAGE) -> None:
         """Create a list filled with each category specific dataframes, then we
         can sort the values and produce a list
 
@@ -190,14 +268,53 @@ class UpdatedInventory:
                       - Product list sorted alphabetically
                   - category 2 (maybe pre-rolls)
                       - ...
-                  - ..."""
-        # Use empty_storage function from Testing_JSON to check if there is any
-        # saved data. If there is, just load that instead of a pandas object.
+                  - ...
+
+        storage is the saved data to start from (a Snapshot or the dict of a
+        storage.json), which is the one loaded from STORAGE if not given. If
+        search_index is given (a SearchView of a shared catalog, see
+        stores.py), the product names go in there instead of a new
+        SearchIndex. path is where the snapshot gets written after a reload
+        (STORAGE if not given)."""
+        # Use empty_storage to check if there is any saved data. If there is,
+        # just load that instead of a pandas object.
 
         ##########################
-        if not empty_storage(obj):
+        self.atom = None
+        self.snapshot = None
+        self.codec = CoordinateCodec()
+        self.search_index = search_index
+        self.journal = journal
+        self.path = path
+        spec = load_layout()
+        self.cycles = compile_layout(spec).cycle_addresses()
+        self.planner = PickPlanner(self.codec, load_model(spec))
+        if journal is not None:
+            self.lock = journal.lock
+        else:
+            self.lock = threading.RLock()
+        if storage is None:
+            storage = _lazy("obj")
+        if isinstance(storage, Snapshot) and len(storage) > 0:
+            # The snapshot already has both maps written down, so there's
+            # nothing to recompute
+            self.tree = storage.tree()
+            if journal is not None and replay(self.tree, journal.events()):
+                # The moves since the snapshot change the coordinates
+                update = self.coordinate_map_build(self.tree)
+            else:
+                update = self.coordinate_map = storage.coordinate_map()
+            self.product_map_build(update)
+            # Everything is in memory now, and the file has to be free for the
+            # next snapshot to be written over it
+            storage.close()
+            print("USING SNAPSHOT")
+        elif not isinstance(storage, Snapshot) and \
+                not empty_storage(storage):
             # self.existing_data = True
-            self.tree = obj
+            self.tree = storage
+            if journal is not None:
+                replay(self.tree, journal.events())
             update = self.coordinate_map_build(self.tree)
             self.product_map_build(update)
             print("USING JSON FILE")
@@ -206,6 +323,9 @@ class UpdatedInventory:
             structure = self.catch_and_kill(AtomicTree)
             future = self.coordinate_map_build(structure)
             self.product_map_build(future)
+            # The old moves were made on a layout that's gone now
+            if journal is not None:
+                journal.clear()
             print("USING CSV FILE")
 
     def catch_and_kill(self,
@@ -213,6 +333,8 @@ class UpdatedInventory:
         """Initialize the front and back map, as well as the tree, then return
         the JSON file structured tree. """
         # Documentation is in inventoryStructure.py
+        self.atom = AtomicTree
+        self.snapshot = AtomicTree._source
         tree = AtomicTree.bijection()
         self.front_map = tree["F"]
         self.back_map = tree["B"]
@@ -285,17 +407,12 @@ class UpdatedInventory:
 
     # Two functions to initialize the attributes
     def coordinate_map_build(self, tree: dict[str, dict[str, list[str]]]):
-        """The purpose of this function is to initialize the product_map
-        attribute"""
-        result = {}
-        for room in tree:
-            for x in tree[room]:
-                for y in tree[room][x]:
-                    products = tree[room][x][y]
-                    for i in range(len(products)):
-                        z = z_coordinate[i].lower()
-                        coordinate = room + '.' + x + '.' + y + '.' + z
-                        result[coordinate] = products[i]
+        """The purpose of this function is to initialize the coordinate_map
+        attribute (and the product_map that goes with it, see
+        product_map_build)"""
+        # The product_map comes out of the same pass, and product_map_build
+        # just picks it up instead of flipping this one around again
+        result, self._flipped = self.codec.build_maps(tree_levels(tree))
 
                 # if isinstance(products[0], list):
                 #     unique_mapping = self._coordinate_map_help(products)
@@ -313,22 +430,84 @@ class UpdatedInventory:
         return result
 
     def product_map_build(self, map_ob) -> None:
-        """Literally switch the key-value pairing"""
-        result = {}
-        for elm in map_ob:
-            save = map_ob[elm]
-            result[save] = elm
+        """Literally switch the key-value pairing. The search index is built
+        here too (or just synced if we already have one), since it needs the
+        exact same product names.
+
+        If map_ob is the coordinate_map that coordinate_map_build just made, it
+        already has the flipped version ready."""
+        flipped = getattr(self, "_flipped", None)
+        if map_ob is getattr(self, "coordinate_map", None) and \
+                flipped is not None:
+            result = flipped
+        else:
+            result = {}
+            for elm in map_ob:
+                save = map_ob[elm]
+                result[save] = elm
+        self._flipped = None
         self.product_map = result
+        if self.search_index is None:
+            self.search_index = SearchIndex(result)
+        else:
+            self.search_index.sync(result)
 
     def fetch(self, search: str) -> tuple[str]:
-        """Return the coordinate of an item when a name is typed in"""
-        products_list = list(self.coordinate_map.values())
-        result = process.extractOne(search, products_list,
-                                    scorer=fuzz.WRatio)
+        """Return the coordinate of an item when a name is typed in. Raise a
+        KeyError if there are no products to search through."""
+        result = self.search_index.search(search)
+        if result is None:
+            raise KeyError(search)
         name = result[0]
         coordinate = self.product_map[name]
         return self.coordinate_map[coordinate], coordinate
 
+    def fetch_many(self, queries: list[str]) -> list[tuple]:
+        """Return (query, name, coordinate, score) for every query, all
+        searched at once (see SearchIndex.search_many) and sorted into the
+        order you'd walk the store in (see walk_key), so one trip picks the
+        whole order. If there's nothing to search, every query comes back with
+        None for the name and coordinate."""
+        found = []
+        missing = []
+        results = self.search_index.search_many(queries)
+        for query, result in zip(queries, results):
+            if result is None:
+                missing.append((query, None, None, 0.0))
+            else:
+                name, score = result
+                found.append((query, name, self.product_map[name], score))
+        rooms = {room: i for i, room in enumerate(self.tree)}
+        found.sort(key=lambda elm: self.walk_key(elm[2], rooms))
+        return found + missing
+
+    def cache_stats(self) -> dict[str, dict[str, int]]:
+        """Return the hits and misses of the search cache and the pick path
+        cache."""
+        return {"search": self.search_index.cache_info(),
+                "pick_paths": {"hits": self.planner.hits,
+                               "misses": self.planner.misses}}
+
+    def pick_path(self, products: list[str], start: str = None,
+                  back: bool = False) -> list[tuple[str, str]]:
+        """Return (product, coordinate) for every product (exact names) in the
+        order that walks the least to pick them all, starting from the door of
+        the room start (the front, if not given). See PickPlanner.route."""
+        if start is None and self.tree:
+            start = next(iter(self.tree))
+        return self.planner.route(self.product_map, products, start, back)
+
+    def walk_key(self, coordinate: str, rooms: dict = None) -> tuple:
+        """Return what to sort coordinates by to get them in walking order:
+        room (in the order of self.tree, so the front comes first), shelf,
+        level, and then slot. Shelves and levels go by number, so "10" comes
+        after "9"."""
+        if rooms is None:
+            rooms = {room: i for i, room in enumerate(self.tree)}
+        room, x, y = self.codec.address(coordinate)
+        slot = self.codec.unpack(self.codec.parse(coordinate))[1]
+        return rooms.get(room, len(rooms)), _natural(x), _natural(y), slot
+
     def _valid_move(self, item: str, loc: str) -> bool:
         """Return True iff the item's current location is not equal to the
         moved location. For example, if an item is in the backroom, it will
@@ -390,6 +569,133 @@ class UpdatedInventory:
     #     room_stock[coordinate[1][2]] = save
     #     self.tree[loc] = room_stock
 
+    def _leaf(self, coordinate: str):
+        """Return the leaf AtomicTree that holds the product at coordinate, or
+        None if there is no tree to look through."""
+        if self.atom is None:
+            return None
+        room, x, y = self.codec.address(coordinate)
+        for subtree in self.atom.subtrees:
+            if subtree.coordinate == room:
+                return subtree.hide_and_seek(x + '.' + y)
+        return None
+
+    def _relabel(self, room: str, x: str, y: str, start: int = 0) -> None:
+        """Redo the coordinates of the products at (room, x, y) in both maps,
+        which is all that changes when something goes in or out of that
+        level. It's the same as what coordinate_map_build does, for one level.
+
+        Only the slots from start on are redone, since putting something in
+        (or taking something out) at start doesn't move anything before it.
+        """
+        level = self.codec.level((room, x, y))
+        products = self.tree[room][x][y]
+        # The z coordinates only ever count up, so the old ones are the first
+        # few z's until one of them isn't there anymore.
+        i = start
+        while True:
+            coordinate = self.codec.format(self.codec.pack(level, i))
+            name = self.coordinate_map.pop(coordinate, None)
+            if name is None:
+                break
+            if self.product_map.get(name) == coordinate:
+                del self.product_map[name]
+            i += 1
+        coordinates = self.codec.coordinates(level, start, len(products))
+        self.coordinate_map.update(zip(coordinates, products[start:]))
+        self.product_map.update(zip(products[start:], coordinates))
+
+    def reload(self, df: pd.DataFrame) -> dict[str, int]:
+        """Update the inventory to a new CSV (df) without rebuilding it.
+
+        df is compared to self.snapshot by SKU, and only the rows that were
+        added, removed, or changed in a column the layout actually splits by
+        (Rank, for example) are sent down the tree with AtomicTree.route. Their
+        names go in and out of the leaves' sorted lists (which ARE the lists in
+        self.tree), and then only the levels that changed get new coordinates
+        in coordinate_map and product_map.
+
+        Return how many products were added, removed, changed, and how many
+        had no leaf to go to (a category that the layout has never seen, for
+        example). If there is no tree to route through (the data came from the
+        JSON file), the whole thing is built from scratch with the layout.
+
+        Note that the trees themselves still hold the rows they were built
+        with; the sorted lists and the maps are what's kept up to date.
+
+        The whole thing holds the lock, so no move or compaction ever sees it
+        halfway. A reload isn't a move, so the journal can't replay it: with a
+        journal, a snapshot is written to self.path right after (and the
+        journal is emptied, like journal.save), so a restart comes back to the
+        reloaded inventory.
+        """
+        if self.journal is None:
+            with self.lock:
+                return self._reload(df)
+        # The same order as journal.save, so a compaction can't deadlock us
+        with self.journal.compacting:
+            with self.lock:
+                result = self._reload(df)
+                # On the disk before the journal goes (see journal.compact)
+                write_snapshot(self.path, self.tree)
+                self.journal.clear()
+        return result
+
+    def _reload(self, df: pd.DataFrame) -> dict[str, int]:
+        """Do what reload says, without the lock or the snapshot."""
+        if self.atom is None or self.snapshot is None:
+            atom = compile_layout(load_layout()).build(df)
+            future = self.coordinate_map_build(self.catch_and_kill(atom))
+            self.product_map_build(future)
+            return {"added": len(df), "removed": 0, "changed": 0,
+                    "unplaced": 0}
+        columns = [column for column in self.atom.columns_used()
+                   if column in df.columns]
+        added, removed, before, after = diff_inventory(self.snapshot, df,
+                                                       columns)
+        # The trees only ever look at these columns, so don't drag the rest
+        # around while routing
+        added, removed = added[columns], removed[columns]
+        before, after = before[columns], after[columns]
+        touched = set()
+        # A dict instead of a set, so the search index gets them in order
+        names = {}
+        # Out with the old. If the name isn't where the rules put it, it has
+        # been moved (see item_to_loc), so take it out of wherever it is now.
+        for leaf, piece in self.atom.route(pd.concat([removed, before])):
+            for name in piece["Product Name"]:
+                names[name] = None
+                if leaf is not None and leaf._stable and \
+                        remove_sorted(leaf.sorted_list, name):
+                    touched.add(leaf_address(leaf))
+                elif name in self.product_map:
+                    room, x, y = self.codec.address(self.product_map[name])
+                    if remove_sorted(self.tree[room][x][y], name):
+                        touched.add((room, x, y))
+        # ...and in with the new
+        unplaced = 0
+        for leaf, piece in self.atom.route(pd.concat([added, after])):
+            if leaf is None or not leaf._stable:
+                unplaced += len(piece)
+                continue
+            for name in piece["Product Name"]:
+                insort(leaf.sorted_list, name)
+                names[name] = None
+            touched.add(leaf_address(leaf))
+        for room, x, y in touched:
+            # Two leaves can share an address, and only the first one made it
+            # into self.tree (see AtomicTree.bijection).
+            if y in self.tree.get(room, {}).get(x, {}):
+                self._relabel(room, x, y)
+        for name in names:
+            if name in self.product_map:
+                self.search_index.add(name)
+            else:
+                self.search_index.discard(name)
+        self.snapshot = df
+        return {"added": len(added), "removed": len(removed),
+                "changed": len(after), "unplaced": unplaced}
+
     def item_to_loc(self, item: str, loc: str) -> None:
         """Move an item to a different location. After the method is executed,
         the front will include the item and re-initialize the maps
@@ -397,324 +703,100 @@ class UpdatedInventory:
         if not self._valid_move(item, loc):
             raise KeyError
         else:
-            self.tree.node.move_item(item)
+            self._move(self.codec.address(self.product_map[item]), [item])
             # self._seek_and_destroy(item)
             # self._inject_item(item, loc)
-            # update = self.coordinate_map_build(self.tree)
-            # self.product_map_build(update)
-
-
-class ProductLookupApp(QMainWindow):
-    def __init__(self, inventory: UpdatedInventory):
-        super().__init__()
-        self.inventory = inventory
-        self.initUI()
-        self.data_window = None
-        self.inventory_layout_window = None
-
-    def initUI(self):
-        self.setWindowTitle("PACIOS")
-
-        # Create a central widget
-        central_widget = QWidget()
-        # self.setCentralWidget(central_widget)
-
-        layout = QVBoxLayout()
-
-        # Create a label for the starting menu
-        title = \
-            "Paradise Air Coordinated Inventory Operating System (PACIOS)"
-        start_label = QLabel(title)
-        layout.addWidget(start_label)
-
-        # Create a search bar
-        search_label = QLabel("Enter product name:")
-        layout.addWidget(search_label)
-
-        self.search_entry1 = QLineEdit()
-        layout.addWidget(self.search_entry1)
-
-        # Create a search button
-        search_button1 = QPushButton("Search")
-        search_button1.clicked.connect(self.search_product)
-        layout.addWidget(search_button1)
-
-        # Create a label to display the results
-        self.result_label = QLabel("")
-        layout.addWidget(self.result_label)
-
-        # Have a search bar that allows you to MOVE product
-        search_label = QLabel("If item must be moved, type item name:")
-        layout.addWidget(search_label)
-
-        self.search_entry2 = QLineEdit()
-        layout.addWidget(self.search_entry2)
-
-        # Create a Move button
-        search_button2 = QPushButton("Move")
-        search_button2.clicked.connect(self.move_item)
-        layout.addWidget(search_button2)
-
-        # Create a label to display the results
-        self.result_label = QLabel("")
-        layout.addWidget(self.result_label)
-
-        # Create a Data page button
-        data_window_button = QPushButton("Open Data Window")
-        data_window_button.clicked.connect(self.openDataWindow)
-        layout.addWidget(data_window_button)
-
-        central_widget.setLayout(layout)
-
-        # Create a inventory layout page button
-        inventory_layout_button = QPushButton("Open Inventory Layout")
-        inventory_layout_button.clicked.connect(self.openLayoutWindow)
-        layout.addWidget(inventory_layout_button)
-
-        central_widget.setLayout(layout)
-
-        # Set the central widget
-        self.setCentralWidget(central_widget)
-
-    def openDataWindow(self):
-        print("DATA WINDOW ACTIVATED")
-        if self.data_window is None:
-            self.data_window = DataWindow(self.inventory.tree)
-        self.data_window.show()
-        self.hide()
-
-    def openLayoutWindow(self):
-        print("INVENTORY LAYOUT WINDOW ACTIVATED")
-        if self.inventory_layout_window is None:
-            page = InventoryLayoutWindow(self.inventory.tree)
-            self.inventory_layout_window = page
-        self.inventory_layout_window.show()
-
-    def search_product(self):
-        # Retrieve the user's input from the search bar
-        search_query = self.search_entry1.text()
-        # search_query = self.sender()
-        name, coordinate = self.inventory.fetch(search_query)
-        statement = (name +
-                     " is at " + coordinate)
-        self.result_label.setText(statement)
-
-    def move_item(self):
-        """Call the item_to_loc method for the class. If the operation was
-        successful, there should be a pop-up that says the move was successful.
-        If not, say it was unsuccessful."""
-        search_query = self.search_entry2.text()
-        coord = self.inventory.fetch(search_query)[1]
-
-        # This will give you the exact name of the product
-        product = self.inventory.coordinate_map[coord]
-
-        rooms = ["F", "B"]
-        for room in rooms:
-            try:
-                self.inventory.item_to_loc(product, room)
-                break
-            except KeyError:
-                pass
-
-        # The following are messages
-        name, coordinate = self.inventory.fetch(search_query)
-        message = name + " is now at " + coordinate
-        self.result_label.setText(message)
-
-
-class DataWindow(QMainWindow):
-    def __init__(self, data: dict[dict[list[str]]], parent=None):
-        super().__init__(parent)
-        self.initUI()
-        self.data = data
-
-    def initUI(self):
-        self.setWindowTitle("Data Window")
-        self.setGeometry(300, 200, 400, 200)
-
-        # Create a central widget
-        central_widget = QWidget()
-        # self.setCentralWidget(central_widget)
-
-        layout = QVBoxLayout()
-
-        # Create a label for the starting menu
-        title = \
-            "Save and close or clear all data"
-        start_label = QLabel(title)
-        layout.addWidget(start_label)
-
-        # Create a button to simulate data
-        self.save_button = QPushButton("Save Data and Close")
-        self.save_button.clicked.connect(self.save_data_and_close)
-        layout.addWidget(self.save_button)
-
-        # Create a button to simulate data
-        self.clear_button = QPushButton("Reset the inventory", self)
-        self.clear_button.clicked.connect(self.showConfirmationDialog)
-        layout.addWidget(self.clear_button)
-
-        # Add the button to the layout
-        central_widget.setLayout(layout)
-        self.setCentralWidget(central_widget)
-
-    def showConfirmationDialog(self):
-        # Create a confirmation dialog
-        confirmation = QMessageBox.question(self,
-                                            'Confirmation',
-                                            'Are you sure you want to proceed?',
-                                            QMessageBox.Yes | QMessageBox.No)
-
-        # Check the user's choice
-        if confirmation == QMessageBox.Yes:
-            self.clear_all()
-            statement = 'Resetting all data. LOAD CSV FILE.'
-            QMessageBox.information(self, 'Information', statement)
-            self.close()
-        else:
-            # User clicked No, do nothing or handle accordingly
-            print('User clicked No. Canceled.')
-
-    def save_data_and_close(self):
-        """After closing the application the data should be stored in the
-        storage.json file"""
-        try:
-            with open(r"D:\My Projects\pythonProject\storage.json",
-                      "w") as json_file:
-                json.dump(self.data, json_file, indent=4)
-        except Exception as e:
-            print(f"An error occurred: {e}")
-
-        # Close the application
-        self.close()
-
-    def clear_all(self) -> None:
-        """This method should clear everything, but it would now require the csv
-        file to work"""
-        old = {"F": {
-            "0": [],
-            "1": [],
-            "2": [],
-            "3": [],
-            "4": [],
-            "5": []
-        },
-            "B": {
-                "0": [],
-                "1": [],
-                "3": [],
-                "4": [],
-                "5": []
-            }}
-        try:
-            with open(r"D:\My Projects\pythonProject\storage.json",
-                      "w") as json_file:
-                json.dump(old, json_file, indent=4)
-        except Exception as e:
-            print(f"An error occurred: {e}")
-
-    def mousePressEvent(self, event):
-        # Close the data window and show the starting menu when the data window
-        # is clicked
-        self.close()
-        self.parent().show()
-
-
-class InventoryLayoutWindow(QMainWindow):
-    def __init__(self, data_dict: dict[dict[list[str]]], parent=None):
-        super().__init__(parent)
-        self.data_dict = data_dict
-        self.initUI()
-
-    def initUI(self):
-        self.setWindowTitle('Tree Visualization')
-        self.setGeometry(500, 500, 400, 300)
-
-        # Create a QTreeView widget
-        self.tree_view = QTreeView(self)
-        self.tree_view.setGeometry(10, 10, 380, 280)
-
-        # Create a QStandardItemModel to represent the tree
-        self.tree_model = QStandardItemModel()
-        self.tree_model.setHorizontalHeaderLabels(["Tree Nodes"])
-
-        # Create root item
-        root_item = self.tree_model.invisibleRootItem()
-
-        # Populate the tree model from the JSON dictionary
-        self.populateTree(root_item, self.data_dict)
-
-        # Set the model for the QTreeView
-        self.tree_view.setModel(self.tree_model)
-
-    def populateTree(self, parent_item, data):
-        if isinstance(data, dict):
-            for key, value in data.items():
-                key_item = self.addTreeItem(parent_item, key)
-                self.populateTree(key_item, value)
-        elif isinstance(data, list):
-            for item in data:
-                self.populateTree(parent_item, item)
-        else:
-            self.addTreeItem(parent_item, str(data))
-
-    def addTreeItem(self, parent, text):
-        item = QStandardItem(text)
-        parent.appendRow(item)
-        return item
-
-    def mousePressEvent(self, event):
-        # Close the data window and show the starting menu when the data window
-        # is clicked
-        self.close()
-        self.parent().show()
-
-
 
-def main():
-    app = QApplication(sys.argv)
-    window = ProductLookupApp(backend)
-    # window = DataWindow()
-    window.show()
-    sys.exit(app.exec_())
+    def items_to_loc(self, items: list[str], loc: str) -> None:
+        """Move a whole batch of items (exact product names) to loc at once.
+        Items coming off the same level go through Node.move_items together, so
+        each level is merged and relabeled once instead of once per item.
+
+        Raise a KeyError (before moving anything) if an item isn't in the
+        inventory or is already in loc."""
+        levels = {}
+        for item in dict.fromkeys(items):
+            coordinate = self.product_map[item]
+            if coordinate[0] == loc:
+                raise KeyError(item)
+            levels.setdefault(self.codec.address(coordinate), []).append(item)
+        for address in levels:
+            self._move(address, levels[address])
+
+    def _move(self, address: tuple[str, str, str], items: list[str]) -> None:
+        """Move items (all on the level at address) to the other end of their
+        LinkedCycle, then fix up the maps and write the moves down."""
+        with self.lock:
+            sources = [self.product_map[item] for item in items]
+            leaf = self._leaf(sources[0])
+            if leaf is not None and leaf.node is not None:
+                target = leaf_address(leaf.node.next.tree)
+            elif self.atom is None and address in self.cycles:
+                target = self.cycles[address]
+            else:
+                raise KeyError
+            room, x, y = address
+            first = min(items)
+            start = bisect_left(self.tree[room][x][y], first)
+            if leaf is not None and leaf.node is not None:
+                # The lists in self.tree are the leaves' sorted lists, so the
+                # move is already in there after this
+                if len(items) == 1:
+                    leaf.node.move_item(items[0])
+                else:
+                    leaf.node.move_items(items)
+            else:
+                # No trees (the data came from a snapshot), so do what
+                # move_items would have done to the lists in self.tree
+                room, x, y = target
+                move_sorted(self.tree[address[0]][address[1]][address[2]],
+                            self.tree[room][x][y], items)
+            # Only the two levels the items went between have new
+            # coordinates, and only from where the first one came out/went
+            # in. The search index stays the same, since a move doesn't
+            # change the set of names at all.
+            room, x, y = target
+            if y in self.tree.get(room, {}).get(x, {}):
+                self._relabel(room, x, y,
+                              bisect_left(self.tree[room][x][y], first))
+            self._relabel(*address, start)
+            if self.journal is not None:
+                for i in range(len(items)):
+                    self.journal.record(items[i], sources[i],
+                                        self.product_map[items[i]])
+
+
+def _natural(label: str) -> tuple:
+    """Return a sort key that puts numbers in number order (before anything
+    that isn't one)."""
+    if label.isdigit():
+        return 0, int(label), label
+    return 1, 0, label
+
+
+def main(inventory=None):
+    """Run the app on inventory, which is the backend unless it's given (a
+    service.RemoteInventory, for example)."""
+    import lookup_app
+    if inventory is None:
+        inventory = backend
+    lookup_app.main(inventory)
 
 
 # Back end testing
 if __name__ == "__main__":
     os.chdir(r"D:\My Projects\Fang Management\Inventory_Management")
-    update_inventory = pd.read_csv(r"update_inventory.csv")
-    update_inventory = update_inventory[update_inventory["Category Code"] != 0]
-    update_inventory = update_inventory[update_inventory["Category Code"] != 4]
+    # Streamed in chunks, without categories 0 and 4 or repeated SKUs (see
+    # ingest.py)
+    update_inventory = read_inventory(r"update_inventory.csv")
     # THE FOLLOWING ARE SPECIFIC TO THE ORGANIZATION STYLES OF THE OG PARADISE
-    # CREW.
-    atom = AtomicTree("***Main", "Rank", update_inventory,
-                      main=True, find=[None])
-    atom.nuke(2, **front_and_back)
-    curr = atom.subtrees[0]
-    curr.nuke(4, **front_flower)
-    curr = curr.subtrees[0]
-    curr.nuke(3, **front_half_quarter)
-    curr = curr.parent.subtrees[5]
-    curr.nuke(5, **front_prerolls)
-    curr = curr.subtrees[4]
-    curr.nuke(3, **front_edibles)
-    curr = curr.subtrees[2]
-    curr.nuke(2, **front_extracts)
-    curr = curr.subtrees[1]
-    curr.nuke(2, **front_carts)
-    curr = atom.subtrees[1]
-    curr.nuke(3, **back_flower)
-    curr = curr.subtrees[2]
-    curr.nuke(3, **back_prerolls)
-    curr = curr.subtrees[2]
-    curr.nuke(2, **back_carts)
-    curr = curr.subtrees[1]
-    curr.nuke(2, **back_edibles)
-    atom.traverse_and_apply(stable_deconstruct)
-    atom.bijection()
+    # CREW. They are all written down in layout.json.
+    atom = compile_layout(load_layout()).build(update_inventory)
     # print(atom)
-    # Now make the actual backend
-    backend = UpdatedInventory(atom)
+    # Now make the actual backend, writing every move down as it happens and
+    # folding the moves into the snapshot every once in a while
+    journal = MoveJournal(JOURNAL)
+    backend = UpdatedInventory(atom, journal=journal)
+    Compactor(journal, lambda: backend.tree, STORAGE).start()
     # print(backend.front_map)
     main()
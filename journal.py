@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import threading
+from bisect import insort
+from inventoryStructure import remove_sorted
+from snapshot import write_snapshot
+
+################################################################################
+# Move journal
+#
+# A move used to live only in memory until someone hit "Save Data and Close",
+# which rewrites the whole storage file. So a crash halfway through a shift lost
+# every move since the last save. Now every move is written down the moment it
+# happens as one line at the end of the journal:
+#
+#   ["Area 51 3.5g", "F.1.2.a", "B.3.1.c", 1700000000.0]
+#
+# (product, from coordinate, to coordinate, timestamp). That's one small append
+# per move instead of a whole file. On start up the journal is replayed on top
+# of the last snapshot, and every once in a while a Compactor folds it into a
+# new snapshot in the background so it never grows too big.
+#
+# Compacting works in three steps so a crash can never lose a move:
+#   1. (Under the lock) copy the tree and move the journal to path.compacting,
+#      starting a new empty journal for the moves that come after.
+#   2. Write the snapshot from the copy.
+#   3. Delete path.compacting.
+# If we crash between 2 and 3, path.compacting gets replayed over a snapshot
+# that already has its moves. That's fine, because replay skips a move whose
+# product isn't at the from coordinate anymore.
+################################################################################
+
+
+class MoveJournal:
+    """An append-only file of moves.
+    ============================================================================
+    Attributes |
+    ===========
+    path: The journal file. path + ".compacting" is the journal that is being
+          folded into a snapshot (see the comment at the top).
+
+    sync: A bool value which is True iff every move is fsynced to disk before
+          record returns (so it survives the power going out, not just the
+          program crashing).
+
+    count: How many moves are in the journal since it was last compacted.
+
+    lock: A threading.RLock. Hold it while changing the tree AND recording the
+          move, so that a compaction never sees one without the other.
+
+    compacting: A threading.Lock that is held for a whole compaction or save,
+                so two snapshots are never written at the same time.
+    """
+
+    def __init__(self, path: str, sync: bool = True) -> None:
+        self.path = path
+        self.sync = sync
+        self.lock = threading.RLock()
+        self.compacting = threading.Lock()
+        self.count = len(self.events())
+        self._fd = self._open()
+
+    def _open(self) -> int:
+        """Open the journal for appending (and make it if it isn't there)."""
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | \
+            getattr(os, "O_BINARY", 0)
+        return os.open(self.path, flags, 0o644)
+
+    def record(self, product: str, source: str, target: str,
+               timestamp: float = None) -> None:
+        """Append the move of product from the coordinate source to the
+        coordinate target."""
+        if timestamp is None:
+            timestamp = time.time()
+        line = json.dumps([product, source, target, timestamp]) + "\n"
+        with self.lock:
+            os.write(self._fd, line.encode("utf-8"))
+            if self.sync:
+                os.fsync(self._fd)
+            self.count += 1
+
+    def events(self) -> list[tuple[str, str, str, float]]:
+        """Return every move that hasn't made it into a snapshot yet, oldest
+        first."""
+        return read_journal(self.path + ".compacting") + \
+            read_journal(self.path)
+
+    def rotate(self) -> None:
+        """Move the journal to path.compacting and start a new empty one. If
+        path.compacting is still there (the last compaction failed), the
+        journal is tacked onto the end of it instead, so no move is ever
+        dropped before it is in a snapshot."""
+        compacting = self.path + ".compacting"
+        with self.lock:
+            os.close(self._fd)
+            if os.path.exists(compacting):
+                with open(self.path, "rb") as f, open(compacting, "ab") as g:
+                    g.write(f.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, compacting)
+            self._fd = self._open()
+            self.count = 0
+
+    def finish_rotation(self) -> None:
+        """Throw away path.compacting, once its moves are in a snapshot."""
+        if os.path.exists(self.path + ".compacting"):
+            os.remove(self.path + ".compacting")
+
+    def clear(self) -> None:
+        """Throw away every move (for when the tree was built from scratch, or
+        saved somewhere that already has all of them)."""
+        with self.lock:
+            os.close(self._fd)
+            with open(self.path, "wb"):
+                pass
+            self.finish_rotation()
+            self._fd = self._open()
+            self.count = 0
+
+    def close(self) -> None:
+        with self.lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def read_journal(path: str) -> list[tuple[str, str, str, float]]:
+    """Return the moves in the journal at path. A line that got cut off by a
+    crash can only ever be the last one, and it gets ignored."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        lines = f.read().split(b"\n")
+    result = []
+    # The last element is whatever came after the last newline, which is
+    # either nothing or a half written move
+    for line in lines[:-1]:
+        try:
+            product, source, target, timestamp = json.loads(line)
+        except ValueError:
+            break
+        result.append((product, source, target, timestamp))
+    return result
+
+
+def replay(tree: dict, events: list) -> int:
+    """Apply the moves in events to tree (room -> shelf -> level -> sorted
+    product list) and return how many actually happened. A move is skipped
+    if the product isn't at the from level, or the to level doesn't exist."""
+    count = 0
+    for product, source, target, timestamp in events:
+        room, x, y = source.split('.')[:3]
+        products = tree.get(room, {}).get(x, {}).get(y)
+        room, x, y = target.split('.')[:3]
+        destination = tree.get(room, {}).get(x, {}).get(y)
+        if products is None or destination is None:
+            continue
+        if remove_sorted(products, product):
+            insort(destination, product)
+            count += 1
+    return count
+
+
+def copy_tree(tree: dict) -> dict:
+    """Return a copy of tree that doesn't share any lists with it."""
+    return {room: {x: {y: list(tree[room][x][y]) for y in tree[room][x]}
+                   for x in tree[room]} for room in tree}
+
+
+def compact(journal: MoveJournal, tree, path: str,
+            z_labels: list[str] = None) -> None:
+    """Fold the journal into a new snapshot of tree at path (see the comment
+    at the top). tree can also be a function that returns the tree, which is
+    then called with the lock held."""
+    with journal.compacting:
+        with journal.lock:
+            if callable(tree):
+                tree = tree()
+            save = copy_tree(tree)
+            journal.rotate()
+        # Moves can keep on happening while the snapshot is written.
+        # write_snapshot only returns once it's on the disk, so only then is
+        # the journal that has the same moves thrown away
+        write_snapshot(path, save, z_labels)
+        journal.finish_rotation()
+
+
+def save(journal: MoveJournal, tree: dict, path: str,
+         z_labels: list[str] = None) -> None:
+    """Write a snapshot of tree at path right now, and throw away the journal
+    since every move is in there."""
+    with journal.compacting:
+        with journal.lock:
+            # On the disk before the journal goes (see compact)
+            write_snapshot(path, tree, z_labels)
+            journal.clear()
+
+
+class Compactor(threading.Thread):
+    """A background thread that compacts the journal once it has at least
+    threshold moves, checking every interval seconds.
+    ============================================================================
+    Attributes |
+    ===========
+    journal: The MoveJournal to compact.
+
+    tree: A function that returns the tree the moves are being made on. It's
+          asked again at every compaction, since UpdatedInventory.reload
+          swaps the whole tree out (so pass lambda: inventory.tree, not
+          inventory.tree).
+
+    path, z_labels: Where the snapshot goes, and its z coordinates (None for
+                    the usual a, b, ..., aa, ..., see write_snapshot).
+
+    threshold, interval: See above.
+    """
+
+    def __init__(self, journal: MoveJournal, tree, path: str,
+                 z_labels: list[str] = None, threshold: int = 200,
+                 interval: float = 30.0) -> None:
+        super().__init__(daemon=True)
+        self.journal = journal
+        self.tree = tree
+        self.path = path
+        self.z_labels = z_labels
+        self.threshold = threshold
+        self.interval = interval
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            if self.journal.count >= self.threshold:
+                try:
+                    compact(self.journal, self.tree, self.path, self.z_labels)
+                except OSError as e:
+                    # Nothing is lost, the moves are still in the journal
+                    print(f"Compaction failed: {e}")
+
+    def stop(self) -> None:
+        """Stop checking (a compaction that already started still
+        finishes)."""
+        self._done.set()
@@ -0,0 +1,351 @@
+import os
+import re
+import json
+import pandas as pd
+from inventoryStructure import AtomicTree, CategoryGroups, LinkedCycle, \
+    stable_deconstruct, compile_find
+
+################################################################################
+# Layout specs
+#
+# The store layout used to be a hard-coded chain of atom.nuke(...) calls in the
+# __main__ blocks, walking around with curr.subtrees[5] and
+# curr.parent.subtrees[...]. Now the whole split tree is written down in a JSON
+# file (see layout.json) and this module turns it into a LayoutPlan:
+#
+#   - "coordinate", "column" and "find" are the root AtomicTree.
+#   - "splits" is a list of nukes. "at" is the path of coordinates from the root
+#     down to the tree being nuked ([] is the root itself, ["F", "Remainder"] is
+#     the Remainder under F), "n" is the n of nuke, and the rest are the exact
+#     same keys as the split dicts in inventoryStructure.py. JSON has no tuples,
+#     so a regular expression in find is written as {"regex": "..."}.
+#     A sorted split can also have a "capacity": how much room each of its
+#     pieces has, so they get packed onto the shelves instead of all getting
+#     the same number of rows (see packing.py).
+#   - "footprint" is the columns that multiply up to how much room a row takes
+#     (like ["Footprint", "Quantity"]) in a split with a capacity. Without it
+#     every row takes up 1, so a capacity is how many products fit.
+#   - "cycles" are the LinkedCycles to hook up between the front and the back.
+#   - "distances" is how far apart the shelves are, for planning pick paths
+#     (see pick_path.py).
+#
+# compile_layout checks the whole spec ONCE (so a typo blows up before we touch
+# a single row instead of halfway down the tree), and LayoutPlan.build runs every
+# split with one shared CategoryGroups instead of having every node filter
+# "Category Code" on its own. build_many does the same for a bunch of stores.
+# Every find gets compiled right there too (see FindRule in inventoryStructure),
+# so a broken regex is a LayoutError.
+################################################################################
+
+# The layout of the store, sitting right next to this file
+LAYOUT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "layout.json")
+
+# Columns that go in "columns" for trees that won't be split any further
+LEAF_COLUMNS = ["TERMINATED", "Terminated"]
+
+
+class LayoutError(Exception):
+    """Raised when a layout spec (or the DataFrame it is run over) doesn't make
+    sense."""
+
+
+def load_layout(path: str = LAYOUT) -> dict:
+    """Return the layout spec saved in the JSON file at path."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def find_value(value):
+    """Return the find value in the way boolean_split wants it. That means
+    {"regex": ...} becomes a tuple, and lists are converted all the way down.
+    >>> find_value([{"regex": "(_1x|_2x)"}, "_3x", None])
+    [('(_1x|_2x)',), '_3x', None]
+    """
+    if isinstance(value, dict):
+        if set(value) != {"regex"}:
+            raise LayoutError("Unknown find value " + str(value))
+        regex = value["regex"]
+        if isinstance(regex, list):
+            return tuple(regex)
+        return regex,
+    if isinstance(value, list):
+        return [find_value(elm) for elm in value]
+    return value
+
+
+def partitions(main: bool, column: str, find, n: int) -> int:
+    """Return how many DataFrames a nuke makes BEFORE the category remainder
+    is tacked on (see sorting_algorithm)."""
+    if main:
+        return 2
+    if column == "":
+        return 1
+    if find:
+        if isinstance(find, list):
+            return len(find) + 1
+        return 2
+    return n
+
+
+class LayoutPlan:
+    """A layout spec that has been checked and is ready to be run.
+    ============================================================================
+    Attributes |
+    ===========
+    name: The name of the layout (usually the store).
+
+    coordinate, column, find: The root AtomicTree.
+
+    steps: A list of (path, n, kwargs) tuples. One for every nuke, in an order
+           where a tree is always made before it gets nuked. A packed split
+           has its capacity and footprint in kwargs too.
+
+    cycles: A list of (name, front coordinate, back coordinate) tuples.
+
+    columns: A set of every column that the DataFrame needs to have.
+    """
+
+    def __init__(self, name: str, coordinate: str, column: str, find,
+                 steps: list, cycles: list, columns: set) -> None:
+        self.name = name
+        self.coordinate = coordinate
+        self.column = column
+        self.find = find
+        self.steps = steps
+        self.cycles = cycles
+        self.columns = columns
+
+    def build(self, df: pd.DataFrame, shared: bool = True,
+              processes: int | None = None) -> AtomicTree:
+        """Return the fully nuked AtomicTree of df, with the sorted lists
+        filled in and the LinkedCycles hooked up. With shared=True (see
+        AtomicTree) the trees only hold row positions into df instead of their
+        own copies. Given processes, the categories are built in a pool of that
+        many processes instead (see parallel_build.py), which always makes a
+        shared tree."""
+        if processes:
+            return self.build_many({self.name: df}, shared,
+                                   processes)[self.name]
+        atom = self.split(df, shared)
+        atom.traverse_and_apply(stable_deconstruct)
+        self.link(atom)
+        return atom
+
+    def split(self, df: pd.DataFrame, shared: bool = True,
+              skip_missing: bool = False) -> AtomicTree:
+        """Return the AtomicTree of df with every split in the plan done, but
+        without the sorted lists or the LinkedCycles (build does those). With
+        skip_missing=True a split of a tree that isn't there is skipped instead
+        of being a LayoutError. A remainder only gets made if it has rows, so
+        that happens when df is just part of the catalog (like one
+        category)."""
+        self.check(df)
+        # CategoryGroups wants the index to be the position in the root
+        df = df.reset_index(drop=True)
+        groups = CategoryGroups(df)
+        atom = AtomicTree(self.coordinate, self.column, df,
+                          main=True, find=self.find, shared=shared)
+        for path, n, kwargs in self.steps:
+            curr = atom
+            for coordinate in path:
+                if skip_missing:
+                    curr = _find_child(curr, coordinate)
+                    if curr is None:
+                        break
+                else:
+                    curr = _child(curr, coordinate, path)
+            if curr is not None:
+                curr.nuke(n, groups=groups, **kwargs)
+        return atom
+
+    def check(self, df: pd.DataFrame) -> None:
+        """Raise a LayoutError if df is missing a column the plan needs, or
+        has rows with no Category Code (no split would ever take them, see
+        ingest.read_inventory, which drops them)."""
+        missing = self.columns - set(df.columns)
+        if missing:
+            raise LayoutError("Missing columns " + str(sorted(missing)))
+        count = int(df["Category Code"].isna().sum())
+        if count:
+            raise LayoutError(str(count) + " rows have no Category Code")
+
+    def link(self, atom: AtomicTree) -> None:
+        """Hook up the LinkedCycles of the plan in atom."""
+        for name, front, back in self.cycles:
+            LinkedCycle(name, atom, front, back)
+
+    def cycle_addresses(self) -> dict[tuple, tuple]:
+        """Return a dict with the (room, x, y) of each end of every cycle
+        pointing to the (room, x, y) of the other end. This is where
+        Node.move_item sends things, for when there is no tree around (the
+        data was loaded from a snapshot)."""
+        rooms = [kwargs["coordinates"] for path, n, kwargs in self.steps
+                 if not path][0]
+        result = {}
+        for name, front, back in self.cycles:
+            # The same x and y that bijection uses for a leaf
+            front = rooms[0], front[0], front[2]
+            back = rooms[1], back[0], back[2]
+            result[front] = back
+            result[back] = front
+        return result
+
+    def build_many(self, frames: dict[str, pd.DataFrame],
+                   shared: bool = True, processes: int | None = None) -> dict:
+        """Return a dict with every store in frames pointing to its
+        AtomicTree. Given processes, every category of every store is built in
+        the same pool of that many processes, so a big rebuild of a lot of
+        stores keeps every core busy."""
+        if processes:
+            # Imported here so the one-process build never pays for it
+            from parallel_build import build_parallel
+            return build_parallel(self, frames, processes)
+        result = {}
+        for store in frames:
+            result[store] = self.build(frames[store], shared)
+        return result
+
+
+def _find_child(curr: AtomicTree, coordinate: str) -> AtomicTree | None:
+    """Return the subtree of curr with this coordinate, or None if there isn't
+    one."""
+    for subtree in curr.subtrees:
+        if subtree.coordinate == coordinate:
+            return subtree
+    return None
+
+
+def _child(curr: AtomicTree, coordinate: str, path: list[str]) -> AtomicTree:
+    """Return the subtree of curr with this coordinate."""
+    subtree = _find_child(curr, coordinate)
+    if subtree is not None:
+        return subtree
+    raise LayoutError("Nothing at " + str(path) + " (no " + coordinate +
+                      " under " + curr.coordinate + ")")
+
+
+def compile_layout(spec: dict) -> LayoutPlan:
+    """Return the LayoutPlan of spec, or raise a LayoutError if the spec is
+    broken."""
+    for key in ["coordinate", "column", "splits"]:
+        if key not in spec:
+            raise LayoutError("The layout needs a " + key)
+    root_find = find_value(spec.get("find"))
+    footprint = spec.get("footprint", [])
+    if not isinstance(footprint, list) or \
+            not all(isinstance(elm, str) for elm in footprint):
+        raise LayoutError("The footprint needs to be a list of columns")
+    # Every tree that exists so far. A path points to (main, column, find) of
+    # the tree, which is what decides how it gets split.
+    trees = {(): (True, spec["column"], root_find)}
+    nuked = set()
+    steps = []
+    columns = {"Category Code", "Product Name"}
+    for split in spec["splits"]:
+        path = tuple(split.get("at", []))
+        where = "split at " + str(list(path))
+        if path not in trees:
+            raise LayoutError(where + " comes before that tree is made")
+        if path in nuked:
+            raise LayoutError(where + " nukes the same tree twice")
+        for key in ["n", "cat", "coordinates", "columns", "stable"]:
+            if key not in split:
+                raise LayoutError(where + " needs a " + key)
+        n = split["n"]
+        coordinates = split["coordinates"]
+        if not isinstance(n, int) or n < 1:
+            raise LayoutError(where + " needs n to be a positive int")
+        if not coordinates or len(set(coordinates)) != len(coordinates):
+            raise LayoutError(where + " needs unique coordinates")
+        if "find" in split:
+            find = find_value(split["find"])
+        else:
+            find = None
+        # The lists all need to line up with the coordinates, except for the
+        # 'simple' kind of split where columns and stable are single values.
+        simple = not isinstance(split["columns"], list)
+        if simple == isinstance(split["stable"], list):
+            raise LayoutError(where + " has a list for only one of columns "
+                                      "and stable")
+        lists = [find] if find is not None else []
+        if not simple:
+            lists += [split["columns"], split["stable"]]
+        for elm in lists:
+            if not isinstance(elm, list) or len(elm) != len(coordinates):
+                raise LayoutError(where + " doesn't have a columns/stable/find"
+                                          " value for every coordinate")
+
+        main, column, node_find = trees[path]
+        if not main and column != "" and node_find:
+            # A boolean split, so its patterns get compiled right here (once)
+            try:
+                compile_find(node_find if isinstance(node_find, list)
+                             else [node_find])
+            except re.error as error:
+                raise LayoutError(where + " has a broken regex: " + str(error))
+        if main and (n != 2 or len(coordinates) != 2):
+            raise LayoutError(where + " is the front/back split, so it needs n "
+                                      "to be 2 and 2 coordinates")
+        count = partitions(main, column, node_find, n)
+        if len(coordinates) not in [count, count + 1]:
+            raise LayoutError(where + " makes " + str(count) +
+                              " DataFrames (plus maybe a remainder), but has " +
+                              str(len(coordinates)) + " coordinates")
+        if column:
+            columns.add(column)
+        capacity = split.get("capacity")
+        if capacity is not None:
+            if main or column == "" or node_find:
+                raise LayoutError(where + " isn't a sorted split, so it can't "
+                                          "have a capacity")
+            if not isinstance(capacity, list) or len(capacity) != count or \
+                    not all(isinstance(elm, (int, float)) and
+                            not isinstance(elm, bool) and elm >= 0
+                            for elm in capacity) or not any(capacity):
+                raise LayoutError(where + " needs a capacity for each of its "
+                                  + str(count) + " pieces (numbers that "
+                                  "aren't negative, and not all 0)")
+            columns.update(footprint)
+
+        # Now the subtrees exist
+        for i in range(len(coordinates)):
+            if simple:
+                if i == len(coordinates) - 1:
+                    child_column = split["columns"]
+                else:
+                    child_column = LEAF_COLUMNS[1]
+            else:
+                child_column = split["columns"][i]
+            if find is None:
+                child_find = None
+            else:
+                child_find = find[i]
+            if not isinstance(child_column, str):
+                # Like [] in the split dicts, which just means "not split"
+                child_column = LEAF_COLUMNS[0]
+            trees[path + (coordinates[i],)] = False, child_column, child_find
+        nuked.add(path)
+        kwargs = {key: split[key] for key in ["cat", "coordinates", "columns",
+                                              "stable"]}
+        if find is not None:
+            kwargs["find"] = find
+        if capacity is not None:
+            kwargs["capacity"] = capacity
+            kwargs["footprint"] = footprint
+        steps.append((list(path), n, kwargs))
+
+    cycles = []
+    rooms = [path[0] for path in trees if len(path) == 1]
+    for cycle in spec.get("cycles", []):
+        name, front, back = cycle["name"], cycle["front"], cycle["back"]
+        if len(rooms) < 2:
+            raise LayoutError("cycle " + name + " needs a front and a back")
+        for room, coordinate in [(rooms[0], front), (rooms[1], back)]:
+            if not any(path[0] == room and path[-1] == coordinate
+                       for path in trees if len(path) > 1):
+                raise LayoutError("cycle " + name + " points at " + coordinate
+                                  + ", which isn't in " + room)
+        cycles.append((name, front, back))
+    return LayoutPlan(spec.get("name", ""), spec["coordinate"], spec["column"],
+                      root_find, steps, cycles, columns)
@@ -0,0 +1,326 @@
+import sys
+from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QLineEdit, \
+    QPushButton, QVBoxLayout, QWidget, QMessageBox, QTreeView
+from PyQt5.QtGui import QStandardItemModel, QStandardItem
+import inventory_documentation as documentation
+from journal import MoveJournal, save
+from snapshot import write_snapshot
+
+################################################################################
+# The PyQt5 app (PACIOS)
+#
+# This used to live in inventory_documentation, which meant importing the
+# backend imported all of Qt too. Now it's only imported when the app actually
+# runs (inventory_documentation.main), so the backend can be imported by things
+# that never show a window (the service, workers, the benchmark).
+################################################################################
+
+
+class ProductLookupApp(QMainWindow):
+    def __init__(self, inventory):
+        super().__init__()
+        self.inventory = inventory
+        self.initUI()
+        self.data_window = None
+        self.inventory_layout_window = None
+
+    def initUI(self):
+        self.setWindowTitle("PACIOS")
+
+        # Create a central widget
+        central_widget = QWidget()
+        # self.setCentralWidget(central_widget)
+
+        layout = QVBoxLayout()
+
+        # Create a label for the starting menu
+        title = \
+            "Paradise Air Coordinated Inventory Operating System (PACIOS)"
+        start_label = QLabel(title)
+        layout.addWidget(start_label)
+
+        # Create a search bar
+        search_label = QLabel("Enter product name:")
+        layout.addWidget(search_label)
+
+        self.search_entry1 = QLineEdit()
+        layout.addWidget(self.search_entry1)
+
+        # Create a search button
+        search_button1 = QPushButton("Search")
+        search_button1.clicked.connect(self.search_product)
+        layout.addWidget(search_button1)
+
+        # Create a label to display the results
+        self.result_label = QLabel("")
+        layout.addWidget(self.result_label)
+
+        # Have a search bar that allows you to MOVE product
+        search_label = QLabel("If item must be moved, type item name:")
+        layout.addWidget(search_label)
+
+        self.search_entry2 = QLineEdit()
+        layout.addWidget(self.search_entry2)
+
+        # Create a Move button
+        search_button2 = QPushButton("Move")
+        search_button2.clicked.connect(self.move_item)
+        layout.addWidget(search_button2)
+
+        # Create a label to display the results
+        self.result_label = QLabel("")
+        layout.addWidget(self.result_label)
+
+        # Create a Data page button
+        data_window_button = QPushButton("Open Data Window")
+        data_window_button.clicked.connect(self.openDataWindow)
+        layout.addWidget(data_window_button)
+
+        central_widget.setLayout(layout)
+
+        # Create a inventory layout page button
+        inventory_layout_button = QPushButton("Open Inventory Layout")
+        inventory_layout_button.clicked.connect(self.openLayoutWindow)
+        layout.addWidget(inventory_layout_button)
+
+        central_widget.setLayout(layout)
+
+        # Set the central widget
+        self.setCentralWidget(central_widget)
+
+    def openDataWindow(self):
+        print("DATA WINDOW ACTIVATED")
+        if self.data_window is None:
+            self.data_window = DataWindow(self.inventory.tree,
+                                          journal=self.inventory.journal,
+                                          stats=self.inventory.cache_stats(),
+                                          path=self.inventory.path)
+        self.data_window.show()
+        self.hide()
+
+    def openLayoutWindow(self):
+        print("INVENTORY LAYOUT WINDOW ACTIVATED")
+        if self.inventory_layout_window is None:
+            page = InventoryLayoutWindow(self.inventory.tree)
+            self.inventory_layout_window = page
+        self.inventory_layout_window.show()
+
+    def search_product(self):
+        # Retrieve the user's input from the search bar
+        search_query = self.search_entry1.text()
+        # search_query = self.sender()
+        name, coordinate = self.inventory.fetch(search_query)
+        statement = (name +
+                     " is at " + coordinate)
+        self.result_label.setText(statement)
+
+    def move_item(self):
+        """Call the item_to_loc method for the class. If the operation was
+        successful, there should be a pop-up that says the move was successful.
+        If not, say it was unsuccessful."""
+        search_query = self.search_entry2.text()
+        # This will give you the exact name of the product
+        product = self.inventory.fetch(search_query)[0]
+
+        rooms = ["F", "B"]
+        for room in rooms:
+            try:
+                self.inventory.item_to_loc(product, room)
+                break
+            except KeyError:
+                pass
+
+        # The following are messages
+        name, coordinate = self.inventory.fetch(search_query)
+        message = name + " is now at " + coordinate
+        self.result_label.setText(message)
+
+
+class DataWindow(QMainWindow):
+    def __init__(self, data: dict[dict[list[str]]], parent=None,
+                 journal: MoveJournal = None, stats: dict = None,
+                 path: str = documentation.STORAGE):
+        """path is where the inventory's snapshot goes, or None if this
+        isn't the one to write it (a service.RemoteInventory, whose service
+        keeps the snapshot and the journal)."""
+        super().__init__(parent)
+        self.stats = stats
+        self.initUI()
+        self.data = data
+        self.journal = journal
+        self.path = path
+
+    def initUI(self):
+        self.setWindowTitle("Data Window")
+        self.setGeometry(300, 200, 400, 200)
+
+        # Create a central widget
+        central_widget = QWidget()
+        # self.setCentralWidget(central_widget)
+
+        layout = QVBoxLayout()
+
+        # Create a label for the starting menu
+        title = \
+            "Save and close or clear all data"
+        start_label = QLabel(title)
+        layout.addWidget(start_label)
+
+        # How the search cache is doing (see search_index.py)
+        if self.stats is not None:
+            search = self.stats["search"]
+            total = max(search["hits"] + search["misses"], 1)
+            statement = f"Search cache: {search['hits']} hits, " \
+                        f"{search['misses']} misses " \
+                        f"({100 * search['hits'] / total:.0f}% hit rate), " \
+                        f"{search['size']}/{search['max_size']} saved"
+            layout.addWidget(QLabel(statement))
+
+        # Create a button to simulate data
+        self.save_button = QPushButton("Save Data and Close")
+        self.save_button.clicked.connect(self.save_data_and_close)
+        layout.addWidget(self.save_button)
+
+        # Create a button to simulate data
+        self.clear_button = QPushButton("Reset the inventory", self)
+        self.clear_button.clicked.connect(self.showConfirmationDialog)
+        layout.addWidget(self.clear_button)
+
+        # Add the button to the layout
+        central_widget.setLayout(layout)
+        self.setCentralWidget(central_widget)
+
+    def showConfirmationDialog(self):
+        if self.path is None:
+            statement = 'The inventory is kept by the service. ' \
+                        'Reset it there.'
+            QMessageBox.information(self, 'Information', statement)
+            return
+        # Create a confirmation dialog
+        confirmation = QMessageBox.question(self,
+                                            'Confirmation',
+                                            'Are you sure you want to proceed?',
+                                            QMessageBox.Yes | QMessageBox.No)
+
+        # Check the user's choice
+        if confirmation == QMessageBox.Yes:
+            self.clear_all()
+            statement = 'Resetting all data. LOAD CSV FILE.'
+            QMessageBox.information(self, 'Information', statement)
+            self.close()
+        else:
+            # User clicked No, do nothing or handle accordingly
+            print('User clicked No. Canceled.')
+
+    def save_data_and_close(self):
+        """After closing the application the data should be stored in the
+        snapshot file (the service's job, if the inventory is remote)"""
+        try:
+            if self.path is not None:
+                documentation.close_storage()
+                if self.journal is not None:
+                    # Every move is in the snapshot now
+                    save(self.journal, self.data, self.path)
+                else:
+                    write_snapshot(self.path, self.data)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+
+        # Close the application
+        self.close()
+
+    def clear_all(self) -> None:
+        """This method should clear everything, but it would now require the csv
+        file to work. A remote inventory is left alone (see
+        showConfirmationDialog)."""
+        if self.path is None:
+            return
+        old = {"F": {
+            "0": [],
+            "1": [],
+            "2": [],
+            "3": [],
+            "4": [],
+            "5": []
+        },
+            "B": {
+                "0": [],
+                "1": [],
+                "3": [],
+                "4": [],
+                "5": []
+            }}
+        try:
+            documentation.close_storage()
+            write_snapshot(self.path, old)
+            if self.journal is not None:
+                self.journal.clear()
+        except Exception as e:
+            print(f"An error occurred: {e}")
+
+    def mousePressEvent(self, event):
+        # Close the data window and show the starting menu when the data window
+        # is clicked
+        self.close()
+        self.parent().show()
+
+
+class InventoryLayoutWindow(QMainWindow):
+    def __init__(self, data_dict: dict[dict[list[str]]], parent=None):
+        super().__init__(parent)
+        self.data_dict = data_dict
+        self.initUI()
+
+    def initUI(self):
+        self.setWindowTitle('Tree Visualization')
+        self.setGeometry(500, 500, 400, 300)
+
+        # Create a QTreeView widget
+        self.tree_view = QTreeView(self)
+        self.tree_view.setGeometry(10, 10, 380, 280)
+
+        # Create a QStandardItemModel to represent the tree
+        self.tree_model = QStandardItemModel()
+        self.tree_model.setHorizontalHeaderLabels(["Tree Nodes"])
+
+        # Create root item
+        root_item = self.tree_model.invisibleRootItem()
+
+        # Populate the tree model from the JSON dictionary
+        self.populateTree(root_item, self.data_dict)
+
+        # Set the model for the QTreeView
+        self.tree_view.setModel(self.tree_model)
+
+    def populateTree(self, parent_item, data):
+        if isinstance(data, dict):
+            for key, value in data.items():
+                key_item = self.addTreeItem(parent_item, key)
+                self.populateTree(key_item, value)
+        elif isinstance(data, list):
+            for item in data:
+                self.populateTree(parent_item, item)
+        else:
+            self.addTreeItem(parent_item, str(data))
+
+    def addTreeItem(self, parent, text):
+        item = QStandardItem(text)
+        parent.appendRow(item)
+        return item
+
+    def mousePressEvent(self, event):
+        # Close the data window and show the starting menu when the data window
+        # is clicked
+        self.close()
+        self.parent().show()
+
+
+
+def main(inventory) -> None:
+    """Run the app on inventory (an UpdatedInventory, or a
+    service.RemoteInventory)."""
+    app = QApplication(sys.argv)
+    window = ProductLookupApp(inventory)
+    # window = DataWindow()
+    window.show()
+    sys.exit(app.exec_())
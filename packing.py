@@ -0,0 +1,215 @@
+import numpy as np
+import pandas as pd
+
+################################################################################
+# Capacity-aware splits
+#
+# sorting_split used to cut a category into n pieces with the same number of
+# rows (np.array_split), as if every shelf held the same amount and every
+# product took the same room. Real shelves don't, and real products don't
+# either, so a split can be given:
+#
+#   - a capacity for every piece (how much room that shelf has, in whatever
+#     unit the footprints are in), and
+#   - a footprint for every row, which is its box size times how many of it
+#     there are (see footprints).
+#
+# The pieces of a sorting split are tiers (the cheapest flowers on 1.2, the
+# next ones on 2.2, ...), and route sends a new row to its piece by the
+# biggest value in each piece (see split_bounds and chunk_index in
+# inventoryStructure). So the products can't be thrown into whichever shelf
+# they fit like first-fit-decreasing would: every piece still has to be a run
+# of the sorted rows, and only where the cuts go changes. pack_cuts picks them:
+#
+#   1. The fullest shelf is made as empty as it can be. How full a shelf is,
+#      is its footprint over its capacity, and the smallest possible worst one
+#      is found by bisection: for a fill f, going down the rows and giving every
+#      shelf as much as it can hold at f tells you if f works, which is one
+#      searchsorted over the running total per shelf.
+#   2. Then every cut is put as close as it can get to where the room so far
+#      says it should be (shelf j ends where the first j capacities' share of
+#      the total footprint ends), without making any shelf fuller than that.
+#      So shelves that all have room come out equally full, and with equal
+#      capacities and footprints of 1 it's the same as np.array_split, give or
+#      take a row.
+#
+# That's O(n log n) for the sort the split does anyway, plus O(n) for the
+# running total and O(shelves * log n) per bisection step, which comes to a
+# few milliseconds on top of the sort whether the category has a thousand SKUs
+# or twenty thousand.
+#
+# The rows within a piece keep the order they were sorted in, and the products
+# on a shelf get put in alphabetical order after that like always (see
+# stable_deconstruct).
+################################################################################
+
+# How many times the fill gets cut in half (a float64 runs out long before)
+STEPS = 64
+
+# A footprint that's missing or isn't a number counts as this much
+DEFAULT_FOOTPRINT = 1.0
+
+
+def footprints(df: pd.DataFrame, columns: list[str] | None) -> np.ndarray:
+    """Return the footprint of every row of df, which is the product of
+    columns (like ["Footprint", "Quantity"]). With no columns every row takes
+    up 1, so capacities are just how many products fit. A value that's missing
+    or isn't a number is DEFAULT_FOOTPRINT, and a negative one is 0.
+    >>> df = pd.DataFrame({"Footprint": [2, 1.5, None], "Quantity": [3, 0, 2]})
+    >>> footprints(df, ["Footprint", "Quantity"]).tolist()
+    [6.0, 0.0, 2.0]
+    >>> footprints(df, None).tolist()
+    [1.0, 1.0, 1.0]
+    """
+    result = np.ones(len(df))
+    for column in columns or []:
+        values = pd.to_numeric(df[column], errors="coerce").to_numpy(
+            dtype=np.float64, na_value=np.nan)
+        result *= np.where(np.isnan(values), DEFAULT_FOOTPRINT,
+                           np.maximum(values, 0.0))
+    return result
+
+
+def _greedy(totals: np.ndarray, capacity: np.ndarray, fill: float,
+            start: int = 0, shelf: int = 0) -> np.ndarray:
+    """Return the cut after every shelf from shelf on, going down the rows from
+    start and giving every shelf as much as it holds at fill. totals is the
+    running total of the footprints, with a 0 in front."""
+    cuts = np.empty(len(capacity) - shelf, dtype=np.int64)
+    for i in range(len(cuts)):
+        room = totals[start] + fill * capacity[shelf + i]
+        start = int(np.searchsorted(totals, room, side="right")) - 1
+        cuts[i] = start
+    return cuts
+
+
+def _backward(totals: np.ndarray, capacity: np.ndarray,
+              fill: float) -> np.ndarray:
+    """Return the smallest cut before every shelf such that everything after
+    it fits in that shelf and the ones after it at fill (the same as _greedy,
+    coming up from the last row)."""
+    cuts = np.empty(len(capacity), dtype=np.int64)
+    end = len(totals) - 1
+    for shelf in range(len(capacity) - 1, -1, -1):
+        room = totals[end] - fill * capacity[shelf]
+        end = int(np.searchsorted(totals, room, side="left"))
+        cuts[shelf] = end
+    return cuts
+
+
+def best_fill(sizes: np.ndarray, capacity) -> float:
+    """Return the smallest fill (footprint over capacity) that the fullest
+    shelf can get down to, keeping the rows in order. Raise a ValueError if no
+    shelf has any room, and there's something to put on them.
+    >>> best_fill(np.array([1.0, 1.0, 1.0, 1.0]), [2, 2])
+    1.0
+    >>> best_fill(np.array([3.0, 1.0, 1.0, 1.0]), [4, 2])
+    1.0
+    """
+    capacity = np.asarray(capacity, dtype=np.float64)
+    totals = np.concatenate([[0.0], np.cumsum(sizes)])
+    total = totals[-1]
+    if total == 0:
+        return 0.0
+    if capacity.max() <= 0:
+        raise ValueError("None of the shelves have any room")
+    # Everything on the biggest shelf always works, and no shelf can be less
+    # full than all of them are together
+    low, high = total / capacity.sum(), total / capacity.max()
+    for i in range(STEPS):
+        if high - low <= high * 1e-12:
+            break
+        fill = (low + high) / 2
+        if _greedy(totals, capacity, fill)[-1] == len(sizes):
+            high = fill
+        else:
+            low = fill
+    # high is a hair over the real answer, which is how full the fullest shelf
+    # of the packing at high actually is
+    cuts = _greedy(totals, capacity, high)
+    used = totals[cuts] - totals[np.concatenate([[0], cuts[:-1]])]
+    has_room = capacity > 0
+    return float((used[has_room] / capacity[has_room]).max())
+
+
+def pack_cuts(sizes: np.ndarray, capacity) -> np.ndarray:
+    """Return where to cut rows with these footprints (in the order they go
+    on the shelves) so that shelf i gets rows cuts[i - 1]:cuts[i] (from 0 for
+    the first). The fullest shelf is as empty as it can be, and every cut is as
+    close as it can get to the share of the footprint its shelves should get
+    (see the comment at the top).
+    >>> pack_cuts(np.ones(10), [1, 1, 1]).tolist()
+    [3, 7, 10]
+    >>> pack_cuts(np.ones(10), [3, 1, 1]).tolist()
+    [6, 8, 10]
+    >>> pack_cuts(np.array([5.0, 1.0, 1.0, 1.0, 1.0, 1.0]), [5, 5]).tolist()
+    [1, 6]
+    """
+    capacity = np.asarray(capacity, dtype=np.float64)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    if len(capacity) == 0:
+        raise ValueError("There are no shelves to pack")
+    if sizes.sum() == 0:
+        # Nothing takes up any room, so split them up by count
+        sizes = np.ones(len(sizes))
+    totals = np.concatenate([[0.0], np.cumsum(sizes)])
+    if len(sizes) == 0:
+        return np.zeros(len(capacity), dtype=np.int64)
+    # With a hair to spare, so rounding in the running total can't tip a
+    # shelf over
+    fill = best_fill(sizes, capacity) * (1 + 1e-9)
+    # Where the room says every cut should be
+    share = totals[-1] * np.cumsum(capacity) / capacity.sum()
+    targets = np.searchsorted(totals, share, side="left")
+    lower = _backward(totals, capacity, fill)
+    cuts = np.empty(len(capacity), dtype=np.int64)
+    start = 0
+    for shelf in range(len(capacity) - 1):
+        # The furthest this shelf can go without being fuller than fill, and
+        # the least it has to take so the rest still fit
+        furthest = _greedy(totals, capacity, fill, start, shelf)[0]
+        least = max(int(lower[shelf + 1]), start)
+        target = int(targets[shelf])
+        # The closest row to the target, going by footprint
+        if target > 0 and \
+                share[shelf] - totals[target - 1] < totals[target] - share[shelf]:
+            target -= 1
+        start = min(max(target, least), max(furthest, least))
+        cuts[shelf] = start
+    cuts[-1] = len(sizes)
+    return cuts
+
+
+def capacity_split(df: pd.DataFrame, column: str, capacity,
+                   footprint: list[str] | None = None) -> list[pd.DataFrame]:
+    """Return df sorted by column and cut into one piece per capacity, with the
+    cuts made by pack_cuts over the footprints of the rows (see footprints)."""
+    temp = df.sort_values(column)
+    cuts = pack_cuts(footprints(temp, footprint), capacity)
+    result = []
+    start = 0
+    for end in cuts:
+        result.append(temp.iloc[start:end])
+        start = end
+    return result
+
+
+def fill_report(pieces: list[pd.DataFrame], capacity,
+                footprint: list[str] | None = None) -> list[float]:
+    """Return how full every piece is (its footprint over its capacity, inf
+    for something on a shelf with no room)."""
+    result = []
+    for piece, room in zip(pieces, capacity):
+        used = footprints(piece, footprint).sum()
+        if room > 0:
+            result.append(used / room)
+        elif used > 0:
+            result.append(float("inf"))
+        else:
+            result.append(0.0)
+    return result
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,286 @@
+import heapq
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from inventoryStructure import AtomicTree, stable_deconstruct
+
+################################################################################
+# Parallel build
+#
+# After the front/back split every category goes down its own part of the tree
+# (flower only ever gets split with flower, pre-rolls with pre-rolls, ...), so
+# the categories can be built at the same time in different processes and
+# glued back together at the end:
+#
+#   1. The columns the layout looks at get packed into ONE block of shared
+#      memory (numbers as raw arrays, categoricals as their codes, strings as
+#      one utf-8 blob plus where each one starts). Workers attach to it by name,
+#      so nobody pickles a DataFrame.
+#   2. Every worker takes the rows of one category and runs the whole plan on
+#      just those. A split whose tree isn't there (a remainder that came out
+#      empty because it only had the OTHER categories) is skipped.
+#   3. The worker sends back, for every tree, its rows as positions in the full
+#      catalog, and for every leaf its already sorted product names.
+#   4. The parent puts every tree back together: its rows are the rows of every
+#      category glued in the order the categories show up in the catalog, which
+#      is exactly the order the one-process build makes, and the sorted lists of
+#      a leaf get merged.
+#
+# So the tree that comes out is the same as LayoutPlan.build's, just made by
+# more than one core. It's opt-in (LayoutPlan.build(df, processes=4)), since for
+# a small catalog starting the processes costs more than it saves.
+################################################################################
+
+
+class SharedFrame:
+    """Some columns of a DataFrame packed into one block of shared memory.
+    ============================================================================
+    Attributes |
+    ===========
+    shm: The SharedMemory block. Only the process that made it unlinks it.
+
+    meta: A small dict object that says where everything is in shm. It's what
+          gets sent to the workers (along with shm.name), so it has to stay
+          picklable and tiny: {"rows": how many rows, "columns": [(name, kind,
+          dtype, start, ...), ...]}. kind is "array" for a column of numbers
+          (start, nbytes), "category" for a categorical column (start and
+          nbytes of the codes, and the categories) and "text" for a column of
+          strings (start of the offsets, start of the blob, size of the blob,
+          start of the missing mask).
+    """
+
+    def __init__(self, df: pd.DataFrame, columns: list[str]) -> None:
+        pieces = []
+        specs = []
+        size = 0
+
+        def place(array: np.ndarray) -> int:
+            # Every piece starts on an 8 byte boundary so the views line up
+            nonlocal size
+            start = size
+            pieces.append((start, array))
+            size += (array.nbytes + 7) // 8 * 8
+            return start
+
+        for name in columns:
+            if isinstance(df[name].dtype, pd.CategoricalDtype):
+                codes = np.ascontiguousarray(df[name].cat.codes.to_numpy())
+                specs.append((name, "category", codes.dtype.str, place(codes),
+                              codes.nbytes,
+                              df[name].cat.categories.tolist()))
+                continue
+            values = df[name].to_numpy()
+            if values.dtype.kind in "biuf":
+                values = np.ascontiguousarray(values)
+                specs.append((name, "array", values.dtype.str, place(values),
+                              values.nbytes))
+            elif values.dtype.kind == "O":
+                specs.append((name, "text", None) + _pack_text(name, values,
+                                                               place))
+            else:
+                raise TypeError("Can't share column " + name + " of type " +
+                                str(values.dtype))
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for start, array in pieces:
+            view = np.frombuffer(array.tobytes(), dtype=np.uint8)
+            self.shm.buf[start:start + len(view)] = view
+        self.meta = {"rows": len(df), "columns": specs}
+
+    def close(self) -> None:
+        """Free the shared memory (every worker should be done with it)."""
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _pack_text(name: str, values: np.ndarray, place) -> tuple:
+    """Place a column of strings (or missing values) and return (start of the
+    offsets, start of the blob, size of the blob, start of the missing
+    mask)."""
+    missing = pd.isna(values)
+    strings = values.copy()
+    strings[missing] = ""
+    if pd.api.types.infer_dtype(strings) not in ["string", "empty"]:
+        raise TypeError("Can't share column " + name + ", it isn't all "
+                        "strings")
+    strings = strings.tolist()
+    joined = "".join(strings)
+    if joined.isascii():
+        # One character is one byte, so the whole thing encodes at once
+        blob = joined.encode("ascii")
+        lengths = np.fromiter(map(len, strings), dtype=np.int64,
+                              count=len(strings))
+    else:
+        encoded = [elm.encode("utf-8") for elm in strings]
+        blob = b"".join(encoded)
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64,
+                              count=len(encoded))
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    blob = np.frombuffer(blob, dtype=np.uint8)
+    return place(offsets), place(blob), len(blob), \
+        place(missing.astype(np.uint8))
+
+
+def read_columns(buf, meta: dict, category) -> tuple[np.ndarray, dict]:
+    """Return (positions, columns) for the rows of category in a SharedFrame's
+    buffer, where positions are their rows in the full catalog and columns is
+    a dict with every column's values for just those rows."""
+    rows = meta["rows"]
+    arrays = {}
+    for spec in meta["columns"]:
+        if spec[1] in ["array", "category"]:
+            name, kind, dtype, start, nbytes = spec[:5]
+            arrays[name] = np.frombuffer(buf, dtype=np.dtype(dtype),
+                                         count=rows, offset=start)
+    kinds = {spec[0]: spec for spec in meta["columns"]}
+    if kinds["Category Code"][1] == "category":
+        # Look for its code instead
+        category = kinds["Category Code"][5].index(category)
+    positions = np.flatnonzero(arrays["Category Code"] == category)
+    columns = {}
+    for spec in meta["columns"]:
+        name = spec[0]
+        if spec[1] == "array":
+            columns[name] = arrays[name][positions]
+            continue
+        if spec[1] == "category":
+            columns[name] = pd.Categorical.from_codes(arrays[name][positions],
+                                                      spec[5])
+            continue
+        name, kind, dtype, offsets, start, size, missing = spec
+        offsets = np.frombuffer(buf, dtype=np.int64, count=rows + 1,
+                                offset=offsets)
+        missing = np.frombuffer(buf, dtype=np.uint8, count=rows,
+                                offset=missing)
+        blob = bytes(buf[start:start + size])
+        # Plain ints, since indexing numpy arrays one at a time is slow
+        starts = offsets[positions].tolist()
+        ends = offsets[positions + 1].tolist()
+        values = np.empty(len(positions), dtype=object)
+        values[:] = [blob[i:j].decode("utf-8") for i, j in zip(starts, ends)]
+        values[missing[positions].astype(bool)] = np.nan
+        columns[name] = values
+    return positions, columns
+
+
+def _build_category(name: str, meta: dict, plan, category) -> list:
+    """Build the tree of just the rows of category (run in a worker). Return a
+    list with (path, rows, _cat, _bounds, sorted_list, (_column, _find,
+    _stable)) for every tree in it, parents before their subtrees. rows are
+    positions in the full catalog, and sorted_list is None for anything that
+    isn't a leaf."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        positions, columns = read_columns(shm.buf, meta, category)
+    finally:
+        shm.close()
+    df = pd.DataFrame(columns)
+    atom = plan.split(df, shared=True, skip_missing=True)
+    if len(positions) < 2 ** 31:
+        positions = positions.astype(np.int32)
+    result = []
+    stack = [((), atom)]
+    while stack:
+        path, curr = stack.pop()
+        if curr._rows is None:
+            rows = positions
+        else:
+            rows = positions[curr._rows]
+        sorted_list = None
+        if len(curr.subtrees) == 0 and curr._stable:
+            stable_deconstruct(curr)
+            sorted_list = curr.sorted_list
+        result.append((path, rows, curr._cat, curr._bounds, sorted_list,
+                       (curr._column, curr._find, curr._stable)))
+        for subtree in reversed(curr.subtrees):
+            stack.append((path + (subtree.coordinate,), subtree))
+    return result
+
+
+def _merge(plan, df: pd.DataFrame, categories: list,
+           pieces: list) -> AtomicTree:
+    """Return the AtomicTree of df put back together from the pieces that
+    _build_category made for each of categories (in the same order)."""
+    nodes = {}
+    children = {}
+    for category, piece in zip(categories, pieces):
+        for path, rows, cat, bounds, sorted_list, spec in piece:
+            nodes.setdefault(path, []).append((category, rows, cat, bounds,
+                                               sorted_list, spec))
+            if path:
+                siblings = children.setdefault(path[:-1], [])
+                if path[-1] not in siblings:
+                    # Every piece has the same subtrees except for maybe the
+                    # remainder, which always comes last anyway
+                    siblings.append(path[-1])
+    kind = np.int32 if len(df) < 2 ** 31 else np.int64
+    atom = AtomicTree(plan.coordinate, plan.column, df, main=True,
+                      find=plan.find, shared=True)
+    stack = [((), atom)]
+    while stack:
+        path, curr = stack.pop()
+        found = nodes[path]
+        cat = found[0][2]
+        curr._cat = cat
+        if curr.main:
+            curr._bounds = {}
+            for elm in found:
+                if elm[3] is not None:
+                    curr._bounds.update(elm[3])
+        else:
+            # Only the rows of cat get sorted, so its piece has the bounds
+            curr._bounds = found[0][3]
+            for elm in found:
+                if elm[0] == cat:
+                    curr._bounds = elm[3]
+        if found[0][4] is not None:
+            curr.sorted_list.extend(heapq.merge(*[elm[4] for elm in found]))
+        for coordinate in children.get(path, []):
+            child = path + (coordinate,)
+            column, find, stable = nodes[child][0][5]
+            rows = np.concatenate([elm[1] for elm in nodes[child]]) \
+                .astype(kind, copy=False)
+            subtree = AtomicTree(coordinate, column, df, find=find,
+                                 stable=stable, parent=curr, rows=rows)
+            curr.subtrees.append(subtree)
+            stack.append((child, subtree))
+    return atom
+
+
+def build_parallel(plan, frames: dict, processes: int | None = None) -> dict:
+    """Return a dict with every store in frames pointing to its fully built
+    AtomicTree (like LayoutPlan.build), with every (store, category) built in
+    its own process out of a pool of processes."""
+    shared = {}
+    jobs = {}
+    result = {}
+    try:
+        with ProcessPoolExecutor(processes) as pool:
+            for store in frames:
+                df = frames[store].reset_index(drop=True)
+                # Up front, instead of a worker blowing up on a category that
+                # isn't one
+                plan.check(df)
+                if len(df) == 0:
+                    # Nothing to farm out (and the plan can't split it anyway)
+                    continue
+                frame = SharedFrame(df, sorted(plan.columns))
+                shared[store] = df, frame
+                categories = list(df["Category Code"].unique())
+                jobs[store] = categories, [
+                    pool.submit(_build_category, frame.shm.name, frame.meta,
+                                plan, category) for category in categories]
+            for store in frames:
+                if store not in jobs:
+                    result[store] = plan.build(frames[store])
+                    continue
+                categories, futures = jobs[store]
+                pieces = [future.result() for future in futures]
+                atom = _merge(plan, shared[store][0], categories, pieces)
+                plan.link(atom)
+                result[store] = atom
+            return result
+    finally:
+        for df, frame in shared.values():
+            frame.close()
@@ -0,0 +1,249 @@
+import numpy as np
+from collections import OrderedDict
+from layout import LayoutError
+
+################################################################################
+# Pick paths
+#
+# A coordinate like F.1.2.a says a lot more than where one product is: F is the
+# room, 1 is the shelf, 2 is the level and a is the slot. This turns a pick list
+# into the order to walk it in.
+#
+# Walking is almost all in getting from shelf to shelf (and from room to room),
+# so the route is planned over the shelves the list touches (its "shelf-set").
+# Once you're at a shelf you just grab everything there level by level, slot by
+# slot. The shelves are ordered with nearest neighbour (always go to the
+# closest shelf you haven't been to yet) and then cleaned up with 2-opt (flip
+# any stretch of the route that makes it shorter, until nothing does).
+#
+# How far apart things are comes from a DistanceModel, which the "distances"
+# part of layout.json can change:
+#
+#   "distances": {
+#       "between_rooms": 20,          # from one room's door to the other's
+#       "aisle": 4,                   # per shelf along the room
+#       "doors": {"F": 0, "B": 0},    # where each room's door is
+#       "shelves": {"B": {"T": 0}}    # where a shelf is, if it isn't its number
+#   }
+#
+# The same shelves come up over and over (every flower order goes to F.1), so
+# the order of every shelf-set is kept in a small LRU cache.
+################################################################################
+
+
+class DistanceModel:
+    """How far apart shelves are.
+    ============================================================================
+    Attributes |
+    ===========
+    between_rooms: A float value with the distance from one room's door to
+                   another's.
+
+    aisle: A float value with the distance from one shelf to the next one.
+
+    doors: A dict object with a room pointing to where its door is (in
+           shelves). A room that isn't in there has its door at 0.
+
+    shelves: A dict object with a room pointing to a dict of shelf -> where it
+             is. A shelf that isn't in there is as far along as its number says
+             (or at the door, if it's not a number).
+    """
+
+    def __init__(self, between_rooms: float = 20.0, aisle: float = 4.0,
+                 doors: dict = None, shelves: dict = None) -> None:
+        self.between_rooms = between_rooms
+        self.aisle = aisle
+        self.doors = doors or {}
+        self.shelves = shelves or {}
+
+    @classmethod
+    def from_spec(cls, spec: dict):
+        """Return the DistanceModel of the "distances" part of a layout spec,
+        or raise a LayoutError if it doesn't make sense."""
+        unknown = set(spec) - {"between_rooms", "aisle", "doors", "shelves"}
+        if unknown:
+            raise LayoutError("Unknown distances " + str(sorted(unknown)))
+        for key in ["between_rooms", "aisle"]:
+            if not isinstance(spec.get(key, 0), (int, float)) or \
+                    spec.get(key, 0) < 0:
+                raise LayoutError(key + " has to be a number >= 0")
+        return cls(spec.get("between_rooms", 20.0), spec.get("aisle", 4.0),
+                   spec.get("doors"), spec.get("shelves"))
+
+    def position(self, room: str, shelf: str) -> float:
+        """Return where shelf is along room."""
+        position = self.shelves.get(room, {}).get(shelf)
+        if position is not None:
+            return position
+        if shelf.isdigit():
+            return int(shelf)
+        return self.door(room)
+
+    def door(self, room: str) -> float:
+        """Return where the door of room is."""
+        return self.doors.get(room, 0)
+
+    def matrix(self, points: list[tuple[str, float]]) -> np.ndarray:
+        """Return the distance between every two (room, position) points
+        (see position)."""
+        rooms = np.array([room for room, where in points], dtype=object)
+        where = np.array([where for room, where in points], dtype=float)
+        doors = np.array([self.door(room) for room, where in points],
+                         dtype=float)
+        same = rooms[:, None] == rooms[None, :]
+        inside = np.abs(where[:, None] - where[None, :])
+        # Out one door, over to the other room, and in from its door
+        across = np.abs(where - doors)[:, None] + \
+            np.abs(where - doors)[None, :]
+        return np.where(same, inside * self.aisle,
+                        across * self.aisle + self.between_rooms)
+
+
+def load_model(spec: dict) -> DistanceModel:
+    """Return the DistanceModel of a layout spec (see load_layout)."""
+    return DistanceModel.from_spec(spec.get("distances", {}))
+
+
+class PickPlanner:
+    """Plans the order to pick a list of products in (see the comment at the
+    top).
+    ============================================================================
+    Attributes |
+    ===========
+    codec: The CoordinateCodec the coordinates were made with.
+
+    model: The DistanceModel.
+
+    cache_size: How many shelf-sets to remember the order of.
+
+    hits, misses: How many times the order of a shelf-set was / wasn't in the
+                  cache.
+
+    _cache: An OrderedDict with (shelf-set, start, back) pointing to the order
+            of the shelves, least recently used first.
+    """
+
+    def __init__(self, codec, model: DistanceModel = None,
+                 cache_size: int = 256) -> None:
+        self.codec = codec
+        self.model = model or DistanceModel()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def order(self, coordinates: list[str], start: str = None,
+              back: bool = False) -> list[str]:
+        """Return coordinates in the order to pick them in, starting at the
+        door of the room start (the first room of the first coordinate, if not
+        given). With back=True the walk ends back at that door, and the route
+        is planned with that in mind."""
+        shelves = {}
+        for coordinate in coordinates:
+            room, x, y = self.codec.address(coordinate)
+            shelves.setdefault((room, x), []).append(coordinate)
+        if not shelves:
+            return []
+        if start is None:
+            start = next(iter(shelves))[0]
+        key = frozenset(shelves), start, back
+        route = self._cache.get(key)
+        if route is None:
+            self.misses += 1
+            route = self._plan(sorted(shelves), start, back)
+            self._cache[key] = route
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        result = []
+        for stop in route:
+            result.extend(sorted(shelves[stop], key=self._shelf_key))
+        return result
+
+    def route(self, product_map: dict, products: list[str],
+              start: str = None, back: bool = False) -> list[tuple[str, str]]:
+        """Return (product, coordinate) for every product (looked up in
+        product_map) in the order to pick them in. Raise a KeyError if a
+        product isn't there."""
+        where = {}
+        for product in products:
+            where.setdefault(product_map[product], []).append(product)
+        return [(product, coordinate)
+                for coordinate in self.order(list(where), start, back)
+                for product in where[coordinate]]
+
+    def length(self, coordinates: list[str], start: str = None,
+               back: bool = False) -> float:
+        """Return how far it is to walk to coordinates in that order."""
+        stops = []
+        for coordinate in coordinates:
+            stop = self.codec.address(coordinate)[:2]
+            if not stops or stops[-1] != stop:
+                stops.append(stop)
+        if not stops:
+            return 0.0
+        if start is None:
+            start = stops[0][0]
+        distance = self._distances(stops, start, back)
+        # The door, every stop in order, and the end
+        return float(sum(distance[i, i + 1] for i in range(len(stops) + 1)))
+
+    def _shelf_key(self, coordinate: str) -> tuple:
+        """Return the order to grab things off one shelf in: level by level
+        (by number), then slot by slot."""
+        room, x, y = self.codec.address(coordinate)
+        try:
+            slot = self.codec.unpack(self.codec.parse(coordinate))[1]
+        except KeyError:
+            slot = 0
+        if y.isdigit():
+            return 0, int(y), y, slot
+        return 1, 0, y, slot
+
+    def _distances(self, stops: list, start: str, back: bool) -> np.ndarray:
+        """Return the distances between the door of start (0), the stops (1 to
+        n), and the end of the walk (n + 1), which is the door again if back
+        is True and anywhere at all (so 0 from everything) if not."""
+        points = [(start, self.model.door(start))]
+        for room, shelf in stops:
+            points.append((room, self.model.position(room, shelf)))
+        distance = np.zeros((len(points) + 1, len(points) + 1))
+        distance[:-1, :-1] = self.model.matrix(points)
+        if back:
+            distance[:-1, -1] = distance[:-1, 0]
+            distance[-1, :-1] = distance[0, :-1]
+        return distance
+
+    def _plan(self, stops: list, start: str, back: bool) -> list:
+        """Return stops in the order to visit them in."""
+        distance = self._distances(stops, start, back)
+        end = len(stops) + 1
+        # Nearest neighbour, starting at the door
+        path = [0]
+        left = set(range(1, end))
+        while left:
+            here = path[-1]
+            closest = min(left, key=lambda stop: (distance[here, stop], stop))
+            path.append(closest)
+            left.remove(closest)
+        path.append(end)
+        path = np.array(path)
+        # 2-opt. Flipping path[i:j + 1] swaps the edges (a, b) and (c, d) for
+        # (a, c) and (b, d), where a = path[i - 1], b = path[i], c = path[j]
+        # and d = path[j + 1]. The door and the end never move.
+        improved = True
+        while improved:
+            improved = False
+            for i in range(1, len(path) - 2):
+                a, b = path[i - 1], path[i]
+                c, d = path[i + 1:-1], path[i + 2:]
+                delta = distance[a, c] + distance[b, d] - distance[a, b] - \
+                    distance[c, d]
+                j = int(np.argmin(delta))
+                if delta[j] < -1e-9:
+                    j += i + 1
+                    path[i:j + 1] = path[i:j + 1][::-1].copy()
+                    improved = True
+        return [stops[stop - 1] for stop in path[1:-1]]
@@ -0,0 +1,295 @@
+import json
+import time
+import argparse
+import tracemalloc
+import inventoryStructure
+
+################################################################################
+# Split profiler
+#
+# When a rebuild is slow, the benchmark (see benchmark.py) says THAT the build
+# is slow but not which split it is. A SplitProfiler answers that:
+#
+#   with SplitProfiler() as profiler:
+#       atom = compile_layout(load_layout()).build(df)
+#   print(profiler.report(atom))
+#   profiler.export_trace("build.json")
+#
+# While it's on, AtomicTree.nuke and AtomicTree.proliferate, and
+# sorting_algorithm, sorting_split and boolean_split in inventoryStructure, are
+# swapped for wrappers that write down, for every call:
+#
+#   - the tree it was for (the one being nuked), by its path of coordinates,
+#   - how long it took,
+#   - how many rows went in and how many came out (boolean_split can give back
+#     more than it got, since a row can match more than one find value),
+#   - and, with memory=True, how many bytes it allocated at its peak (and how
+#     many were still held when it was done), from tracemalloc.
+#
+# The originals go right back when it's done. So with no profiler running
+# there is nothing in the way at all, not even an "is it on?" check.
+#
+# report is the tree as AtomicTree.__str__ prints it, with what each node took.
+# export_trace writes the calls in the Chrome trace format, which
+# chrome://tracing, Perfetto and speedscope all open.
+#
+# Only calls in this process are seen, so a build with processes=... (see
+# parallel_build.py) only shows the parent putting the trees back together.
+# tracemalloc makes everything a few times slower, so for times you can trust
+# use memory=False.
+################################################################################
+
+# What gets wrapped. The functions are looked up in inventoryStructure when
+# they're called, so swapping the module's names is enough.
+METHODS = ["nuke", "proliferate"]
+FUNCTIONS = ["sorting_algorithm", "sorting_split", "boolean_split"]
+
+
+class SplitProfiler:
+    """Records every split of every AtomicTree while it's running (see the
+    comment at the top).
+    ============================================================================
+    Attributes |
+    ===========
+    memory: A boolean value that is True iff allocations are recorded too.
+
+    events: A list with a dict for every call that finished, in the order
+            they finished: {"name", "node" (the path of coordinates as a
+            string), "start" and "seconds" (from time.perf_counter), "rows_in",
+            "rows_out", "depth" (how many recorded calls it was inside of),
+            and "allocated" and "held" in bytes if memory is True}.
+
+    _nodes: A dict object with id(tree) pointing to the events of the nukes
+            and everything they called, for report.
+
+    _stack: A list of the calls that are running, innermost last.
+
+    _originals: What was swapped out, to put back when it's done.
+    """
+
+    def __init__(self, memory: bool = True) -> None:
+        self.memory = memory
+        self.events = []
+        self._nodes = {}
+        self._stack = []
+        self._originals = {}
+        self._tracing = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """Swap in the wrappers (and start tracemalloc, if it's needed)."""
+        if self._originals:
+            return
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        tree = inventoryStructure.AtomicTree
+        for name in METHODS:
+            self._originals[name] = getattr(tree, name)
+            setattr(tree, name, self._method(name, getattr(tree, name)))
+        for name in FUNCTIONS:
+            self._originals[name] = getattr(inventoryStructure, name)
+            setattr(inventoryStructure, name,
+                    self._function(name, getattr(inventoryStructure, name)))
+
+    def stop(self) -> None:
+        """Put the originals back."""
+        tree = inventoryStructure.AtomicTree
+        for name, original in self._originals.items():
+            if name in METHODS:
+                setattr(tree, name, original)
+            else:
+                setattr(inventoryStructure, name, original)
+        self._originals = {}
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def _method(self, name: str, original):
+        """Return the recording version of the AtomicTree method original."""
+        profiler = self
+
+        def wrapper(tree, *args, **kwargs):
+            if name == "proliferate":
+                rows = sum(len(df) for df in args[0])
+            else:
+                rows = tree.size
+            call = profiler._enter(name, tree, rows)
+            try:
+                result = original(tree, *args, **kwargs)
+            except BaseException:
+                profiler._stack.remove(call)
+                raise
+            if name == "proliferate":
+                out = sum(subtree.size for subtree in result)
+            else:
+                out = sum(subtree.size for subtree in tree.subtrees)
+            profiler._exit(call, out)
+            return result
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = original.__doc__
+        return wrapper
+
+    def _function(self, name: str, original):
+        """Return the recording version of the split function original. The
+        tree it's for is whatever is being nuked."""
+        profiler = self
+
+        def wrapper(df, *args, **kwargs):
+            tree = None
+            for call in reversed(profiler._stack):
+                if call["tree"] is not None:
+                    tree = call["tree"]
+                    break
+            call = profiler._enter(name, tree, len(df))
+            try:
+                result = original(df, *args, **kwargs)
+            except BaseException:
+                profiler._stack.remove(call)
+                raise
+            profiler._exit(call, sum(len(piece) for piece in result))
+            return result
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = original.__doc__
+        return wrapper
+
+    def _enter(self, name: str, tree, rows: int) -> dict:
+        """Start recording a call and return it."""
+        call = {"name": name, "tree": tree, "rows_in": rows}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak is about to be reset for this call, so whoever called
+            # it gets to keep what it has seen so far
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            call["base"] = call["peak"] = current
+        self._stack.append(call)
+        call["start"] = time.perf_counter()
+        return call
+
+    def _exit(self, call: dict, rows: int) -> None:
+        """Finish recording call, which gave back rows rows."""
+        seconds = time.perf_counter() - call["start"]
+        self._stack.pop()
+        event = {"name": call["name"], "node": _path(call["tree"]),
+                 "start": call["start"], "seconds": seconds,
+                 "rows_in": call["rows_in"], "rows_out": rows,
+                 "depth": len(self._stack)}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(call["peak"], peak)
+            event["allocated"] = peak - call["base"]
+            event["held"] = current - call["base"]
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+        self.events.append(event)
+        if call["tree"] is not None:
+            self._nodes.setdefault(id(call["tree"]), []).append(event)
+
+    def report(self, atom) -> str:
+        """Return the tree of atom like AtomicTree.__str__ prints it, with the
+        time, rows and memory of every nuke, and under it how long everything
+        it called took in total."""
+        lines = []
+        self._report(atom, 0, lines)
+        return "\n".join(lines) + "\n"
+
+    def _report(self, curr, level: int, lines: list) -> None:
+        indent = "    "
+        name = str(curr.coordinate)
+        if curr._stable:
+            name += "***"
+        events = self._nodes.get(id(curr), [])
+        nukes = [event for event in events if event["name"] == "nuke"]
+        if nukes:
+            name += "  " + _describe(nukes[-1])
+        lines.append(level * indent + name)
+        totals = {}
+        # In the order they were first called (events are in the order they
+        # finished, which puts a function before whatever called it)
+        for event in sorted(events, key=lambda elm: elm["start"]):
+            if event["name"] != "nuke":
+                count, seconds = totals.get(event["name"], (0, 0.0))
+                totals[event["name"]] = count + 1, seconds + event["seconds"]
+        for function, (count, seconds) in totals.items():
+            lines.append((level + 1) * indent + "- " + function + " x" +
+                         str(count) + " " + _milliseconds(seconds))
+        for subtree in curr.subtrees:
+            self._report(subtree, level + 1, lines)
+
+    def export_trace(self, path: str) -> None:
+        """Save every call in the Chrome trace format (complete "X" events,
+        in microseconds) at path."""
+        if self.events:
+            first = min(event["start"] for event in self.events)
+        else:
+            first = 0.0
+        trace = []
+        for event in self.events:
+            args = {key: event[key] for key in
+                    ["node", "rows_in", "rows_out", "allocated", "held"]
+                    if key in event}
+            trace.append({"name": event["name"] + " " + event["node"],
+                          "cat": event["name"], "ph": "X", "pid": 0,
+                          "tid": 0,
+                          "ts": (event["start"] - first) * 1e6,
+                          "dur": event["seconds"] * 1e6, "args": args})
+        # Parents before their children when they start at the same time
+        trace.sort(key=lambda elm: (elm["ts"], -elm["dur"]))
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+def _path(tree) -> str:
+    """Return the coordinates from the root down to tree, like main/F/1.2."""
+    coordinates = []
+    # The root's parent isn't None, it's whatever AtomicTree's default is
+    while isinstance(tree, inventoryStructure.AtomicTree):
+        coordinates.append(str(tree.coordinate))
+        tree = tree.parent
+    return "/".join(reversed(coordinates))
+
+
+def _milliseconds(seconds: float) -> str:
+    return f"{seconds * 1000:.2f} ms"
+
+
+def _describe(event: dict) -> str:
+    """Return one line with the time, rows and memory of event."""
+    result = _milliseconds(event["seconds"]) + "  rows " + \
+        str(event["rows_in"]) + " -> " + str(event["rows_out"])
+    if "allocated" in event:
+        result += f"  {event['allocated'] / 2 ** 20:.2f} MB peak, " \
+                  f"{event['held'] / 2 ** 20:.2f} MB held"
+    return result
+
+
+if __name__ == "__main__":
+    from layout import load_layout, compile_layout
+    from ingest import read_inventory
+
+    parser = argparse.ArgumentParser(description="Build the layout over an "
+                                                 "inventory CSV and show "
+                                                 "what every split took.")
+    parser.add_argument("csv", help="the inventory CSV")
+    parser.add_argument("--trace", help="also save a Chrome trace here")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="don't record allocations (faster, and the "
+                             "times are closer to the real thing)")
+    args = parser.parse_args()
+    plan = compile_layout(load_layout())
+    df = read_inventory(args.csv, plan)
+    with SplitProfiler(memory=not args.no_memory) as profiler:
+        atom = plan.build(df)
+    print(profiler.report(atom), end="")
+    if args.trace:
+        profiler.export_trace(args.trace)
@@ -0,0 +1,298 @@
+import math
+import time
+import heapq
+
+################################################################################
+# Front/back rebalancing
+#
+# The front/back split is made once, when the tree is nuked: the better half of
+# every category by Rank goes in the front (see AtomicTree.nuke). Rank is a
+# number from the POS export, so between exports the front only changes when
+# someone moves things by hand. A Rebalancer keeps it up with what is actually
+# selling:
+#
+#   rebalancer = Rebalancer(inventory)
+#   moves = rebalancer.record({"Area 51 3.5g": 2, "Blue Dream 7g": 1})
+#   rebalancer.apply(moves)
+#
+# Products can only go between the two ends of a LinkedCycle, so every cycle
+# is a pool of its own: the products at its front end and at its back end. What
+# goes in the front is whatever in the pool sells the fastest, for as many
+# spots as the front end has now (so a move out of the front always comes with
+# one into it, and no shelf fills up).
+#
+# How fast something sells is a sales count that fades with a half life
+# (HALF_LIFE). Fading every product's count at every batch would be a pass
+# over the whole store, so the counts are kept as if it were always time 0: a
+# sale at time t counts for exp(t / tau) (tau being the half life over ln 2),
+# and since everything fades by the same amount, comparing those is the same as
+# comparing the faded counts. They're kept as logs, so they never overflow.
+# That means a sale only changes the score of what was sold.
+#
+# Every pool keeps two heaps: the slowest product in the front on top of one,
+# and the fastest one in the back on top of the other. A batch of sales pushes
+# the new scores (the old entries are left in there and skipped when they come
+# up, see _top), and then, only in the pools that sold something, the top two
+# trade places for as long as the one in the back sells faster. So a batch costs
+# O(changes * log n), and never goes near the products that didn't sell.
+#
+# Each product that trades places is one move, and nothing moves unless it has
+# to: the ones coming in are the fastest in the back in order, so nothing that
+# comes in gets sent back out by the same batch. With margin, something in the
+# back has to sell that much faster (0.2 is 20% faster) to take a spot, so two
+# products that sell about the same don't keep trading places. A product that
+# has never sold never takes a spot from one that hasn't either, so Rank only
+# breaks ties (the worst Rank in the front goes first, the best one in the back
+# comes first).
+#
+# The moves are (product, from (room, x, y), to (room, x, y)), and apply runs
+# them with UpdatedInventory.items_to_loc, which goes through Node.move_items
+# and writes them to the journal like any other move. The Rebalancer takes its
+# moves as done when it hands them out, so they should all be applied. A product
+# that got moved some other way (or that reload put somewhere new) is found
+# where it is the next time it sells.
+################################################################################
+
+# How long it takes for a sale to count half as much, in seconds
+HALF_LIFE = 7 * 24 * 60 * 60
+
+# Seconds in a day (velocity is in sales per day)
+DAY = 24 * 60 * 60
+
+
+class CyclePool:
+    """The products of one LinkedCycle (see the comment at the top).
+    ============================================================================
+    Attributes |
+    ===========
+    front, back: The (room, x, y) of each end of the cycle.
+
+    names: A set of every product that has been in the pool. One that moved
+           somewhere else (see Rebalancer._where) is taken out the next time
+           the heaps are rebuilt.
+
+    fronts: A heap of (score, -rank, name) of the products in the front, so
+            the slowest one is on top.
+
+    backs: A heap of (-score, rank, name) of the products in the back, so the
+           fastest one is on top.
+    """
+
+    def __init__(self, front: tuple, back: tuple) -> None:
+        self.front = front
+        self.back = back
+        self.names = set()
+        self.fronts = []
+        self.backs = []
+
+
+class Rebalancer:
+    """Keeps the front of every LinkedCycle stocked with what sells the
+    fastest (see the comment at the top).
+    ============================================================================
+    Attributes |
+    ===========
+    inventory: The UpdatedInventory being rebalanced.
+
+    half_life: How long it takes a sale to count half as much, in seconds.
+
+    margin: How much faster (0.2 is 20%) something in the back has to sell to
+            take a spot in the front.
+
+    pools: A dict object with the (room, x, y) of each end of a cycle pointing
+           to its CyclePool.
+
+    _tau: half_life / ln 2, so a sale at time t counts for exp(t / _tau).
+
+    _scores: A dict object with a product pointing to the log of its sales
+             count at time 0 (a product that never sold isn't in here, which
+             is -inf).
+
+    _ranks: A dict object with a product pointing to its Rank (inf if it
+            doesn't have one), for breaking ties.
+
+    _where: A dict object with every product in a pool pointing to the
+            (room, x, y) it's in, moves handed out included.
+    """
+
+    def __init__(self, inventory, half_life: float = HALF_LIFE,
+                 margin: float = 0.0, ranks: dict[str, float] = None) -> None:
+        """ranks is the Rank of every product, which is taken from the
+        inventory's snapshot if not given (and if there's no snapshot, ties go
+        by name). The front room is the first one in inventory.tree."""
+        self.inventory = inventory
+        self.half_life = half_life
+        self.margin = margin
+        self.pools = {}
+        self._tau = half_life / math.log(2)
+        self._scores = {}
+        self._where = {}
+        if ranks is None:
+            ranks = {}
+            df = inventory.snapshot
+            if df is not None and "Rank" in df.columns:
+                ranks = dict(zip(df["Product Name"], df["Rank"]))
+        self._ranks = ranks
+        tree = inventory.tree
+        front_room = next(iter(tree), None)
+        for front, back in inventory.cycles.items():
+            if front[0] != front_room:
+                continue
+            # Two leaves can share an address, and only the first one made it
+            # into the tree (see AtomicTree.bijection)
+            if not all(y in tree.get(room, {}).get(x, {})
+                       for room, x, y in [front, back]):
+                continue
+            pool = CyclePool(front, back)
+            self.pools[front] = self.pools[back] = pool
+            for address in [front, back]:
+                room, x, y = address
+                for name in tree[room][x][y]:
+                    self._where[name] = address
+                    pool.names.add(name)
+            self._rebuild(pool)
+
+    def _rank(self, name: str) -> float:
+        rank = self._ranks.get(name)
+        # NaN isn't equal to itself
+        if rank is None or rank != rank:
+            return math.inf
+        return rank
+
+    def _push(self, pool: CyclePool, name: str) -> None:
+        """Put name's entry in the heap of the end it's at."""
+        score = self._scores.get(name, -math.inf)
+        if self._where[name] == pool.front:
+            heapq.heappush(pool.fronts, (score, -self._rank(name), name))
+        else:
+            heapq.heappush(pool.backs, (-score, self._rank(name), name))
+
+    def _rebuild(self, pool: CyclePool) -> None:
+        """Make the heaps of pool over again, without the old entries."""
+        pool.names = {name for name in pool.names
+                      if self._where.get(name) in (pool.front, pool.back)}
+        pool.fronts = []
+        pool.backs = []
+        for name in pool.names:
+            score = self._scores.get(name, -math.inf)
+            if self._where[name] == pool.front:
+                pool.fronts.append((score, -self._rank(name), name))
+            else:
+                pool.backs.append((-score, self._rank(name), name))
+        heapq.heapify(pool.fronts)
+        heapq.heapify(pool.backs)
+
+    def _top(self, pool: CyclePool, front: bool) -> str | None:
+        """Return the slowest product in the front (or the fastest in the
+        back) of pool, throwing away the entries on top that are out of date
+        (an older score, or from before it moved)."""
+        heap = pool.fronts if front else pool.backs
+        address = pool.front if front else pool.back
+        while heap:
+            score, rank, name = heap[0]
+            if not front:
+                score = -score
+            if self._where.get(name) == address and \
+                    self._scores.get(name, -math.inf) == score:
+                return name
+            heapq.heappop(heap)
+        return None
+
+    def _locate(self, name: str) -> CyclePool | None:
+        """Return the pool name is in right now, going by the inventory (None
+        if it isn't at either end of a cycle)."""
+        coordinate = self.inventory.product_map.get(name)
+        address = pool = None
+        if coordinate is not None:
+            address = self.inventory.codec.address(coordinate)
+            pool = self.pools.get(address)
+        if pool is None:
+            # Gone, or moved out of the pools without us (if it was ever in
+            # one), so its old entries can't count as being there anymore
+            self._where.pop(name, None)
+        elif self._where.get(name) != address:
+            # New, or moved without us
+            self._where[name] = address
+            pool.names.add(name)
+            self._push(pool, name)
+        return pool
+
+    def record(self, sales, now: float = None) -> list[tuple]:
+        """Count a batch of sales and return the moves that get the front of
+        every cycle that sold something back to the fastest sellers, as
+        (product, from (room, x, y), to (room, x, y)). sales is a dict (or a
+        list of pairs) of product name and how many sold, and now is when
+        they sold (time.time() if not given). A product that isn't in the
+        inventory is ignored, and so is a quantity that isn't positive."""
+        if now is None:
+            now = time.time()
+        if isinstance(sales, dict):
+            sales = sales.items()
+        offset = now / self._tau
+        touched = {}
+        for name, quantity in sales:
+            if not quantity > 0:
+                continue
+            pool = self._locate(name)
+            if pool is None and name not in self.inventory.product_map:
+                continue
+            weight = math.log(quantity) + offset
+            score = self._scores.get(name)
+            if score is not None:
+                # log(exp(score) + exp(weight)) without leaving the logs
+                weight = max(score, weight) + \
+                    math.log1p(math.exp(-abs(score - weight)))
+            self._scores[name] = weight
+            if pool is not None:
+                self._push(pool, name)
+                touched[id(pool)] = pool
+        moves = []
+        for pool in touched.values():
+            moves.extend(self._balance(pool))
+        return moves
+
+    def _balance(self, pool: CyclePool) -> list[tuple]:
+        """Trade the slowest product in the front of pool for the fastest in
+        the back for as long as the one in the back sells faster, and return
+        the moves."""
+        moves = []
+        # Scores are logs, so "margin faster" is a difference
+        margin = math.log1p(self.margin)
+        while True:
+            slow = self._top(pool, True)
+            fast = self._top(pool, False)
+            if slow is None or fast is None:
+                break
+            if not self._scores.get(fast, -math.inf) > \
+                    self._scores.get(slow, -math.inf) + margin:
+                break
+            heapq.heappop(pool.fronts)
+            heapq.heappop(pool.backs)
+            self._where[slow] = pool.back
+            self._where[fast] = pool.front
+            self._push(pool, slow)
+            self._push(pool, fast)
+            moves.append((fast, pool.back, pool.front))
+            moves.append((slow, pool.front, pool.back))
+        if len(pool.fronts) + len(pool.backs) > 2 * len(pool.names) + 64:
+            self._rebuild(pool)
+        return moves
+
+    def apply(self, moves: list[tuple]) -> None:
+        """Make moves (from record) in the inventory, one batch per room they
+        go to (see UpdatedInventory.items_to_loc)."""
+        rooms = {}
+        for name, source, target in moves:
+            rooms.setdefault(target[0], []).append(name)
+        for room, items in rooms.items():
+            self.inventory.items_to_loc(items, room)
+
+    def velocity(self, name: str, now: float = None) -> float:
+        """Return how many of name sell in a day right now, going by the faded
+        sales count."""
+        if now is None:
+            now = time.time()
+        score = self._scores.get(name)
+        if score is None:
+            return 0.0
+        return math.exp(score - now / self._tau) / self._tau * DAY
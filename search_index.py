@@ -0,0 +1,548 @@
+import numpy as np
+from collections import OrderedDict
+from rapidfuzz import process, fuzz
+
+################################################################################
+# Persistent search index for UpdatedInventory.fetch
+#
+# fetch used to rebuild list(self.coordinate_map.values()) and WRatio every
+# single product on every search. With a few stores worth of SKUs that is a full
+# linear scan per keystroke. Instead, we keep the names around once (built
+# together with the maps), along with two things that let us skip most of them:
+#
+#   - A letter count table (one row per name, one column per letter/digit).
+#     Almost every part of WRatio is built out of the longest common
+#     subsequence of the two strings, and that can never be longer than the
+#     letters they have in common (plus the spaces/punctuation). That gives us a
+#     cheap upper bound on the score of every name with one numpy operation.
+#     token_set_ratio throws out repeated words before it compares anything,
+#     so the letters a string is counted as having are only the ones in its
+#     distinct words (see distinct_letters). A name like "ab ab ab" is 2
+#     letters long as far as the bound is concerned, not 6.
+#   - A token table (word -> names with that word). The one exception to the
+#     above is token_set_ratio, which can give a name that shares a whole word
+#     with the query 100 no matter what. WRatio scales that down by how
+#     different the lengths are though (95, 85.5 or 57), so those names get
+#     that as their bound instead.
+#
+# The search then scores the shortlist (the best few by bound), and uses that
+# score as a cutoff: anything whose bound can't reach it is thrown out without
+# being scored. What's left gets the exact same extractOne call as before, so
+# we get the exact same best match (ties included) as the old scan.
+#
+# On top of that, the last few hundred answers are kept in an LRU cache (the
+# same few products get searched all shift long). The best match for a query
+# only depends on which names are in the index, so the cache only has to
+# change when that does:
+#
+#   - discard(name) throws out just the answers that were name.
+#   - add(name) can only matter if name beats an answer, so a cached answer
+#     gets checked against the names added since it was cached the next time
+#     it's used (a handful of WRatios instead of a whole search).
+#
+# A move (item_to_loc, Node.move_item) or a reload that only moves things
+# around never touches the names, so nothing gets thrown out. The coordinate
+# isn't cached, UpdatedInventory.fetch looks it up in product_map every time.
+# The key is the query exactly as it was typed, since WRatio cares about case
+# and spaces and a "normalized" key could hand back a different answer.
+################################################################################
+
+
+def normalize(name: str) -> str:
+    """Return a lowercase version of name with the whitespace squished, which
+    is what the letter counts are built from.
+    >>> normalize("  Area 51   3.5G ")
+    'area 51 3.5g'
+    """
+    return " ".join(name.lower().split())
+
+
+def tokens(name: str) -> set[str]:
+    """Return every 'word' that WRatio could possibly see in name. That's the
+    raw words, plus the words you get after rapidfuzz's default_process (which
+    lowercases and turns anything that isn't a letter or digit into a space).
+    >>> sorted(tokens("Area 51 3.5g"))
+    ['3', '3.5g', '51', '5g', 'Area', 'area']
+    """
+    result = set(name.split())
+    result.update(default_process(name).split())
+    return result
+
+
+def distinct_letters(name: str) -> int:
+    """Return how many letters/digits are in the distinct words of name, which
+    is the fewest letters any string WRatio compares can have (token_set_ratio
+    drops repeated words, and default_process can make two words the same).
+    >>> distinct_letters("OG og Kush og")
+    6
+    """
+    return sum(map(len, set(default_process(name).split())))
+
+
+class _Separators(dict):
+    """A str.translate table that turns anything that isn't a letter or digit
+    into a space. Whether a character is one is worked out the first time it's
+    seen, so it goes for any character at all."""
+
+    def __missing__(self, code: int):
+        self[code] = result = code if chr(code).isalnum() else " "
+        return result
+
+
+_SEPARATORS = _Separators()
+
+
+def default_process(name: str) -> str:
+    """Return name the way rapidfuzz's default_process would hand it over.
+    >>> default_process(" Area 51 3.5g! ")
+    'area 51 3 5g'
+    """
+    return name.lower().translate(_SEPARATORS).strip()
+
+
+def length_cap(len1: np.ndarray, len2: np.ndarray) -> np.ndarray:
+    """Return the most WRatio can give two strings with these lengths that
+    share a word (the token_set_ratio of 100, scaled by WRatio)."""
+    ratio = np.maximum(len1, len2) / np.maximum(np.minimum(len1, len2), 1e-9)
+    return np.where(ratio < 1.5, 95, np.where(ratio < 8, 85.5, 57))
+
+
+class SearchIndex:
+    """Fuzzy-search index over the product names of an inventory.
+    ============================================================================
+    Attributes |
+    ===========
+    shortlist: An int value which tells you how many of the names with the best
+               bound are scored first to find the cutoff.
+
+    _names: A list of the product names in the order that they were added. A
+            removed name leaves a None behind so that the positions of the other
+            names (which decide ties, just like the old list did) never move.
+
+    _slots: A dict object with a product name pointing to its index in _names.
+
+    _words: A dict object with a token pointing to the set of indices in _names
+            that contain that token.
+
+    _letters: A dict object with a letter/digit pointing to its column in the
+              letter count table.
+
+    _counts: A list (one per index in _names) with the letter counts, the
+             lengths and the distinct_letters of that name. The numpy table gets built out of this
+             lazily, so a bunch of adds in a row only pays for the table once.
+
+    cache_size: How many answers to keep in the cache (0 for no cache).
+
+    hits, misses: How many searches were / weren't answered by the cache.
+
+    _cache: An OrderedDict with a query pointing to [name, score, how many
+            names had been added when it was checked last], least recently
+            used first.
+
+    _answers: A dict object with a name pointing to the set of queries that
+              have it as their cached answer.
+
+    _added: A list of the names added since the cache was last emptied.
+    """
+
+    def __init__(self, names=(), shortlist: int = 50,
+                 cache_size: int = 512) -> None:
+        self.shortlist = shortlist
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._answers = {}
+        self._added = []
+        self._names = []
+        self._slots = {}
+        self._words = {}
+        self._letters = {}
+        self._counts = []
+        self._table = None
+        for name in names:
+            self.add(name)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._slots
+
+    def _letter_counts(self, name: str) -> tuple[dict[str, int], int]:
+        """Return the count of every letter/digit in name, and how many
+        characters are left over (spaces and punctuation)."""
+        counts = {}
+        for c in normalize(name):
+            if c.isalnum():
+                counts[c] = counts.get(c, 0) + 1
+        return counts, len(name) - sum(counts.values())
+
+    def _lengths(self, name: str) -> tuple[int, int]:
+        """Return the length of name, both raw and after default_process, since
+        we don't know which one rapidfuzz is going to compare."""
+        return len(name), len(default_process(name))
+
+    def add(self, name: str) -> None:
+        """Add name to the index. Adding a name that is already in there does
+        nothing."""
+        if name in self._slots:
+            return
+        slot = len(self._names)
+        self._names.append(name)
+        self._slots[name] = slot
+        for word in tokens(name):
+            self._words.setdefault(word, set()).add(slot)
+        counts, other = self._letter_counts(name)
+        for c in counts:
+            self._letters.setdefault(c, len(self._letters))
+        self._counts.append((counts, other, self._lengths(name),
+                             distinct_letters(name)))
+        self._table = None
+        self._note_added(name)
+
+    def _note_added(self, name: str) -> None:
+        """Write name down for the cached answers to be checked against (see
+        _cached)."""
+        if self._cache:
+            self._added.append(name)
+            if len(self._added) > self.cache_size:
+                # Checking that many names on every hit isn't worth it
+                self.clear_cache()
+
+    def discard(self, name: str) -> None:
+        """Remove name from the index if it is in there."""
+        slot = self._slots.pop(name, None)
+        if slot is None:
+            return
+        for query in self._answers.pop(name, ()):
+            del self._cache[query]
+        self._names[slot] = None
+        self._counts[slot] = None
+        for word in tokens(name):
+            bucket = self._words[word]
+            bucket.discard(slot)
+            if not bucket:
+                del self._words[word]
+        self._table = None
+        # Too many holes just slows everything down, so every once in a while
+        # we squish them out (in the same order, so ties don't change).
+        if len(self._names) > 2 * len(self._slots) + 64:
+            self._compact()
+
+    def sync(self, names) -> None:
+        """Make the index contain exactly the names in names. Only the names
+        that actually came or went are touched, so calling this after a move
+        (where the set of names doesn't change at all) is basically free."""
+        names = dict.fromkeys(names)
+        for name in [name for name in self._slots if name not in names]:
+            self.discard(name)
+        for name in names:
+            self.add(name)
+
+    def _compact(self) -> None:
+        """Rebuild the index with only the names that are still in it."""
+        names = [name for name in self._names if name is not None]
+        # Same names in the same order, so every cached answer still stands
+        cache, self._cache = self._cache, OrderedDict()
+        self._names = []
+        self._slots = {}
+        self._words = {}
+        self._letters = {}
+        self._counts = []
+        self._table = None
+        for name in names:
+            self.add(name)
+        self._cache = cache
+
+    def _build_table(self) -> None:
+        """Build the numpy letter count table out of self._counts."""
+        table = np.zeros((len(self._names), len(self._letters)), np.int32)
+        alnum = np.zeros(len(self._names), np.int32)
+        other = np.zeros(len(self._names), np.int32)
+        lengths = np.zeros((len(self._names), 2), np.int32)
+        alive = np.zeros(len(self._names), bool)
+        for slot, save in enumerate(self._counts):
+            if save is None:
+                continue
+            counts, other[slot], lengths[slot], alnum[slot] = save
+            for c, count in counts.items():
+                table[slot, self._letters[c]] = count
+            alive[slot] = True
+        self._table = table, alnum, other, lengths, alive
+
+    def bounds(self, query: str) -> np.ndarray:
+        """Return the highest WRatio score that each name could possibly get
+        against query (see the comment at the top). Removed names get -1.
+
+        If x is the query or the name, with A letters and W other characters,
+        and B is the number of letters they share, then every ratio WRatio
+        looks at is at most 2(B + W) / (A + B + 2W). That only goes up as A
+        goes down, so A is the distinct_letters of x, which covers the strings
+        token_set_ratio makes out of its distinct words too. The names that
+        share a word with the query can also get the length_cap."""
+        return self.bounds_many([query])[0]
+
+    def bounds_many(self, queries: list[str]) -> np.ndarray:
+        """Return the bounds of every query at once, one row per query.
+
+        The letters two strings share is the sum of min(count in one, count in
+        the other) over every letter, and min(a, b) is how many k >= 1 have
+        both a >= k and b >= k. So the whole table of them is a few matrix
+        products (one per k, and k only goes up to the biggest count in the
+        queries, which is tiny)."""
+        if self._table is None:
+            self._build_table()
+        table, alnum, other, lengths, alive = self._table
+        q_counts = np.zeros((len(queries), len(self._letters)), np.int32)
+        q_other = np.zeros((len(queries), 1), np.int64)
+        for i in range(len(queries)):
+            counts, q_other[i] = self._letter_counts(queries[i])
+            for c, count in counts.items():
+                if c in self._letters:
+                    q_counts[i, self._letters[c]] = count
+        # Letters in the query that no name has still count towards A
+        q_alnum = np.array([[distinct_letters(query)] for query in queries],
+                           np.int64).reshape(-1, 1)
+        shared = np.zeros((len(queries), len(table)), np.float32)
+        for k in range(1, q_counts.max(initial=0) + 1):
+            shared += (q_counts >= k).astype(np.float32) @ \
+                (table >= k).T.astype(np.float32)
+        # Every entry is a small whole number, so float32 got it exactly
+        shared = shared.astype(np.int64)
+        q_bound = 2 * (shared + q_other) / np.maximum(
+            q_alnum + shared + 2 * q_other, 1)
+        n_bound = 2 * (shared + other) / np.maximum(
+            alnum + shared + 2 * other, 1)
+        result = 100 * np.maximum(q_bound, n_bound)
+        for i in range(len(queries)):
+            shares = set()
+            for word in tokens(queries[i]):
+                shares.update(self._words.get(word, ()))
+            if shares:
+                shares = np.fromiter(shares, np.int64, len(shares))
+                q_raw, q_processed = self._lengths(queries[i])
+                cap = np.maximum(length_cap(lengths[shares, 0], q_raw),
+                                 length_cap(lengths[shares, 1], q_processed))
+                result[i, shares] = np.maximum(result[i, shares], cap)
+        result[:, ~alive] = -1
+        return result
+
+    def clear_cache(self) -> None:
+        """Forget every cached answer."""
+        self._cache.clear()
+        self._answers.clear()
+        self._added.clear()
+
+    def cache_info(self) -> dict[str, int]:
+        """Return how the cache is doing."""
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._cache), "max_size": self.cache_size}
+
+    def _cached(self, query: str) -> tuple[str, float] | None:
+        """Return the cached answer for query, or None if there isn't one (or
+        a name added since then beats it)."""
+        entry = self._cache.get(query)
+        if entry is None:
+            return None
+        if entry[2] < len(self._added):
+            added = [name for name in self._added[entry[2]:]
+                     if name in self._slots]
+            best = process.extractOne(query, added, scorer=fuzz.WRatio)
+            # On a tie the older name still wins, like it would in a search
+            if best is not None and best[1] > entry[1]:
+                self._forget(query)
+                return None
+            entry[2] = len(self._added)
+        self._cache.move_to_end(query)
+        return entry[0], entry[1]
+
+    def _remember(self, query: str, result: tuple[str, float]) -> None:
+        if self.cache_size <= 0:
+            return
+        if not self._cache:
+            # Nothing to check the names added before now against
+            self._added.clear()
+        self._cache[query] = [result[0], result[1], len(self._added)]
+        self._answers.setdefault(result[0], set()).add(query)
+        if len(self._cache) > self.cache_size:
+            self._forget(next(iter(self._cache)))
+
+    def _forget(self, query: str) -> None:
+        name = self._cache.pop(query)[0]
+        queries = self._answers[name]
+        queries.discard(query)
+        if not queries:
+            del self._answers[name]
+
+    def search(self, query: str) -> tuple[str, float] | None:
+        """Return the (name, score) of the best WRatio match for query, or None
+        if the index is empty. The result is always the same as running
+        process.extractOne over every name in the index."""
+        result = self._cached(query)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = self._search(query)
+        if result is not None:
+            self._remember(query, result)
+        return result
+
+    def _search(self, query: str) -> tuple[str, float] | None:
+        if not self._slots:
+            return None
+        bound = self.bounds(query)
+        size = min(self.shortlist, len(bound))
+        seed = np.argpartition(-bound, size - 1)[:size]
+        seed = [self._names[slot] for slot in np.sort(seed) if bound[slot] >= 0]
+        cutoff = process.extractOne(query, seed, scorer=fuzz.WRatio)[1]
+        # A tiny bit of slack so floating point rounding can't drop a name
+        # that ties the cutoff.
+        keep = np.flatnonzero(bound >= cutoff - 1e-6)
+        choices = [self._names[slot] for slot in keep]
+        if not choices:
+            # The bound should never allow this, but if it's ever wrong the
+            # answer still has to be the right one
+            choices = self._live_names()
+        # No score_cutoff here on purpose, rapidfuzz can round a score slightly
+        # differently when it has a cutoff to work with.
+        result = process.extractOne(query, choices, scorer=fuzz.WRatio)
+        return result[0], result[1]
+
+    def _live_names(self) -> list[str]:
+        """Return every name in the index, in the order they came in."""
+        return [self._names[slot] for slot in sorted(self._slots.values())]
+
+    def search_many(self, queries: list[str]) -> list[tuple[str, float] | None]:
+        """Return what search would for every query in queries, with the
+        bounds done as one matrix (see bounds_many) and the scoring done by
+        process.cdist (which scores a whole matrix in C, on every core) instead
+        of extractOne. It's the same cutoff trick as search: score every query
+        against its shortlist, then against whatever is left that could still
+        beat that. Queries in the cache don't get searched at all."""
+        result = [self._cached(query) for query in queries]
+        todo = [i for i in range(len(queries)) if result[i] is None]
+        self.hits += len(queries) - len(todo)
+        self.misses += len(todo)
+        found = self._search_many([queries[i] for i in todo])
+        for i, elm in zip(todo, found):
+            result[i] = elm
+            if elm is not None:
+                self._remember(queries[i], elm)
+        return result
+
+    def _search_many(self, queries: list[str]) -> list:
+        if not self._slots:
+            return [None] * len(queries)
+        if not queries:
+            return []
+        bounds = self.bounds_many(queries)
+        size = min(self.shortlist, bounds.shape[1])
+        seeds = []
+        for bound in bounds:
+            seed = np.sort(np.argpartition(-bound, size - 1)[:size])
+            seeds.append(seed[bound[seed] >= 0])
+        keep = []
+        for i, scores in enumerate(self._score_all(queries, seeds)):
+            slots = np.flatnonzero(bounds[i] >= scores.max() - 1e-6)
+            if len(slots) == 0:
+                # Same as in _search, every name it has
+                slots = np.sort(np.fromiter(self._slots.values(), np.int64,
+                                            len(self._slots)))
+            keep.append(slots)
+        result = []
+        for i, scores in enumerate(self._score_all(queries, keep)):
+            # argmax takes the first of a tie, and the slots are in the same
+            # order as _names, so ties go the same way as extractOne
+            best = scores.argmax()
+            result.append((self._names[keep[i][best]], float(scores[best])))
+        return result
+
+    def _score_all(self, queries: list[str], slots: list[np.ndarray]) -> list:
+        """Return the WRatio of queries[i] against the names at slots[i] (in
+        the same order) for every i. If the queries mostly want the same names
+        they're all scored as one matrix, since scoring a query against a name
+        it didn't ask for doesn't change anything. If not (a short query like
+        "3.5g" can want thousands of names that nobody else does), they're
+        scored one at a time."""
+        union = np.unique(np.concatenate(slots))
+        if len(union) * len(queries) > 2 * sum(map(len, slots)):
+            return [self._scores([queries[i]], slots[i])[0]
+                    for i in range(len(queries))]
+        scores = self._scores(queries, union)
+        return [scores[i, np.searchsorted(union, slots[i])]
+                for i in range(len(queries))]
+
+    def _scores(self, queries: list[str], slots: np.ndarray) -> np.ndarray:
+        """Return the WRatio of every query against the names at slots.
+        float64 so that the scores are exactly what extractOne gets."""
+        return process.cdist(queries, [self._names[slot] for slot in slots],
+                             scorer=fuzz.WRatio, dtype=np.float64, workers=-1)
+
+
+class SearchView(SearchIndex):
+    """The part of a shared SearchIndex that one store actually has (see
+    stores.py). The names, letter counts and tokens all live in index, once
+    for every store, and a view only keeps which of them are its own, by their
+    slot in index. Everything else in index gets a bound of -1, which is what
+    a removed name gets, so it can never be picked.
+
+    A view has its own cache (two stores can have different answers to the
+    same query). Ties go to whichever name came into index first, which is the
+    order of the shared catalog, not of the store's product_map.
+    ============================================================================
+    Attributes |
+    ===========
+    index: The shared SearchIndex. Names only ever go into it, so the slots
+           never move.
+
+    _slots: A dict object with a product name of this store pointing to its
+            slot in index.
+
+    The rest are the same as SearchIndex.
+    """
+
+    def __init__(self, index: SearchIndex, names=(),
+                 cache_size: int = 512) -> None:
+        self.index = index
+        self.shortlist = index.shortlist
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._answers = {}
+        self._added = []
+        self._slots = {}
+        for name in names:
+            self.add(name)
+
+    @property
+    def _names(self) -> list:
+        return self.index._names
+
+    def add(self, name: str) -> None:
+        """Add name to the view (and to index, if nobody had it yet)."""
+        if name in self._slots:
+            return
+        self.index.add(name)
+        self._slots[name] = self.index._slots[name]
+        self._note_added(name)
+
+    def discard(self, name: str) -> None:
+        """Remove name from the view. It stays in index, since another store
+        could have it too."""
+        if self._slots.pop(name, None) is None:
+            return
+        for query in self._answers.pop(name, ()):
+            del self._cache[query]
+
+    def bounds_many(self, queries: list[str]) -> np.ndarray:
+        """Return the bounds index gives every query, with -1 for every name
+        that isn't in the view."""
+        result = self.index.bounds_many(queries)
+        outside = np.ones(result.shape[1], bool)
+        outside[np.fromiter(self._slots.values(), np.int64,
+                            len(self._slots))] = False
+        result[:, outside] = -1
+        return result
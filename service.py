@@ -0,0 +1,475 @@
+import json
+import asyncio
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit, parse_qs, quote
+
+################################################################################
+# Inventory service
+#
+# Every register used to load its own copy of the CSV and build its own tree,
+# so a move made at one register never showed up at the next one. Now one
+# process holds THE UpdatedInventory and hands it out over a tiny HTTP/JSON
+# API, and the GUIs can talk to it through a RemoteInventory instead of
+# building their own:
+#
+#   GET  /fetch?q=jean guy     -> {"name": ..., "coordinate": ...}
+#   POST /lookup               {"queries": [...]} -> {"results": [...]}
+#   POST /pick                 {"queries": [...]} -> {"results": [...]} in
+#                              walking order (see fetch_many)
+#   POST /route                {"items": [...], "start": "F", "back": false}
+#                              -> {"route": [[name, coordinate], ...]} in the
+#                              order to pick them (see pick_path.py)
+#   POST /move                 {"items": [...], "loc": "F"}
+#                              -> {"moved": {name: new coordinate}}
+#   GET  /layout               -> the whole room -> shelf -> level tree
+#   GET  /stats                -> the hits and misses of the caches
+#
+# The connections all live on one asyncio event loop, so thousands of
+# registers can be connected at once without a thread each. The answers are
+# worked out in the loop's thread pool (run_in_executor) instead of on the loop
+# itself, so a slow search, or a move waiting for the Compactor to let go of the
+# inventory's lock, never holds up the loop (taking new connections, reading
+# requests and sending back the answers that are ready). They're worked out
+# one at a time, under the service's lock: a move redoes coordinates in both
+# maps as it goes, and the search and pick path caches aren't safe to share
+# between threads either, so a lookup can never see a move that's only half
+# done (and the inventory's lock keeps the Compactor out in the middle of one
+# as well).
+#
+# There's no web framework here on purpose. All it needs is GET/POST with a
+# JSON body and keep-alive, and that's a page of code.
+################################################################################
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# Nobody needs to send more than this in one request
+MAX_BODY = 1 << 20
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict",
+           500: "Internal Server Error"}
+
+
+class BadRequest(Exception):
+    """Raised (and turned into a 400) when a request doesn't make sense."""
+
+
+class MoveError(Exception):
+    """Raised (and turned into a 409) when a product can't go where it was
+    asked to (it's already there, or there's no cycle to send it along)."""
+
+
+class ServiceError(Exception):
+    """Raised by RemoteInventory when the service answers with an error that
+    isn't a KeyError (see RemoteInventory._request)."""
+
+
+class InventoryService:
+    """Serves one UpdatedInventory over HTTP (see the comment at the top).
+    ============================================================================
+    Attributes |
+    ===========
+    inventory: The UpdatedInventory being served.
+
+    host, port: Where the service listens.
+
+    routes: A dict object with (method, path) pointing to the method that
+            answers it. Each one takes (query, body) and returns a JSON-able
+            object, or raises KeyError (404), BadRequest (400) or MoveError
+            (409).
+
+    lock: A threading.Lock held while a route runs, so that one move (or
+          lookup) is done before the next one starts (see the comment at the
+          top).
+
+    _layout: The encoded /layout response, kept until the next move changes
+             it (it's the biggest thing anyone asks for).
+
+    _server: The asyncio Server, once it's started.
+    """
+
+    def __init__(self, inventory, host: str = HOST, port: int = PORT) -> None:
+        self.inventory = inventory
+        self.host = host
+        self.port = port
+        self.routes = {("GET", "/fetch"): self.fetch,
+                       ("POST", "/lookup"): self.lookup,
+                       ("POST", "/pick"): self.pick,
+                       ("POST", "/route"): self.route,
+                       ("POST", "/move"): self.move,
+                       ("GET", "/layout"): self.layout,
+                       ("GET", "/stats"): self.stats}
+        self.lock = threading.Lock()
+        self._layout = None
+        self._server = None
+
+    #########################
+    # The API
+    #########################
+
+    def fetch(self, query: dict, body) -> dict:
+        if "q" not in query:
+            raise BadRequest("fetch needs a q")
+        name, coordinate = self.inventory.fetch(query["q"])
+        return {"name": name, "coordinate": coordinate}
+
+    def lookup(self, query: dict, body) -> dict:
+        """Fetch a whole list of queries at once. A query with no match gets
+        None instead of failing the rest."""
+        queries = _field(body, "queries", list)
+        results = []
+        for search in queries:
+            if not isinstance(search, str):
+                raise BadRequest("every query has to be a string")
+            try:
+                name, coordinate = self.inventory.fetch(search)
+            except KeyError:
+                results.append(None)
+                continue
+            results.append({"name": name, "coordinate": coordinate})
+        return {"results": results}
+
+    def pick(self, query: dict, body) -> dict:
+        """Resolve a whole pick list at once, sorted into walking order."""
+        queries = _field(body, "queries", list)
+        if not all(isinstance(search, str) for search in queries):
+            raise BadRequest("every query has to be a string")
+        return {"results": [
+            {"query": search, "name": name, "coordinate": coordinate,
+             "score": score}
+            for search, name, coordinate, score in
+            self.inventory.fetch_many(queries)]}
+
+    def route(self, query: dict, body) -> dict:
+        """Order the exact product names in "items" into a pick path."""
+        items = _field(body, "items", list)
+        if not all(isinstance(item, str) for item in items):
+            raise BadRequest("every item has to be a string")
+        start = body.get("start")
+        if start is not None and not isinstance(start, str):
+            raise BadRequest("start has to be a room")
+        route = self.inventory.pick_path(items, start,
+                                         bool(body.get("back", False)))
+        return {"route": [list(stop) for stop in route]}
+
+    def move(self, query: dict, body) -> dict:
+        """Move the exact product names in "items" (or the one in "item") to
+        "loc" and return where they ended up."""
+        loc = _field(body, "loc", str)
+        if "item" in body:
+            items = [_field(body, "item", str)]
+        else:
+            items = _field(body, "items", list)
+        for item in items:
+            if not isinstance(item, str):
+                raise BadRequest("every item has to be a string")
+            if item not in self.inventory.product_map:
+                raise KeyError(item)
+        try:
+            if len(items) == 1:
+                self.inventory.item_to_loc(items[0], loc)
+            else:
+                self.inventory.items_to_loc(items, loc)
+        except KeyError as e:
+            # Everything is in the inventory, so it's the move that's wrong
+            raise MoveError(*(e.args or items)) from None
+        finally:
+            # Even a move that failed halfway could have moved something
+            self._layout = None
+        return {"moved": {item: self.inventory.product_map[item]
+                          for item in items}}
+
+    def layout(self, query: dict, body) -> bytes:
+        if self._layout is None:
+            self._layout = json.dumps(self.inventory.tree).encode("utf-8")
+        return self._layout
+
+    def stats(self, query: dict, body) -> dict:
+        return self.inventory.cache_stats()
+
+    #########################
+    # HTTP
+    #########################
+
+    def respond(self, method: str, target: str, body: bytes) -> tuple:
+        """Return the (status, JSON-able object or encoded bytes) that
+        answers the request. This runs in the thread pool (see handle), and
+        takes the lock while the route runs."""
+        url = urlsplit(target)
+        if not any(path == url.path for _, path in self.routes):
+            return 404, {"error": "no such thing as " + url.path}
+        route = self.routes.get((method, url.path))
+        if route is None:
+            return 405, {"error": url.path + " doesn't take " + method}
+        query = {key: values[-1] for key, values in
+                 parse_qs(url.query, keep_blank_values=True).items()}
+        try:
+            if body:
+                body = json.loads(body)
+            else:
+                body = {}
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            return 400, {"error": "bad JSON: " + str(e)}
+        # Anything else a route raises is a bug (a 500, see handle), not the
+        # client's fault
+        try:
+            with self.lock:
+                return 200, route(query, body)
+        except BadRequest as e:
+            return 400, {"error": str(e)}
+        except MoveError as e:
+            return 409, {"error": "can't move " + ", ".join(map(str, e.args))}
+        except KeyError as e:
+            return 404, {"error": "nothing found for " +
+                                  ", ".join(map(str, e.args))}
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        """Answer requests on one connection until the client is done with
+        it."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except BadRequest as e:
+                    writer.write(_response(400, {"error": str(e)}, False))
+                    break
+                if request is None:
+                    break
+                method, target, keep_alive, body = request
+                try:
+                    status, payload = await loop.run_in_executor(
+                        None, self.respond, method, target, body)
+                except Exception as e:
+                    # Keep serving everyone else
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self.handle, self.host,
+                                                  self.port)
+        # With port 0 the system picks one
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+
+
+def _field(body, key: str, kind: type):
+    """Return body[key], or raise a BadRequest if it isn't there or isn't a
+    kind."""
+    if not isinstance(body, dict) or not isinstance(body.get(key), kind):
+        raise BadRequest("needs a " + kind.__name__ + " " + key)
+    return body[key]
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    """Return (method, target, keep_alive, body) of the next request on
+    reader, or None if the client hung up."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise BadRequest("bad request line") from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise BadRequest("bad Content-Length") from None
+    if length > MAX_BODY or length < 0:
+        raise BadRequest("body too big")
+    body = await reader.readexactly(length) if length else b""
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.0":
+        keep_alive = connection == "keep-alive"
+    else:
+        keep_alive = connection != "close"
+    return method, target, keep_alive, body
+
+
+def _response(status: int, payload, keep_alive: bool) -> bytes:
+    if not isinstance(payload, bytes):
+        payload = json.dumps(payload).encode("utf-8")
+    head = f"HTTP/1.1 {status} {REASONS[status]}\r\n" \
+           f"Content-Type: application/json\r\n" \
+           f"Content-Length: {len(payload)}\r\n"
+    if not keep_alive:
+        head += "Connection: close\r\n"
+    return head.encode("latin-1") + b"\r\n" + payload
+
+
+class RemoteInventory:
+    """A stand-in for UpdatedInventory that asks an InventoryService for
+    everything, so a GUI can be a thin client. It has the parts of
+    UpdatedInventory the GUIs use: fetch, fetch_many, pick_path, item_to_loc,
+    items_to_loc, cache_stats and tree.
+    Just like UpdatedInventory, a KeyError means nothing was found or the move
+    can't happen.
+    ============================================================================
+    Attributes |
+    ===========
+    host, port: Where the service is.
+
+    journal: Always None. The service keeps the journal, not the client.
+
+    path: Always None. The service writes the snapshot, not the client (so the
+          app never writes this computer's storage file over, see
+          lookup_app.DataWindow).
+
+    _connection: The http.client.HTTPConnection that's kept open between
+                 requests.
+
+    _lock: A threading.Lock so two threads never talk over each other on the
+           same connection.
+    """
+
+    def __init__(self, host: str = HOST, port: int = PORT,
+                 timeout: float = 10.0) -> None:
+        self.host = host
+        self.port = port
+        self.journal = None
+        self.path = None
+        self._connection = http.client.HTTPConnection(host, port,
+                                                      timeout=timeout)
+        self._lock = threading.Lock()
+
+    def _request(self, method: str, path: str, payload=None):
+        body = None
+        headers = {}
+        if payload is not None:
+            body = json.dumps(payload).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        with self._lock:
+            for attempt in range(2):
+                sent = False
+                try:
+                    self._connection.request(method, path, body, headers)
+                    sent = True
+                    response = self._connection.getresponse()
+                    data = response.read()
+                    break
+                except (ConnectionError, http.client.HTTPException):
+                    # The service closed the connection we were holding on
+                    # to (it was restarted, for example). Try once more, but
+                    # a POST that went out could have been done already (a
+                    # move made twice), so only if it never got sent.
+                    self._connection.close()
+                    if attempt or (sent and method != "GET"):
+                        raise
+        result = json.loads(data)
+        if response.status in (404, 409):
+            raise KeyError(result["error"])
+        if response.status != 200:
+            raise ServiceError(result["error"])
+        return result
+
+    def fetch(self, search: str) -> tuple[str, str]:
+        result = self._request("GET", "/fetch?q=" + quote(search))
+        return result["name"], result["coordinate"]
+
+    def lookup(self, queries: list[str]) -> list[tuple[str, str] | None]:
+        """Return what fetch would for every query (None for no match), in
+        one round trip."""
+        results = self._request("POST", "/lookup", {"queries": queries})
+        return [None if result is None else
+                (result["name"], result["coordinate"])
+                for result in results["results"]]
+
+    def fetch_many(self, queries: list[str]) -> list[tuple]:
+        """Return (query, name, coordinate, score) for every query, in walking
+        order (see UpdatedInventory.fetch_many)."""
+        results = self._request("POST", "/pick", {"queries": queries})
+        return [(result["query"], result["name"], result["coordinate"],
+                 result["score"]) for result in results["results"]]
+
+    def pick_path(self, products: list[str], start: str = None,
+                  back: bool = False) -> list[tuple[str, str]]:
+        """Return (product, coordinate) for every product in the order to pick
+        them in (see UpdatedInventory.pick_path)."""
+        result = self._request("POST", "/route", {"items": products,
+                                                  "start": start,
+                                                  "back": back})
+        return [tuple(stop) for stop in result["route"]]
+
+    def item_to_loc(self, item: str, loc: str) -> None:
+        self._request("POST", "/move", {"item": item, "loc": loc})
+
+    def items_to_loc(self, items: list[str], loc: str) -> None:
+        self._request("POST", "/move", {"items": items, "loc": loc})
+
+    def cache_stats(self) -> dict:
+        return self._request("GET", "/stats")
+
+    @property
+    def tree(self) -> dict:
+        return self._request("GET", "/layout")
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def serve(path: str, host: str = HOST, port: int = PORT) -> None:
+    """Build the inventory out of the CSV at path (or the snapshot, if there is
+    one) the same way inventory_documentation does, and serve it until
+    killed."""
+    from layout import load_layout, compile_layout
+    from journal import MoveJournal, Compactor
+    from ingest import read_inventory
+    import inventory_documentation as documentation
+
+    plan = compile_layout(load_layout())
+    atom = plan.build(read_inventory(path, plan))
+    journal = MoveJournal(documentation.JOURNAL)
+    inventory = documentation.UpdatedInventory(atom, journal=journal)
+    Compactor(journal, lambda: inventory.tree,
+              documentation.STORAGE).start()
+    service = InventoryService(inventory, host, port)
+    print(f"Serving on {host}:{port}")
+    asyncio.run(service.serve_forever())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the inventory over "
+                                                 "HTTP, or open the app on a "
+                                                 "served inventory.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("serve")
+    command.add_argument("csv", help="the inventory CSV")
+    command.add_argument("--host", default=HOST)
+    command.add_argument("--port", type=int, default=PORT)
+    command = commands.add_parser("connect",
+                                  help="run the PyQt app as a thin client")
+    command.add_argument("--host", default=HOST)
+    command.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.csv, args.host, args.port)
+    else:
+        import inventory_documentation
+        inventory_documentation.main(RemoteInventory(args.host, args.port))
@@ -0,0 +1,433 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import numpy as np
+from coordinate_codec import slot_labels
+
+################################################################################
+# Binary snapshots of the inventory
+#
+# The store used to be saved as storage.json with indent=4, which means every
+# start up parses the entire thing before a single window shows up. A snapshot
+# holds the exact same room/shelf/level/product tree, but laid out so that it
+# can be mmapped and read in place:
+#
+#   - A header (see HEADER) with the magic, the version, and how big every
+#     section is.
+#   - A string table. Every room, shelf, level, product name and z label is
+#     written ONCE as utf-8, with a uint32 array of where each one starts.
+#   - The levels, one row of uint32s (room, shelf, level, first product,
+#     how many products) each, in the same order as the tree.
+#   - The products of every level back to back, as string ids.
+#   - The z labels, so the coordinates come out exactly the same as
+#     coordinate_map_build made them.
+#   - Three sorted orders (levels by "room.x.y", products by name, z labels by
+#     label), so that a coordinate or a product can be looked up with a binary
+#     search over the file instead of building any dicts at all.
+#
+# All the arrays are numpy views over the mmap, so opening a snapshot only
+# reads the header. Every section starts on a multiple of 4 bytes.
+################################################################################
+
+MAGIC = b"IMSNAP\0\0"
+VERSION = 1
+# magic, version, (padding), strings, blob size, levels, products, z labels
+HEADER = struct.Struct("<8sHHIIIII")
+# A room or a shelf with nothing under it still has to come back, so it gets
+# a level row with this as the shelf/level
+MISSING = 0xFFFFFFFF
+
+
+class SnapshotError(Exception):
+    """Raised when a file isn't a snapshot this version can read, or a tree
+    can't be written as one."""
+
+
+def _pad(n: int) -> int:
+    """Return how many bytes it takes to get n up to a multiple of 4."""
+    return -n % 4
+
+
+def _normalize(tree: dict) -> dict:
+    """Return tree with every shelf being a dict of levels. The 'empty' tree
+    that DataWindow.clear_all writes has empty lists for its shelves, which
+    just means a shelf without any levels."""
+    result = {}
+    for room in tree:
+        result[room] = {}
+        for x in tree[room]:
+            shelf = tree[room][x]
+            if isinstance(shelf, list):
+                if shelf:
+                    raise SnapshotError("Shelf " + room + '.' + x + " has "
+                                        "products but no levels")
+                shelf = {}
+            result[room][x] = {y: list(shelf[y]) for y in shelf}
+    return result
+
+
+def write_snapshot(path: str, tree: dict, z_labels: list[str] = None) -> None:
+    """Save tree (room -> shelf -> level -> list of product names) to path as a
+    snapshot. z_labels[i] is the z coordinate of the i-th product of a level,
+    and there has to be one for every position that is actually used. If it
+    isn't given, they're the a, b, ..., aa, ... of slot_labels (see
+    coordinate_codec.py), as many as the longest level needs.
+
+    The file is written next to path first and then swapped in, so a crash
+    halfway through never leaves a broken snapshot behind. It's on the disk
+    (the file and the swap both) by the time this returns, so whoever throws
+    away the journal after it (see journal.py) can't lose a move to the power
+    going out."""
+    tree = _normalize(tree)
+    strings = {}
+
+    def intern(string: str) -> int:
+        if string not in strings:
+            strings[string] = len(strings)
+        return strings[string]
+
+    levels = []
+    products = []
+    longest = 0
+    for room in tree:
+        if not tree[room]:
+            levels.append((intern(room), MISSING, MISSING, len(products), 0))
+        for x in tree[room]:
+            if not tree[room][x]:
+                levels.append((intern(room), intern(x), MISSING,
+                               len(products), 0))
+            for y in tree[room][x]:
+                names = tree[room][x][y]
+                levels.append((intern(room), intern(x), intern(y),
+                               len(products), len(names)))
+                products.extend(intern(name) for name in names)
+                longest = max(longest, len(names))
+    if z_labels is None:
+        z_labels = slot_labels(max(longest, 1)).tolist()
+    if longest > len(z_labels):
+        raise SnapshotError("A level has " + str(longest) + " products but "
+                            "there are only " + str(len(z_labels)) +
+                            " z labels")
+    z_labels = [intern(label) for label in z_labels[:max(longest, 1)]]
+
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, np.uint32)
+    offsets[1:] = np.cumsum([len(elm) for elm in encoded])
+    blob = b"".join(encoded)
+
+    levels = np.array(levels, np.uint32).reshape(-1, 5)
+    products = np.array(products, np.uint32)
+    z_labels = np.array(z_labels, np.uint32)
+    keys = [_level_key(encoded, row) for row in levels]
+    level_order = np.array(sorted(range(len(keys)), key=keys.__getitem__),
+                           np.uint32)
+    # Equal names stay in tree order, so the LAST one wins a lookup, just like
+    # in product_map_build
+    name_order = np.array(sorted(range(len(products)),
+                                 key=lambda i: encoded[products[i]]),
+                          np.uint32)
+    z_order = np.array(sorted(range(len(z_labels)),
+                              key=lambda i: encoded[z_labels[i]]), np.uint32)
+
+    temp = path + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(encoded), len(blob),
+                            len(levels), len(products), len(z_labels)))
+        f.write(offsets.tobytes())
+        f.write(blob + b"\0" * _pad(len(blob)))
+        for array in [levels, level_order, products, name_order, z_labels,
+                      z_order]:
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+    sync_directory(path)
+
+
+def sync_directory(path: str) -> None:
+    """Make sure the file at path being created, renamed or swapped in is on
+    the disk, by fsyncing the folder it's in. Windows has no way to open a
+    folder for that (and NTFS keeps renames in its own log), so there it's
+    skipped."""
+    if os.name == "nt":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _level_key(encoded: list[bytes], row) -> bytes:
+    """Return the "room.x.y" of a level row as bytes (what the level order is
+    sorted by). Rooms and shelves without levels get keys nothing can find."""
+    if row[2] == MISSING:
+        return b"\xff" + encoded[row[0]]
+    return encoded[row[0]] + b"." + encoded[row[1]] + b"." + encoded[row[2]]
+
+
+class Snapshot:
+    """A snapshot file opened with mmap. Nothing gets parsed until it is asked
+    for, and coordinate/location only ever read what they need.
+    ============================================================================
+    Attributes |
+    ===========
+    path: The file that is opened.
+
+    _offsets, _levels, _level_order, _products, _name_order, _z_labels,
+    _z_order: numpy arrays sitting right on top of the mmap (see the comment
+              at the top for what they are).
+
+    _blob: A memoryview of the utf-8 strings.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise SnapshotError(path + " is too small to be a snapshot")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, n_strings, blob_size, n_levels, n_products, \
+            n_z = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise SnapshotError(path + " is not a snapshot")
+        if version != VERSION:
+            raise SnapshotError(path + " is version " + str(version) +
+                                ", but only version " + str(VERSION) +
+                                " can be read")
+        at = HEADER.size
+        self._offsets, at = self._array(at, n_strings + 1)
+        self._blob = memoryview(self._mmap)[at:at + blob_size]
+        at += blob_size + _pad(blob_size)
+        self._levels, at = self._array(at, n_levels * 5)
+        self._levels = self._levels.reshape(-1, 5)
+        self._level_order, at = self._array(at, n_levels)
+        self._products, at = self._array(at, n_products)
+        self._name_order, at = self._array(at, n_products)
+        self._z_labels, at = self._array(at, n_z)
+        self._z_order, at = self._array(at, n_z)
+        if at != len(self._mmap):
+            raise SnapshotError(path + " is cut off or has junk at the end")
+
+    def _array(self, at: int, n: int) -> tuple[np.ndarray, int]:
+        """Return the uint32 array of length n starting at byte at, and where
+        the next section starts."""
+        if at + 4 * n > len(self._mmap):
+            raise SnapshotError(self.path + " is cut off")
+        return np.frombuffer(self._mmap, np.uint32, n, at), at + 4 * n
+
+    def close(self) -> None:
+        """Let go of the file (which Windows needs before the file can be
+        written over). The snapshot can't be used after this."""
+        if self._mmap.closed:
+            return
+        self._offsets = self._levels = self._level_order = None
+        self._products = self._name_order = None
+        self._z_labels = self._z_order = None
+        self._blob.release()
+        self._mmap.close()
+
+    def __len__(self) -> int:
+        """Return the number of products (counting a product once per level
+        it is on)."""
+        return len(self._products)
+
+    def _bytes(self, i: int) -> bytes:
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]])
+
+    def _string(self, i: int) -> str:
+        return self._bytes(i).decode("utf-8")
+
+    def _search(self, order: np.ndarray, key: bytes, key_of) -> int:
+        """Return the position of the first element of order whose key_of is
+        >= key (a binary search, like bisect_left)."""
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key_of(order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def coordinate(self, coordinate: str) -> str | None:
+        """Return the product at coordinate (like "F.1.2.c"), or None if there
+        is nothing there."""
+        parts = coordinate.split('.')
+        if len(parts) != 4:
+            return None
+        level_key = '.'.join(parts[:3]).encode("utf-8")
+
+        def level_key_of(i):
+            row = self._levels[i]
+            if row[2] == MISSING:
+                return b"\xff"
+            return self._bytes(row[0]) + b"." + self._bytes(row[1]) + b"." + \
+                self._bytes(row[2])
+
+        i = self._search(self._level_order, level_key, level_key_of)
+        if i == len(self._level_order) or \
+                level_key_of(self._level_order[i]) != level_key:
+            return None
+        row = self._levels[self._level_order[i]]
+        z = parts[3].encode("utf-8")
+        j = self._search(self._z_order, z,
+                         lambda k: self._bytes(self._z_labels[k]))
+        if j == len(self._z_order) or \
+                self._bytes(self._z_labels[self._z_order[j]]) != z:
+            return None
+        position = self._z_order[j]
+        if position >= row[4]:
+            return None
+        return self._string(self._products[row[3] + position])
+
+    def location(self, name: str) -> str | None:
+        """Return the coordinate of the product called name, or None if it
+        isn't in the snapshot. A product on more than one level gives the same
+        coordinate that product_map would have."""
+        key = name.encode("utf-8")
+
+        def name_of(slot):
+            return self._bytes(self._products[slot])
+
+        # The last slot with this name is the one right before the first slot
+        # with a bigger name (and nothing fits between name and name + "\0")
+        i = self._search(self._name_order, key + b"\0", name_of)
+        if i == 0 or name_of(self._name_order[i - 1]) != key:
+            return None
+        return self._slot_coordinate(self._name_order[i - 1])
+
+    def _slot_coordinate(self, slot: int) -> str:
+        """Return the coordinate of the product at slot."""
+        # Empty levels share their first slot with the next level, and taking
+        # the last level that starts at or before slot skips right over them
+        level = np.searchsorted(self._levels[:, 3], slot, side="right") - 1
+        row = self._levels[level]
+        return self._string(row[0]) + '.' + self._string(row[1]) + '.' + \
+            self._string(row[2]) + '.' + \
+            self._string(self._z_labels[slot - row[3]])
+
+    def tree(self) -> dict:
+        """Return the whole room -> shelf -> level -> product list tree."""
+        strings = self._strings()
+        result = {}
+        for room, x, y, first, count in self._levels.tolist():
+            shelves = result.setdefault(strings[room], {})
+            if x == MISSING:
+                continue
+            levels = shelves.setdefault(strings[x], {})
+            if y == MISSING:
+                continue
+            products = self._products[first:first + count].tolist()
+            levels[strings[y]] = [strings[i] for i in products]
+        return result
+
+    def coordinate_map(self) -> dict[str, str]:
+        """Return the coordinate_map (coordinate -> product) that
+        coordinate_map_build would make out of the tree."""
+        strings = self._strings()
+        z_labels = [strings[i] for i in self._z_labels.tolist()]
+        result = {}
+        for room, x, y, first, count in self._levels.tolist():
+            if y == MISSING:
+                continue
+            prefix = strings[room] + '.' + strings[x] + '.' + strings[y] + '.'
+            products = self._products[first:first + count].tolist()
+            for i in range(count):
+                result[prefix + z_labels[i]] = strings[products[i]]
+        return result
+
+    def product_map(self) -> dict[str, str]:
+        """Return the product_map (product -> coordinate)."""
+        result = {}
+        coordinate_map = self.coordinate_map()
+        for coordinate in coordinate_map:
+            result[coordinate_map[coordinate]] = coordinate
+        return result
+
+    def _strings(self) -> list[str]:
+        """Return the entire string table decoded."""
+        offsets = self._offsets.tolist()
+        blob = bytes(self._blob)
+        return [blob[offsets[i]:offsets[i + 1]].decode("utf-8")
+                for i in range(len(offsets) - 1)]
+
+
+def check_round_trip(path: str, tree: dict,
+                     z_labels: list[str] = None) -> None:
+    """Raise a SnapshotError unless the snapshot at path gives back exactly
+    tree, and both maps that coordinate_map_build/product_map_build would
+    make out of it (lookups included). z_labels is the same as for
+    write_snapshot."""
+    tree = _normalize(tree)
+    if z_labels is None:
+        longest = max([len(tree[room][x][y]) for room in tree
+                       for x in tree[room] for y in tree[room][x]] + [1])
+        z_labels = slot_labels(longest).tolist()
+    coordinate_map = {}
+    for room in tree:
+        for x in tree[room]:
+            for y in tree[room][x]:
+                products = tree[room][x][y]
+                for i in range(len(products)):
+                    coordinate = room + '.' + x + '.' + y + '.' + z_labels[i]
+                    coordinate_map[coordinate] = products[i]
+    product_map = {}
+    for coordinate in coordinate_map:
+        product_map[coordinate_map[coordinate]] = coordinate
+    snapshot = Snapshot(path)
+    try:
+        if snapshot.tree() != tree or \
+                list(snapshot.tree()) != list(tree):
+            raise SnapshotError("The tree didn't survive the round trip")
+        if snapshot.coordinate_map() != coordinate_map:
+            raise SnapshotError("The coordinate map didn't survive the round "
+                                "trip")
+        if snapshot.product_map() != product_map:
+            raise SnapshotError("The product map didn't survive the round "
+                                "trip")
+        for coordinate in coordinate_map:
+            if snapshot.coordinate(coordinate) != coordinate_map[coordinate]:
+                raise SnapshotError("Looking up " + coordinate + " is broken")
+        for name in product_map:
+            if snapshot.location(name) != product_map[name]:
+                raise SnapshotError("Looking up " + name + " is broken")
+    finally:
+        snapshot.close()
+
+
+def z_labels_from(data_path: str) -> list[str]:
+    """Return the z labels (in order) from the z_coordinate table in
+    data.json, lowercased like coordinate_map_build does."""
+    with open(data_path) as f:
+        data = json.load(f)
+    labels = data["z_coordinate"][0]
+    result = [None] * len(labels)
+    for alpha in labels:
+        result[labels[alpha]] = alpha.lower()
+    return result
+
+
+def convert(json_path: str, path: str, z_labels: list[str] = None) -> None:
+    """Turn a storage.json into a snapshot at path, and make sure it reads
+    back exactly the same."""
+    with open(json_path) as f:
+        tree = json.load(f)
+    write_snapshot(path, tree, z_labels)
+    check_round_trip(path, tree, z_labels)
+
+
+if __name__ == "__main__":
+    # python snapshot.py storage.json storage.snap [data.json]
+    # (the z labels are made up as needed, unless an old data.json is given)
+    if len(sys.argv) not in [3, 4]:
+        print("usage: python snapshot.py storage.json storage.snap "
+              "[data.json]")
+        sys.exit(1)
+    z_labels = None
+    if len(sys.argv) == 4:
+        z_labels = z_labels_from(sys.argv[3])
+    convert(sys.argv[1], sys.argv[2], z_labels)
+    print("Wrote " + sys.argv[2])
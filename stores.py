@@ -0,0 +1,268 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from layout import load_layout, compile_layout
+from search_index import SearchIndex, SearchView
+from snapshot import Snapshot, write_snapshot
+from journal import MoveJournal, Compactor, save
+import inventory_documentation as documentation
+
+################################################################################
+# Many stores in one process
+#
+# Every store used to be its own process, with its own UpdatedInventory, its
+# own storage file and its own copy of (mostly) the same product names. Almost
+# all of what an inventory costs is its SearchIndex (the letter counts and
+# tokens of every name come to over 1 KB a name, against a few hundred bytes for
+# its spot in the tree and the maps), and that's exactly the part that is the
+# same in every store. So a StoreRegistry keeps one Catalog for all of them:
+#
+#   - Every product name gets an id, which is its slot in the catalog's one
+#     SearchIndex, and every SKU gets an id too. The catalog keeps the one copy
+#     of every string.
+#   - A store's frame gets its strings swapped for the catalog's (see
+#     Catalog.intern) before its layout is built, so its tree, its maps and
+#     its frames all point at the catalog's strings instead of having their
+#     own.
+#   - A store searches through a SearchView (see search_index.py), which is
+#     only the ids of its own names.
+#
+# So what one more store costs is its layout: its trees, its maps and the ids
+# of its products, and not the size of the catalog. The first store to have a
+# name pays for its search entry, and every store after that gets it for free.
+#
+# Every store has its own folder under the registry's root with its own
+# storage.snap and moves.journal (the same files inventory_documentation uses
+# for the one store it runs):
+#
+#   registry = StoreRegistry("stores")
+#   registry.open("downtown", read_inventory("downtown.csv"))
+#   registry.open("uptown", read_inventory("uptown.csv"))
+#   registry["uptown"].fetch("area 51")
+################################################################################
+
+# The files every store keeps in its folder
+STORAGE = documentation.STORAGE
+JOURNAL = documentation.JOURNAL
+
+
+class Catalog:
+    """The product names and SKUs of every store in a registry, each kept
+    once (see the comment at the top).
+    ============================================================================
+    Attributes |
+    ===========
+    index: The SearchIndex every store searches through. The id of a name is
+           its slot in here. It has no cache of its own, since every store's
+           SearchView keeps one.
+
+    skus: A list of every SKU, so skus[i] is the SKU with id i.
+
+    _sku_ids: A dict object with a SKU pointing to its id.
+    """
+
+    def __init__(self) -> None:
+        self.index = SearchIndex(cache_size=0)
+        self.skus = []
+        self._sku_ids = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def name(self, name: str) -> str:
+        """Return the catalog's copy of name, adding it if it's new."""
+        self.index.add(name)
+        return self.index._names[self.index._slots[name]]
+
+    def sku(self, sku: str) -> str:
+        """Return the catalog's copy of sku, adding it if it's new."""
+        i = self._sku_ids.get(sku)
+        if i is None:
+            i = self._sku_ids[sku] = len(self.skus)
+            self.skus.append(sys.intern(sku))
+        return self.skus[i]
+
+    def name_ids(self, names) -> np.ndarray:
+        """Return the ids of names (which all have to be in the catalog)."""
+        slots = self.index._slots
+        return np.fromiter((slots[name] for name in names), np.int64)
+
+    def sku_ids(self, skus) -> np.ndarray:
+        """Return the ids of skus (which all have to be in the catalog)."""
+        return np.fromiter((self._sku_ids[sku] for sku in skus), np.int64)
+
+    def names(self, ids) -> list[str]:
+        """Return the names with these ids."""
+        return [self.index._names[i] for i in ids]
+
+    def intern(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Return a copy of df with every product name and SKU swapped for the
+        catalog's copy of it (anything that isn't a string is left as is)."""
+        columns = {"Product Name": self.name, "SKU": self.sku}
+        df = df.copy()
+        for column, intern in columns.items():
+            if column in df.columns:
+                df[column] = pd.Series(
+                    [intern(elm) if type(elm) is str else elm
+                     for elm in df[column]], index=df.index, dtype=object)
+        return df
+
+    def intern_tree(self, tree: dict) -> dict:
+        """Swap every name in a room -> shelf -> level -> products tree for
+        the catalog's copy of it, in place, and return the tree."""
+        for room in tree:
+            for x in tree[room]:
+                for y in tree[room][x]:
+                    products = tree[room][x][y]
+                    products[:] = [self.name(name) for name in products]
+        return tree
+
+
+class Store:
+    """One store of a StoreRegistry.
+    ============================================================================
+    Attributes |
+    ===========
+    name: The name of the store (and of its folder).
+
+    folder: The folder its storage and journal are in.
+
+    inventory: Its UpdatedInventory, searching through a SearchView of the
+               catalog.
+
+    journal: Its MoveJournal (None if it doesn't keep one).
+
+    compactor: The Compactor folding its journal into its storage (None if it
+               doesn't keep a journal).
+    """
+
+    def __init__(self, name: str, folder: str, inventory,
+                 journal: MoveJournal = None,
+                 compactor: Compactor = None) -> None:
+        self.name = name
+        self.folder = folder
+        self.inventory = inventory
+        self.journal = journal
+        self.compactor = compactor
+
+    @property
+    def storage(self) -> str:
+        return os.path.join(self.folder, STORAGE)
+
+
+class StoreRegistry:
+    """Every store running in this process, over one shared Catalog (see the
+    comment at the top).
+    ============================================================================
+    Attributes |
+    ===========
+    root: The folder with a folder for every store in it.
+
+    catalog: The Catalog all of the stores share.
+
+    plan: The LayoutPlan a store gets built with if it isn't given its own.
+
+    stores: A dict object with the name of a store pointing to its Store.
+    """
+
+    def __init__(self, root: str = ".", catalog: Catalog = None,
+                 plan=None) -> None:
+        self.root = root
+        self.catalog = Catalog() if catalog is None else catalog
+        self.plan = compile_layout(load_layout()) if plan is None else plan
+        self.stores = {}
+
+    def __len__(self) -> int:
+        return len(self.stores)
+
+    def __iter__(self):
+        return iter(self.stores)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.stores
+
+    def __getitem__(self, name: str):
+        """Return the UpdatedInventory of the store name."""
+        return self.stores[name].inventory
+
+    def open(self, name: str, df: pd.DataFrame = None, plan=None,
+             journal: bool = True):
+        """Start up the store name and return its UpdatedInventory.
+
+        If the store has a storage.snap in its folder it's loaded from there
+        (with its journal replayed on top, like inventory_documentation does),
+        and if not its layout is built out of df with plan (the registry's, if
+        not given). Raise a ValueError if it has neither, and a KeyError if
+        the store is already open."""
+        if name in self.stores:
+            raise KeyError(name)
+        folder = os.path.join(self.root, name)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, STORAGE)
+        storage = {}
+        if os.path.exists(path):
+            snapshot = Snapshot(path)
+            if len(snapshot) > 0:
+                # The snapshot's strings are its own, so this goes through the
+                # catalog like a storage.json would (and the file has to be
+                # free for the next snapshot anyway)
+                storage = self.catalog.intern_tree(snapshot.tree())
+            snapshot.close()
+        atom = None
+        if documentation.empty_storage(storage):
+            if df is None:
+                raise ValueError("Store " + name + " has no storage and no "
+                                 "inventory to build it from")
+            if plan is None:
+                plan = self.plan
+            atom = plan.build(self.catalog.intern(df))
+        moves = None
+        if journal:
+            moves = MoveJournal(os.path.join(folder, JOURNAL))
+        inventory = documentation.UpdatedInventory(
+            atom, journal=moves, storage=storage,
+            search_index=SearchView(self.catalog.index), path=path)
+        compactor = None
+        if moves is not None:
+            compactor = Compactor(moves, lambda: inventory.tree, path)
+            compactor.start()
+        self.stores[name] = Store(name, folder, inventory, moves, compactor)
+        return inventory
+
+    def reload(self, name: str, df: pd.DataFrame) -> dict[str, int]:
+        """Update the store name to a new CSV (see UpdatedInventory.reload),
+        with its strings swapped for the catalog's first, and save it so its
+        snapshot is the reloaded store."""
+        store = self.stores[name]
+        result = store.inventory.reload(self.catalog.intern(df))
+        # With a journal, reload already wrote the snapshot to store.storage
+        if store.journal is None:
+            self.save(name)
+        return result
+
+    def product_ids(self, name: str) -> np.ndarray:
+        """Return the catalog ids of every product the store name has."""
+        return np.sort(self.catalog.name_ids(
+            self.stores[name].inventory.product_map))
+
+    def save(self, name: str) -> None:
+        """Write a snapshot of the store name right now (and throw its journal
+        away, since every move is in there)."""
+        store = self.stores[name]
+        tree = store.inventory.tree
+        if store.journal is None:
+            write_snapshot(store.storage, tree)
+        else:
+            save(store.journal, tree, store.storage)
+
+    def close(self, name: str, keep: bool = True) -> None:
+        """Shut down the store name, saving it first if keep is True. Its
+        names stay in the catalog, since another store could have them."""
+        if keep:
+            self.save(name)
+        store = self.stores.pop(name)
+        if store.compactor is not None:
+            store.compactor.stop()
+        if store.journal is not None:
+            store.journal.close()
@@ -0,0 +1,111 @@
+import pytest
+import inventory_documentation as documentation
+from layout import load_layout, compile_layout
+from journal import MoveJournal, Compactor, compact, save, read_journal
+from snapshot import Snapshot, write_snapshot
+
+################################################################################
+# However the program goes down (in the middle of writing a move, or at any
+# step of a compaction), starting over from the snapshot and the journal has
+# to come back to exactly the inventory that was running.
+################################################################################
+
+
+@pytest.fixture
+def running(store, tmp_path):
+    """An inventory with a journal, saved once, with no moves yet."""
+    path = str(tmp_path / "storage.snap")
+    journal = MoveJournal(str(tmp_path / "moves.journal"), sync=False)
+    inventory = documentation.UpdatedInventory(
+        compile_layout(load_layout()).build(store), journal=journal,
+        storage={}, path=path)
+    write_snapshot(path, inventory.tree)
+    yield inventory
+    journal.close()
+
+
+def _move(inventory, count: int) -> list[str]:
+    """Move count products from the front of the first cycle to the back, one
+    at a time, and return them."""
+    (room, x, y), back = sorted(inventory.cycles.items())[0]
+    items = inventory.tree[room][x][y][:count]
+    for item in items:
+        inventory.item_to_loc(item, back[0])
+    return items
+
+
+def _restart(inventory):
+    """Return the inventory that a restart after a crash would come back
+    with."""
+    journal = MoveJournal(inventory.journal.path, sync=False)
+    return documentation.UpdatedInventory(None, journal=journal,
+                                          storage=Snapshot(inventory.path),
+                                          path=inventory.path)
+
+
+def _assert_same(restarted, inventory) -> None:
+    try:
+        assert restarted.tree == inventory.tree
+        assert restarted.product_map == inventory.product_map
+        assert restarted.coordinate_map == inventory.coordinate_map
+    finally:
+        restarted.journal.close()
+
+
+def test_crash_mid_write(running) -> None:
+    items = _move(running, 5)
+    assert [event[0] for event in read_journal(running.journal.path)] == items
+    # The power went out halfway through the next line
+    with open(running.journal.path, "ab") as f:
+        f.write(b'["' + items[0].encode("utf-8") + b'", "F.1')
+    assert len(read_journal(running.journal.path)) == 5
+    _assert_same(_restart(running), running)
+
+
+def test_crash_mid_compaction(running) -> None:
+    _move(running, 3)
+    # Step 1 happened, and then more moves, but the snapshot never got
+    # written
+    running.journal.rotate()
+    _move(running, 2)
+    _assert_same(_restart(running), running)
+    # The snapshot got written, but path.compacting is still there. Its moves
+    # are in the snapshot already, so replaying them has to change nothing
+    write_snapshot(running.path, running.tree)
+    _assert_same(_restart(running), running)
+
+
+def test_failed_compaction_keeps_every_move(running) -> None:
+    first = _move(running, 2)
+    running.journal.rotate()
+    second = _move(running, 2)
+    # The last one never finished, so this one goes on the end of it
+    running.journal.rotate()
+    assert [event[0] for event in running.journal.events()] == first + second
+    assert running.journal.count == 0
+    _assert_same(_restart(running), running)
+
+
+def test_compaction(running) -> None:
+    _move(running, 4)
+    compact(running.journal, lambda: running.tree, running.path)
+    assert running.journal.events() == []
+    assert running.journal.count == 0
+    _assert_same(_restart(running), running)
+    _move(running, 1)
+    _assert_same(_restart(running), running)
+    save(running.journal, running.tree, running.path)
+    assert running.journal.events() == []
+    _assert_same(_restart(running), running)
+
+
+def test_compactor(running) -> None:
+    compactor = Compactor(running.journal, lambda: running.tree, running.path,
+                          threshold=3, interval=0.01)
+    compactor.start()
+    try:
+        _move(running, 6)
+    finally:
+        compactor.stop()
+        compactor.join()
+    _assert_same(_restart(running), running)
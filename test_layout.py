@@ -0,0 +1,96 @@
+import copy
+import pytest
+import inventory_documentation as documentation
+from layout import LayoutError, load_layout, compile_layout
+from snapshot import Snapshot, write_snapshot
+
+################################################################################
+# layout.json has to build the exact same store the old hand-chained nukes did
+# (every tree's rows, and the bijection), and compile_layout has to turn down a
+# broken spec before a single row gets split.
+################################################################################
+
+
+def _rows(atom) -> dict:
+    """Return every tree's path pointing to its product names, in order."""
+    result = {}
+
+    def walk(tree, path):
+        result[path] = list(tree._dataframe["Product Name"])
+        for i, subtree in enumerate(tree.subtrees):
+            walk(subtree, path + (i, subtree.coordinate))
+    walk(atom, ())
+    return result
+
+
+def test_matches_hand_chained_nukes(store, build_by_hand) -> None:
+    old = build_by_hand(store)
+    new = compile_layout(load_layout()).build(store)
+    assert _rows(new) == _rows(old)
+    assert new.bijection() == old.bijection()
+
+
+def test_cycle_moves_without_the_trees(store, tmp_path) -> None:
+    """A move in an inventory loaded from a snapshot (no trees, so it goes by
+    cycle_addresses) has to end up where the LinkedCycle sends it."""
+    built = documentation.UpdatedInventory(
+        compile_layout(load_layout()).build(store), storage={})
+    path = str(tmp_path / "storage.snap")
+    write_snapshot(path, built.tree)
+    loaded = documentation.UpdatedInventory(None, storage=Snapshot(path),
+                                            path=path)
+    assert loaded.atom is None
+    for front, back in sorted(built.cycles.items()):
+        room, x, y = front
+        items = built.tree[room][x][y][:3]
+        for inventory in [built, loaded]:
+            inventory.item_to_loc(items[0], back[0])
+            inventory.items_to_loc(items[1:], back[0])
+        assert all(built.product_map[item][0] == back[0] for item in items)
+        assert loaded.tree == built.tree
+        assert loaded.product_map == built.product_map
+        assert loaded.coordinate_map == built.coordinate_map
+
+
+def _broken(change) -> dict:
+    spec = copy.deepcopy(load_layout())
+    change(spec)
+    return spec
+
+
+@pytest.mark.parametrize("change, message", [
+    (lambda spec: spec.pop("splits"), "needs a splits"),
+    (lambda spec: spec["splits"].reverse(), "comes before"),
+    (lambda spec: spec["splits"].append(spec["splits"][1]), "twice"),
+    (lambda spec: spec["splits"][1].pop("stable"), "needs a stable"),
+    (lambda spec: spec["splits"][1].update(n=0), "positive int"),
+    (lambda spec: spec["splits"][1]["coordinates"].__setitem__(1, "Flower "
+                                                                  "3.5g"),
+     "unique coordinates"),
+    (lambda spec: spec["splits"][1]["columns"].pop(), "for every coordinate"),
+    (lambda spec: spec["splits"][0].update(n=3), "front/back"),
+    (lambda spec: spec["splits"][1]["find"][5].__setitem__(0, {"regex": "("}),
+     "broken regex"),
+    (lambda spec: spec["splits"][0].update(capacity=[1, 1]), "capacity"),
+    (lambda spec: spec["cycles"][0].update(front="9.9"), "isn't in"),
+    (lambda spec: spec.update(footprint="Footprint"), "footprint"),
+])
+def test_compile_rejects(change, message) -> None:
+    with pytest.raises(LayoutError, match=message):
+        compile_layout(_broken(change))
+
+
+def test_missing_columns(store) -> None:
+    with pytest.raises(LayoutError, match="Missing columns"):
+        compile_layout(load_layout()).build(store.drop(columns="Rank"))
+
+
+@pytest.mark.parametrize("processes", [None, 2])
+def test_rows_with_no_category(store, processes) -> None:
+    df = store.astype({"Category Code": "float64"})
+    df.loc[df.index[::97], "Category Code"] = None
+    with pytest.raises(LayoutError, match="no Category Code"):
+        compile_layout(load_layout()).build(df, processes=processes)
+    df = df.astype({"Category Code": "category"})
+    with pytest.raises(LayoutError, match="no Category Code"):
+        compile_layout(load_layout()).build(df, processes=processes)
@@ -0,0 +1,128 @@
+import pytest
+import pandas as pd
+import inventory_documentation as documentation
+from layout import load_layout, compile_layout
+from journal import MoveJournal, copy_tree
+from snapshot import Snapshot, write_snapshot
+
+################################################################################
+# A reload only touches the levels that changed, so the tree, both maps and the
+# search index have to come out just like they would have if every level had
+# been redone, and reloading the old CSV has to give back the exact inventory
+# it started as.
+################################################################################
+
+
+def _build(df: pd.DataFrame, **kwargs):
+    return documentation.UpdatedInventory(
+        compile_layout(load_layout()).build(df), storage={}, **kwargs)
+
+
+def _next_week(store: pd.DataFrame, make_frame) -> pd.DataFrame:
+    """Return store with some products gone, some new ones, and a new Rank for
+    some of the rest."""
+    df = store.drop(index=store.index[::7]).copy()
+    changed = df.index[::5]
+    df.loc[changed, "Rank"] = df.loc[changed, "Rank"][::-1].to_numpy()
+    return pd.concat([df, make_frame(300, seed=1, prefix="New ")],
+                     ignore_index=True)
+
+
+def _assert_in_sync(inventory, df: pd.DataFrame) -> None:
+    """The maps and the search index have to be what a full rebuild of the
+    maps out of the tree would make, with nothing that isn't in df. (Which
+    products make it onto a shelf can be different from a whole new build of
+    df, since a reload routes by the cuts of the first build.)"""
+    rebuilt = documentation.UpdatedInventory(None,
+                                             storage=copy_tree(inventory.tree))
+    assert inventory.coordinate_map == rebuilt.coordinate_map
+    assert inventory.product_map == rebuilt.product_map
+    assert set(inventory.product_map) <= set(df["Product Name"])
+    assert len(inventory.search_index) == len(inventory.product_map)
+    assert all(name in inventory.search_index
+               for name in inventory.product_map)
+    for room in inventory.tree:
+        for x in inventory.tree[room]:
+            for y in inventory.tree[room][x]:
+                products = inventory.tree[room][x][y]
+                assert products == sorted(products)
+
+
+def test_same_csv_changes_nothing(store) -> None:
+    inventory = _build(store)
+    tree = copy_tree(inventory.tree)
+    product_map = dict(inventory.product_map)
+    assert inventory.reload(store.copy()) == {"added": 0, "removed": 0,
+                                              "changed": 0, "unplaced": 0}
+    assert inventory.tree == tree
+    assert inventory.product_map == product_map
+
+
+def test_reload_and_back(store, make_frame) -> None:
+    inventory = _build(store)
+    tree = copy_tree(inventory.tree)
+    coordinate_map = dict(inventory.coordinate_map)
+    df = _next_week(store, make_frame)
+    counts = inventory.reload(df)
+    assert counts["added"] == 300
+    assert counts["removed"] == len(store.index[::7])
+    assert counts["changed"] > 0
+    _assert_in_sync(inventory, df)
+    gone = store["Product Name"].iloc[0]
+    assert gone not in inventory.search_index
+    new = [name for name in inventory.product_map if name.startswith("New ")]
+    assert len(new) > 100
+    assert all(inventory.fetch(name)[0] == name for name in new[::10])
+    # Every product that's back goes right where the first build put it
+    inventory.reload(store)
+    _assert_in_sync(inventory, store)
+    assert inventory.tree == tree
+    assert list(inventory.tree) == list(tree)
+    assert inventory.coordinate_map == coordinate_map
+
+
+def test_reload_without_trees(store, make_frame, tmp_path) -> None:
+    """Loaded from a snapshot there are no trees to route through, so the
+    reload is a whole new build, which has to be what building the new CSV
+    makes."""
+    path = str(tmp_path / "storage.snap")
+    write_snapshot(path, _build(store).tree)
+    inventory = documentation.UpdatedInventory(None, storage=Snapshot(path),
+                                               path=path)
+    df = _next_week(store, make_frame)
+    inventory.reload(df)
+    built = _build(df)
+    assert inventory.tree == built.tree
+    assert inventory.product_map == built.product_map
+    _assert_in_sync(inventory, df)
+
+
+@pytest.mark.parametrize("from_snapshot", [False, True])
+def test_restart_after_reload(store, make_frame, tmp_path,
+                              from_snapshot) -> None:
+    """A reload isn't in the journal, so it has to be in the snapshot, with the
+    moves from before it and after it on the right side of it."""
+    path = str(tmp_path / "storage.snap")
+    journal = MoveJournal(str(tmp_path / "moves.journal"), sync=False)
+    if from_snapshot:
+        write_snapshot(path, _build(store).tree)
+        inventory = documentation.UpdatedInventory(
+            None, journal=journal, storage=Snapshot(path), path=path)
+    else:
+        inventory = _build(store, journal=journal, path=path)
+    (room, x, y), back = sorted(inventory.cycles.items())[0]
+    inventory.item_to_loc(inventory.tree[room][x][y][0], back[0])
+    df = _next_week(store, make_frame)
+    inventory.reload(df)
+    assert journal.events() == []
+    inventory.items_to_loc(inventory.tree[room][x][y][:3], back[0])
+    journal.close()
+    restarted = documentation.UpdatedInventory(
+        None, journal=MoveJournal(journal.path, sync=False),
+        storage=Snapshot(path), path=path)
+    try:
+        assert restarted.tree == inventory.tree
+        assert restarted.product_map == inventory.product_map
+        assert restarted.coordinate_map == inventory.coordinate_map
+    finally:
+        restarted.journal.close()
@@ -0,0 +1,66 @@
+import random
+from rapidfuzz import process, fuzz
+from search_index import SearchIndex, SearchView
+
+################################################################################
+# SearchIndex has to give the exact same answer as process.extractOne over
+# every name, and the names and queries here repeat words on purpose, since
+# that's where token_set_ratio (which drops repeated words) can beat a bound
+# that counts every letter. Run with pytest, or just python.
+################################################################################
+
+WORDS = ["og", "OG", "Og!", "kush", "ab", "cd", "x", "3.5g", "7g", "Blue",
+         "blue", "dream", "pen", "gum", "a.b", "b"]
+
+
+def _name(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 7)))
+
+
+def _expected(query: str, names: list[str]) -> tuple[str, float]:
+    result = process.extractOne(query, names, scorer=fuzz.WRatio)
+    return result[0], result[1]
+
+
+def test_repeated_words() -> None:
+    index = SearchIndex(["ab", "ab ab ab"])
+    assert index.search("blue og kush cd og og x x") == ("ab ab ab", 57.0)
+    names = ["3.5g", "gum x pen pen ab", "kush x dream"]
+    expected = _expected("cd cd cd", names)
+    assert SearchIndex(names).search("cd cd cd") == expected
+    assert SearchIndex(names).search_many(["cd cd cd"]) == [expected]
+
+
+def test_matches_extract_one() -> None:
+    rng = random.Random(0)
+    for trial in range(500):
+        names = list(dict.fromkeys(_name(rng)
+                                   for _ in range(rng.randint(1, 12))))
+        queries = [_name(rng) for _ in range(4)]
+        # A tiny shortlist, so the bound does all the work
+        index = SearchIndex(names, shortlist=rng.randint(1, 3))
+        expected = [_expected(query, names) for query in queries]
+        assert [index.search(query) for query in queries] == expected
+        index.clear_cache()
+        assert index.search_many(queries) == expected
+
+
+def test_view_matches_extract_one() -> None:
+    rng = random.Random(1)
+    for trial in range(200):
+        names = list(dict.fromkeys(_name(rng)
+                                   for _ in range(rng.randint(2, 16))))
+        shared = SearchIndex(names)
+        view = SearchView(shared, names[::2])
+        view.shortlist = 1
+        for query in [_name(rng) for _ in range(4)]:
+            expected = _expected(query, names[::2])
+            assert view.search(query) == expected
+            assert view.search_many([query]) == [expected]
+
+
+if __name__ == "__main__":
+    test_repeated_words()
+    test_matches_extract_one()
+    test_view_matches_extract_one()
+    print("ok")
@@ -0,0 +1,93 @@
+import os
+import pytest
+import inventory_documentation as documentation
+from layout import load_layout, compile_layout
+from journal import MoveJournal
+from snapshot import Snapshot, SnapshotError, write_snapshot, \
+    check_round_trip
+
+################################################################################
+# A snapshot has to give back exactly the tree it was written from, and both
+# maps that the inventory built out of that tree, whether it's read whole or
+# looked up one thing at a time. An inventory started from one (with the moves
+# in the journal on top) has to be the same inventory that was saved.
+################################################################################
+
+
+@pytest.fixture
+def built(store):
+    return documentation.UpdatedInventory(
+        compile_layout(load_layout()).build(store), storage={})
+
+
+def test_round_trip(built, tmp_path) -> None:
+    path = str(tmp_path / "storage.snap")
+    write_snapshot(path, built.tree)
+    assert not os.path.exists(path + ".tmp")
+    check_round_trip(path, built.tree)
+    snapshot = Snapshot(path)
+    try:
+        assert snapshot.tree() == built.tree
+        assert list(snapshot.tree()) == list(built.tree)
+        assert snapshot.coordinate_map() == built.coordinate_map
+        assert snapshot.product_map() == built.product_map
+        for name in list(built.product_map)[::50]:
+            assert snapshot.location(name) == built.product_map[name]
+            coordinate = built.product_map[name]
+            assert snapshot.coordinate(coordinate) == name
+        assert snapshot.location("nothing by that name") is None
+        assert snapshot.coordinate("F.0.0.zzz") is None
+    finally:
+        snapshot.close()
+
+
+def test_restart(store, tmp_path) -> None:
+    """Save, move some things, and start over from the snapshot and the
+    journal."""
+    path = str(tmp_path / "storage.snap")
+    journal = MoveJournal(str(tmp_path / "moves.journal"), sync=False)
+    built = documentation.UpdatedInventory(
+        compile_layout(load_layout()).build(store), journal=journal,
+        storage={}, path=path)
+    write_snapshot(path, built.tree)
+    (room, x, y), back = sorted(built.cycles.items())[0]
+    items = built.tree[room][x][y][:4]
+    built.items_to_loc(items, back[0])
+    journal.close()
+    restarted = documentation.UpdatedInventory(
+        None, journal=MoveJournal(journal.path, sync=False),
+        storage=Snapshot(path), path=path)
+    assert restarted.tree == built.tree
+    assert restarted.product_map == built.product_map
+    assert restarted.coordinate_map == built.coordinate_map
+    assert all(restarted.fetch(item)[0] == item for item in items)
+    restarted.journal.close()
+
+
+def test_long_and_empty_levels(tmp_path) -> None:
+    """More than 26 products on a level (so the z's go on to aa, ab, ...),
+    and rooms and shelves with nothing on them (like the tree that
+    DataWindow.clear_all writes)."""
+    path = str(tmp_path / "storage.snap")
+    names = ["Product %03d" % i for i in range(60)]
+    tree = {"F": {"1": {"1": names, "2": []}, "2": []}, "B": {}}
+    write_snapshot(path, tree)
+    check_round_trip(path, tree)
+    snapshot = Snapshot(path)
+    try:
+        assert snapshot.location(names[26]) == "F.1.1.aa"
+        assert snapshot.coordinate("F.1.1.bh") == names[59]
+        assert snapshot.tree() == {"F": {"1": {"1": names, "2": []}, "2": {}},
+                                   "B": {}}
+    finally:
+        snapshot.close()
+
+
+def test_not_a_snapshot(tmp_path) -> None:
+    path = str(tmp_path / "storage.json")
+    with open(path, "w") as f:
+        f.write('{"F": {"1": {"1": ["Area 51 3.5g"]}}}')
+    with pytest.raises(SnapshotError):
+        Snapshot(path)
+    with pytest.raises(SnapshotError):
+        write_snapshot(path, {"F": {"1": ["Area 51 3.5g"]}})